@@ -16,17 +16,63 @@ Supported platforms:
 from __future__ import annotations
 
 import argparse
+import dataclasses
+import hashlib
+import json
+import os
 import platform as py_platform
-import shlex
+import re
 import shutil
 import subprocess
 import sys
 from pathlib import Path
 from typing import Any, Iterable
 
-from install_actions import ACTIONS
-from install_core import Context, platform_kind, run, shlex_join
-
+from install_core import (
+    NPM_PREAMBLE,
+    AnyOf,
+    Binary,
+    Context,
+    InstallPlan,
+    Module,
+    ModuleItems,
+    PackageEntry,
+    PipxItem,
+    SchemaError,
+    Step,
+    StepJournal,
+    StepsFailed,
+    action_config_keys,
+    action_registry,
+    binary_dest,
+    cache_dir,
+    cache_result,
+    cargo_home,
+    chown_home,
+    compile_modules,
+    dotnet_tool_installed,
+    file_matches_sha256,
+    go_bin_dir,
+    go_binary_name,
+    home_env,
+    installed_cargo_crates,
+    installed_rustup_components,
+    open_event_stream,
+    per_home_actions,
+    plan_hash,
+    platform_kind,
+    records_from_data,
+    reload_actions,
+    run,
+    run_bash,
+    run_many,
+    run_parallel,
+    run_steps,
+    set_event_stream,
+    shlex_join,
+    to_data,
+    tool_path,
+)
 
 # ------------------------------ Output Helpers ------------------------------
 
@@ -35,16 +81,6 @@ def error_print(*args: object) -> None:
     print(*args, file=sys.stderr)
 
 
-# ------------------------------ YAML Dependency ------------------------------
-
-try:
-    import yaml  # type: ignore
-except Exception:
-    error_print("Missing dependency: PyYAML.")
-    error_print("Install it with: python3 -m pip install --user pyyaml")
-    raise
-
-
 # ---------------------------- Command Execution -----------------------------
 
 
@@ -57,6 +93,18 @@ def load_yaml(path: Path) -> dict[str, Any]:
     Returns:
         A dictionary representing the YAML file contents.
     """
+    # Imported here: runs served from the compiled selection cache skip it.
+    try:
+        import yaml  # type: ignore
+    except Exception:
+        error_print("Missing dependency: PyYAML.")
+        error_print("Install it with: python3 -m pip install --user pyyaml")
+        error_print(
+            f"Or regenerate {compiled_deps_path(path).name} where PyYAML is "
+            "available: python3 setup/install.py compile"
+        )
+        raise
+
     with path.open("r", encoding="utf-8") as f:
         data = yaml.safe_load(f)
     if not isinstance(data, dict):
@@ -64,8 +112,158 @@ def load_yaml(path: Path) -> dict[str, Any]:
     return data
 
 
+# Bump when the layout of the compiled JSON form changes.
+COMPILED_DEPS_FORMAT = 2
+
+
+def compiled_deps_path(deps_path: Path) -> Path:
+    """Return the checked-in JSON form of a YAML file (`dependencies.json`)."""
+    return deps_path.with_suffix(".json")
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def read_compiled_deps(deps_path: Path) -> dict[str, Any] | None:
+    """Return the compiled payload of `deps_path` if it was built from its current bytes.
+
+    Returns:
+        The payload (`data` plus its reverse `index`), or None if the JSON form
+        is missing, malformed or stale (its recorded `source_sha256` differs
+        from the YAML's).
+    """
+    try:
+        with compiled_deps_path(deps_path).open("r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(payload, dict)
+        or payload.get("format") != COMPILED_DEPS_FORMAT
+        or payload.get("source_sha256") != file_sha256(deps_path)
+        or not isinstance(payload.get("data"), dict)
+    ):
+        return None
+    return payload
+
+
+def load_compiled_deps(deps_path: Path) -> dict[str, Any] | None:
+    payload = read_compiled_deps(deps_path)
+    return payload["data"] if payload is not None else None
+
+
+def load_dependencies(deps_path: Path) -> dict[str, Any]:
+    """Load `dependencies.yaml`, preferring its precompiled JSON form.
+
+    The JSON form is only trusted while its hash matches the YAML source, so a
+    forgotten regeneration costs a YAML parse, never a stale install. PyYAML
+    is therefore only needed on hosts editing `dependencies.yaml`.
+    """
+    data = load_compiled_deps(deps_path)
+    cache_result("compiled_deps", data is not None)
+    if data is not None:
+        return data
+    return load_yaml(deps_path)
+
+
+def render_compiled_deps(deps_path: Path) -> str:
+    data = load_yaml(deps_path)
+    payload = {
+        "format": COMPILED_DEPS_FORMAT,
+        "source": deps_path.name,
+        "source_sha256": file_sha256(deps_path),
+        "data": data,
+        "index": build_index(data),
+    }
+    return json.dumps(payload, indent=2, ensure_ascii=False) + "\n"
+
+
+# ------------------------------- Reverse Index -------------------------------
+
+
+# Index kind names of the selector-keyed item kinds (singular).
+INDEX_KINDS = {
+    "rustup_components": "rustup_component",
+    "dotnet_tools": "dotnet_tool",
+    "binaries": "binary",
+    "actions": "action",
+}
+
+
+def index_key(kind: str, name: str) -> str:
+    """Return the lookup name of an item (bare package/distribution name)."""
+    if kind in {"pip", "pipx"}:
+        name = re.split(r"[<>=!~\[; ]", name, 1)[0].replace("_", "-").lower()
+    elif kind == "npm" and name.rfind("@") > 0:
+        name = name[: name.rfind("@")]
+    elif kind == "go":
+        name = go_binary_name(name)
+    return name
+
+
+def build_index(data: dict[str, Any]) -> dict[str, Any]:
+    """Build the reverse index stored next to the compiled dependencies.
+
+    Returns:
+        A mapping with:
+          - `profiles`: profile -> fully resolved module list
+          - `module_profiles`: module -> profiles that include it
+          - `module_items`: module -> `[kind, selector, label]` rows, where
+            `kind` is a package manager, `cask`, `pip`, `pipx`, `npm`, `go`,
+            `cargo`, `rustup_component`, `dotnet_tool`, `binary` or `action`,
+            and `selector` is the platform selector (or null)
+          - `items`: lookup name -> `[module, kind, selector, label]` rows
+    """
+    profiles = data.get("profiles") or {}
+    modules, errors = compile_modules(data.get("modules") or {})
+    if errors:
+        raise SchemaError(errors)
+    index: dict[str, Any] = {
+        "profiles": {},
+        "module_profiles": {name: [] for name in modules},
+        "module_items": {},
+        "items": {},
+    }
+    for profile in profiles:
+        resolved = resolve_profile_modules(data, [profile])
+        index["profiles"][profile] = resolved
+        for module in resolved:
+            index["module_profiles"][module].append(profile)
+
+    for module_name, module in modules.items():
+        rows: list[list[Any]] = []
+        for manager, entries in module.packages:
+            for entry in entries:
+                if isinstance(entry, AnyOf):
+                    rows.extend([manager, None, o, entry.label] for o in entry.options)
+                else:
+                    rows.append([manager, None, entry, entry])
+        rows.extend(["cask", None, cask, cask] for cask in module.casks)
+        for key, selector, entries in module.selected:
+            kind = INDEX_KINDS.get(key, key)
+            for entry in entries:
+                name = entry if isinstance(entry, str) else entry.name
+                label = index_key(kind, name) if kind == "pipx" else name
+                rows.append([kind, selector, name, label])
+
+        seen: set[tuple[str, Any, str]] = set()
+        module_rows = index["module_items"][module_name] = []
+        for kind, selector, entry, label in rows:
+            name = index_key(kind, entry)
+            index["items"].setdefault(name, []).append(
+                [module_name, kind, selector, label]
+            )
+            if (kind, selector, label) not in seen:
+                seen.add((kind, selector, label))
+                module_rows.append([kind, selector, label])
+    return index
+
+
 # ---------------------------- Platform Detection ----------------------------
 
+PLATFORM_KEYS = ["macos", "ubuntu", "manjaro"]
+
 
 def read_os_release() -> dict[str, str]:
     """Read /etc/os-release and return its contents as a dictionary.
@@ -86,6 +284,35 @@ def read_os_release() -> dict[str, str]:
     return data
 
 
+def release_key() -> str | None:
+    """Return this host's distro release, e.g. `ubuntu-24.04` (None if unknown).
+
+    Rolling releases (Arch, Manjaro) have no `VERSION_ID` and are keyed by
+    their `ID` alone.
+    """
+    if py_platform.system() == "Darwin":
+        version = py_platform.mac_ver()[0]
+        return f"macos-{version.split('.')[0]}" if version else None
+    osr = read_os_release()
+    distro_id = osr.get("ID")
+    if not distro_id:
+        return None
+    version = osr.get("VERSION_ID")
+    return f"{distro_id}-{version}" if version else distro_id
+
+
+def release_platform(release: str) -> str | None:
+    """Return the platform key a `release_key` value belongs to (None if none)."""
+    distro_id = release.split("-", 1)[0]
+    if distro_id == "macos":
+        return "macos"
+    if distro_id in {"ubuntu", "debian"}:
+        return "ubuntu"
+    if distro_id in {"manjaro", "arch"}:
+        return "manjaro"
+    return None
+
+
 def detect_platform() -> str:
     """Detect the current platform and return a platform key.
 
@@ -172,36 +399,6 @@ def selector_keys(platform_key: str) -> list[str]:
     return keys
 
 
-def collect_selector_map(map_value: Any, *, platform_key: str) -> list[Any]:
-    """Collect items from a selector map based on platform key.
-
-    Args:
-        map_value: The selector map (dict) or list of items.
-        platform_key: The specific platform key (e.g., "ubuntu", "manjaro")
-
-    Returns:
-        A list of collected items.
-    """
-    if map_value is None:
-        return []
-
-    if isinstance(map_value, list):
-        return map_value
-
-    if not isinstance(map_value, dict):
-        raise TypeError(f"Expected list or mapping, got {type(map_value)}")
-
-    out: list[Any] = []
-    for k in selector_keys(platform_key):
-        v = map_value.get(k)
-        if v is None:
-            continue
-        if not isinstance(v, list):
-            raise TypeError(f"Expected list for selector {k!r}, got {type(v)}")
-        out.extend(v)
-    return out
-
-
 # ------------------------------ Install Context ------------------------------
 
 
@@ -245,45 +442,104 @@ def pkg_exists(ctx: Context, pkg_name: str) -> bool:
     return False
 
 
-def resolve_package_entries(ctx: Context, entries: list[Any]) -> list[str]:
+# Bump when the layout of `any_of.json` changes.
+ANY_OF_TABLE_FORMAT = 1
+
+
+def any_of_table_path(ctx: Context) -> Path:
+    return ctx.repo_root / "setup" / "any_of.json"
+
+
+def any_of_cache_path() -> Path:
+    """Return where this host records `any_of` choices the shipped table lacks."""
+    return cache_dir() / "any_of.json"
+
+
+def read_any_of_table(path: Path) -> dict[str, dict[str, str]]:
+    """Return `release -> {any_of label -> chosen package}` from `any_of.json`."""
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("format") != ANY_OF_TABLE_FORMAT:
+        return {}
+    releases = data.get("releases")
+    return releases if isinstance(releases, dict) else {}
+
+
+def write_any_of_table(path: Path, releases: dict[str, dict[str, str]]) -> None:
+    """Rewrite `any_of.json` (sorted, for reviewable diffs).
+
+    Best-effort: if `path` cannot be written, later runs just probe again.
+    """
+    data = {
+        "format": ANY_OF_TABLE_FORMAT,
+        "releases": {
+            release: dict(sorted(table.items()))
+            for release, table in sorted(releases.items())
+        },
+    }
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+        tmp.replace(path)
+    except OSError:
+        pass
+
+
+def resolve_package_entries(
+    ctx: Context, entries: list[PackageEntry], *, record: Path | None = None
+) -> list[str]:
     """Resolve package entries into concrete package names.
 
-    Supported entry forms:
-      - "pkg-name"
-      - {"any_of": ["candidate-a", "candidate-b", ...]}
+    `AnyOf` entries are useful for distro-specific renames (e.g. `clangd` vs
+    `clangd-10`); the first known package is chosen. Choices are looked up in
+    the shipped `any_of.json` table for this host's release (`release_key`),
+    so known releases never probe the package manager. Entries the table
+    does not know are probed, and the results are recorded in `record`.
 
-    The `any_of` form is useful for distro-specific renames (e.g. `clangd` vs
-    `clangd-10`); the first known package is chosen.
+    Args:
+        ctx: The install context.
+        entries: The package entries to resolve.
+        record: The table probed choices are written to. Defaults to the
+            per-host cache (`any_of_cache_path`), so installs never modify
+            the checkout; `install.py any-of` passes the shipped table.
     """
+    shipped = any_of_table_path(ctx)
+    record = record or any_of_cache_path()
+    releases: dict[str, dict[str, str]] = {}
+    known: dict[str, str] = {}
+    release = None
+    if any(isinstance(e, AnyOf) for e in entries):
+        releases = read_any_of_table(record)
+        release = release_key()
+        if release:
+            known = releases.get(release, {})
+            if record != shipped:
+                known = {**known, **read_any_of_table(shipped).get(release, {})}
+
     resolved: list[str] = []
+    learned: dict[str, str] = {}
     for entry in entries:
         if isinstance(entry, str):
             resolved.append(entry)
             continue
-        if isinstance(entry, dict) and "any_of" in entry:
-            options = entry["any_of"]
-            if not isinstance(options, list) or not all(
-                isinstance(x, str) for x in options
-            ):
-                raise TypeError("'any_of' must be a list of strings")
-
+        chosen = known.get(entry.label)
+        cache_result("any_of", chosen in entry.options)
+        if chosen not in entry.options:
             chosen = None
-            for opt in options:
-                if ctx.dry_run:
-                    chosen = opt
-                    break
-                if pkg_exists(ctx, opt):
-                    chosen = opt
-                    break
-
-            if chosen is None:
-                # Fall back to the first option to produce a useful failure
-                # message at install time.
-                chosen = options[0]
-            resolved.append(chosen)
-            continue
-
-        raise TypeError(f"Unsupported package entry: {entry!r}")
+            if not ctx.dry_run:
+                chosen = next((o for o in entry.options if pkg_exists(ctx, o)), None)
+            if chosen is not None:
+                learned[entry.label] = chosen
+        # Fall back to the first option to produce a useful failure message at
+        # install time.
+        resolved.append(chosen or entry.options[0])
+    if learned and release:
+        releases[release] = {**releases.get(release, {}), **learned}
+        write_any_of_table(record, releases)
     return uniq_keep_order(resolved)
 
 
@@ -298,10 +554,26 @@ def install_system_packages(
     - `brew`: installs formulae and optional `--cask` apps.
     - `apt`: optionally runs `apt-get update`, then installs packages.
     - `pacman`: uses `-Syu --needed` to update/upgrade and install.
+
+    With an offline bundle, apt/pacman install its downloaded archives
+    directly and brew installs from the bundled cache (`HOMEBREW_CACHE`).
     """
     if not packages and not casks:
         return
 
+    if ctx.offline and ctx.manager in {"apt", "pacman"}:
+        archives = ctx.offline / "packages" / ctx.manager
+        pattern = "*.deb" if ctx.manager == "apt" else "*.pkg.tar.*"
+        files = [str(p) for p in sorted(archives.glob(pattern)) if p.suffix != ".sig"]
+        if ctx.manager == "apt":
+            cmd = ["sudo", "apt-get", "install", "--no-download"]
+        else:
+            cmd = ["sudo", "pacman", "-U", "--needed"]
+        if ctx.yes:
+            cmd.append("-y" if ctx.manager == "apt" else "--noconfirm")
+        run([*cmd, *files], dry_run=ctx.dry_run)
+        return
+
     if ctx.manager == "apt":
         if ctx.do_update:
             run(["sudo", "apt-get", "update"], dry_run=ctx.dry_run)
@@ -339,37 +611,27 @@ def install_pip_packages(ctx: Context, packages: list[str]) -> None:
     """Install Python packages into the user site-packages via `pip`."""
     if not packages:
         return
-    run(["python3", "-m", "pip", "install", "--user", *packages], dry_run=ctx.dry_run)
-
+    cmd = ["python3", "-m", "pip", "install", "--user"]
+    if ctx.offline:
+        cmd += ["--no-index", "--find-links", str(ctx.offline / "pip")]
+    run([*cmd, *packages], dry_run=ctx.dry_run, env=home_env(ctx))
 
-def install_pipx_packages(ctx: Context, items: list[Any]) -> None:
-    """Install applications via `pipx`.
 
-    Supported entry forms:
-      - "package-name"
-      - {"name": "package-name", "python": "python3.12"}
-    """
+def install_pipx_packages(ctx: Context, items: list[PipxItem]) -> None:
+    """Install applications via `pipx`."""
     if not items:
         return
     pipx_cmd = shutil.which("pipx")
     if pipx_cmd is None and not ctx.dry_run:
         raise RuntimeError("pipx not found; install it via your system packages first.")
+    offline = []
+    if ctx.offline:
+        offline = [f"--pip-args=--no-index --find-links={ctx.offline / 'pipx'}"]
     for item in items:
-        if isinstance(item, str):
-            cmd = ["pipx", "install", item]
-            run(cmd, dry_run=ctx.dry_run)
-            continue
-        if isinstance(item, dict):
-            name = item.get("name")
-            if not isinstance(name, str) or not name:
-                raise TypeError(f"Invalid pipx item: {item!r}")
-            cmd = ["pipx", "install", name]
-            python = item.get("python")
-            if isinstance(python, str) and python:
-                cmd.extend(["--python", python])
-            run(cmd, dry_run=ctx.dry_run)
-            continue
-        raise TypeError(f"Unsupported pipx entry: {item!r}")
+        cmd = ["pipx", "install", *offline, item.name]
+        if item.python:
+            cmd.extend(["--python", item.python])
+        run(cmd, dry_run=ctx.dry_run, env=home_env(ctx))
 
 
 def install_npm_packages(ctx: Context, packages: list[str]) -> None:
@@ -381,20 +643,89 @@ def install_npm_packages(ctx: Context, packages: list[str]) -> None:
     if not packages:
         return
 
-    pkgs = " ".join(shlex.quote(p) for p in packages)
-    script = f"""
-        set -e
-        if ! command -v npm >/dev/null 2>&1; then
-          export NVM_DIR="$HOME/.nvm"
-          [ -s "$NVM_DIR/nvm.sh" ] && . "$NVM_DIR/nvm.sh"
-        fi
-        if ! command -v npm >/dev/null 2>&1; then
-          echo "npm not found. Install Node.js first (e.g. include the languages-node module)." >&2
-          exit 1
-        fi
-        npm i -g {pkgs}
-    """
-    run_bash(script, dry_run=ctx.dry_run)
+    cmd = ["npm", "i", "-g"]
+    if ctx.offline:
+        cmd += ["--offline", "--cache", str(ctx.offline / "npm-cache")]
+    run_bash(
+        NPM_PREAMBLE + shlex_join([*cmd, *packages]),
+        dry_run=ctx.dry_run,
+        env=home_env(ctx),
+    )
+
+
+# ---------------------------- Language Ecosystems ----------------------------
+#
+# Items within each ecosystem are installed concurrently where the tool allows
+# it, and already-installed items are skipped without invoking the tool. Each
+# tool installs into `ctx`'s home (see `home_env`).
+
+
+def install_go_packages(ctx: Context, packages: list[str]) -> None:
+    """`go install` each package whose binary is not in GOBIN yet."""
+    gobin = go_bin_dir(ctx)
+    missing = [p for p in packages if not (gobin / go_binary_name(p)).exists()]
+    run_many(
+        [["go", "install", p] for p in missing],
+        dry_run=ctx.dry_run,
+        env=home_env(ctx),
+    )
+
+
+def install_cargo_crates(ctx: Context, crates: list[str]) -> None:
+    installed = installed_cargo_crates(ctx)
+    cargo = tool_path("cargo", cargo_home(ctx) / "bin")
+    missing = [c for c in crates if c not in installed]
+    run_many(
+        [[cargo, "install", "--locked", c] for c in missing],
+        dry_run=ctx.dry_run,
+        env=home_env(ctx),
+    )
+
+
+def install_rustup_components(ctx: Context, components: list[str]) -> None:
+    installed = installed_rustup_components(ctx) or set()
+    missing = [c for c in components if c not in installed]
+    if missing:
+        rustup = tool_path("rustup", cargo_home(ctx) / "bin")
+        run(
+            [rustup, "component", "add", *missing],
+            dry_run=ctx.dry_run,
+            env=home_env(ctx),
+        )
+
+
+def install_dotnet_tools(ctx: Context, tools: list[str]) -> None:
+    missing = [t for t in tools if not dotnet_tool_installed(ctx, t)]
+    run_many(
+        [["dotnet", "tool", "install", "--global", t] for t in missing],
+        dry_run=ctx.dry_run,
+        env=home_env(ctx),
+    )
+
+
+def install_binary(ctx: Context, binary: Binary) -> None:
+    """Download a pinned binary, verify its sha256 and install it executable."""
+    dest = binary_dest(ctx, binary)
+    if file_matches_sha256(dest, binary.sha256):
+        return
+    tmp = dest.with_name(f".{dest.name}.download")
+    if not ctx.dry_run:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+    run(["curl", "-fsSL", "-o", str(tmp), binary.url], dry_run=ctx.dry_run)
+    if ctx.dry_run:
+        return
+    if not file_matches_sha256(tmp, binary.sha256):
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"sha256 mismatch for {binary.name} ({binary.url})")
+    tmp.chmod(0o755)
+    tmp.replace(dest)
+
+
+def install_binaries(ctx: Context, binaries: list[Binary]) -> None:
+    run_parallel(
+        [lambda b=b: install_binary(ctx, b) for b in binaries],
+        jobs=1 if ctx.dry_run else 4,
+    )
 
 
 # --------------------------- Profile/Module Resolve --------------------------
@@ -433,28 +764,403 @@ def resolve_profile_modules(data: dict[str, Any], names: list[str]) -> list[str]
     return uniq_keep_order(resolved)
 
 
-# ----------------------------------- CLI -----------------------------------
+def collect_module_items(
+    ctx: Context, modules: dict[str, Any], module_names: list[str]
+) -> list[ModuleItems]:
+    """Compile the modules and select their items for the current platform.
 
+    Args:
+        ctx: The installation context.
+        modules: The `modules` mapping from dependencies.yaml.
+        module_names: Resolved module names, in install order.
 
-def main(argv: list[str]) -> int:
-    parser = argparse.ArgumentParser(
-        description="Install dependencies from setup/dependencies.yaml",
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog=(
-            "Examples:\n"
-            "  # Install the default profile for this machine\n"
-            "  python3 setup/install.py --profile default\n"
-            "\n"
-            "  # Show what would be executed\n"
-            "  python3 setup/install.py --dry-run\n"
-            "\n"
-            "  # Add a module in addition to the profile\n"
-            "  python3 setup/install.py --profile default --module clangd\n"
+    Returns:
+        One `ModuleItems` per module, in the same order as `module_names`.
+
+    Raises:
+        SchemaError: Listing every schema error in `modules`.
+    """
+    compiled, errors = compile_modules(modules)
+    if errors:
+        raise SchemaError(errors)
+    selectors = selector_keys(ctx.platform_key)
+    return [compiled[name].select(ctx.manager, selectors) for name in module_names]
+
+
+# -------------------------------- Plan/Steps --------------------------------
+
+
+def merge_plan(items: list[ModuleItems], packages: list[str]) -> InstallPlan:
+    """Merge and deduplicate the selected modules' items into one plan.
+
+    Args:
+        items: Per-module items, in install order.
+        packages: The already-resolved system package names.
+    """
+    return InstallPlan(
+        packages=packages,
+        casks=uniq_keep_order(c for m in items for c in m.casks),
+        pip=uniq_keep_order(p for m in items for p in m.pip),
+        pipx=[p for m in items for p in m.pipx],
+        npm=uniq_keep_order(p for m in items for p in m.npm),
+        go=uniq_keep_order(p for m in items for p in m.go),
+        cargo=uniq_keep_order(p for m in items for p in m.cargo),
+        rustup_components=uniq_keep_order(
+            c for m in items for c in m.rustup_components
         ),
+        dotnet_tools=uniq_keep_order(t for m in items for t in m.dotnet_tools),
+        binaries=list({b.name: b for m in items for b in m.binaries}.values()),
+        actions=uniq_keep_order(a for m in items for a in m.actions),
     )
+
+
+def check_actions(plan: InstallPlan) -> None:
+    """Raise if the plan names an action no action module registers."""
+    if plan.actions:
+        registry = action_registry()
+        for action in plan.actions:
+            if action not in registry:
+                raise RuntimeError(f"Unknown action: {action}")
+
+
+def resolve_plan(ctx: Context, items: list[ModuleItems]) -> InstallPlan:
+    """Resolve `any_of` packages for this host and merge the items into a plan."""
+    plan = merge_plan(
+        items, resolve_package_entries(ctx, [e for m in items for e in m.packages])
+    )
+    check_actions(plan)
+    return plan
+
+
+# Actions that read files the `dotfiles` action deploys (shell rc files, the
+# tmux link, nvim's lazy-lock.json), so they run after it.
+DOTFILES_READERS = {"nvim_plugins", "shell_env", "tmux_config"}
+
+
+def build_steps(
+    ctx: Context,
+    items: list[ModuleItems],
+    plan: InstallPlan,
+    config: dict[str, Any],
+) -> list[Step]:
+    """Turn a resolved plan into installer steps with their dependencies."""
+
+    def owners(pick: Any) -> list[str]:
+        return [m.name for m in items if pick(m)]
+
+    steps: list[Step] = []
+    if plan.packages or plan.casks:
+        steps.append(
+            Step(
+                "packages",
+                owners(lambda m: m.packages or m.casks),
+                lambda: install_system_packages(ctx, plan.packages, casks=plan.casks),
+                inputs={
+                    "manager": ctx.manager,
+                    "packages": plan.packages,
+                    "casks": plan.casks,
+                },
+            )
+        )
+    if plan.pip:
+        steps.append(
+            Step(
+                "pip",
+                owners(lambda m: m.pip),
+                lambda: install_pip_packages(ctx, plan.pip),
+                after=["packages"],
+                inputs=plan.pip,
+            )
+        )
+    if plan.pipx:
+        steps.append(
+            Step(
+                "pipx",
+                owners(lambda m: m.pipx),
+                lambda: install_pipx_packages(ctx, plan.pipx),
+                after=["packages"],
+                inputs=plan.pipx,
+            )
+        )
+    for action in plan.actions:
+        fn = action_registry()[action]
+        after = ["packages"]
+        if action in DOTFILES_READERS:
+            after.append("action:dotfiles")
+        steps.append(
+            Step(
+                f"action:{action}",
+                owners(lambda m, a=action: a in m.actions),
+                lambda fn=fn: fn(ctx, config),
+                after=after,
+                inputs=config,
+            )
+        )
+    if plan.npm:
+        steps.append(
+            Step(
+                "npm",
+                owners(lambda m: m.npm),
+                lambda: install_npm_packages(ctx, plan.npm),
+                # npm comes from nvm when the languages-node module is selected.
+                after=["packages", "action:nvm_node"],
+                inputs=plan.npm,
+            )
+        )
+    # Each ecosystem is its own step, so `--jobs` installs them side by side.
+    ecosystems: list[tuple[str, list[Any], Any, list[str]]] = [
+        ("go", plan.go, install_go_packages, ["packages"]),
+        ("cargo", plan.cargo, install_cargo_crates, ["action:rustup_toolchains"]),
+        (
+            "rustup_components",
+            plan.rustup_components,
+            install_rustup_components,
+            ["action:rustup_toolchains"],
+        ),
+        ("dotnet_tools", plan.dotnet_tools, install_dotnet_tools, ["packages"]),
+        ("binaries", plan.binaries, install_binaries, ["packages"]),
+    ]
+    for kind, entries, fn, after in ecosystems:
+        if entries:
+            steps.append(
+                Step(
+                    kind,
+                    owners(lambda m, k=kind: getattr(m, k)),
+                    lambda fn=fn, entries=entries: fn(ctx, entries),
+                    after=uniq_keep_order(["packages", *after]),
+                    inputs=entries,
+                )
+            )
+    return steps
+
+
+# Plan fields installed into a home directory rather than system-wide.
+HOME_PLAN_FIELDS = (
+    "pip",
+    "pipx",
+    "npm",
+    "go",
+    "cargo",
+    "rustup_components",
+    "dotnet_tools",
+    "binaries",
+)
+
+
+def build_home_steps(
+    ctx: Context,
+    items: list[ModuleItems],
+    plan: InstallPlan,
+    config: dict[str, Any],
+    homes: list[Path],
+) -> list[Step]:
+    """Build the steps that provision several home directories on one host.
+
+    System packages and host-level actions (e.g. `docker_enable`) run once.
+    Everything else is built per home, with a `Context` whose `home` is that
+    directory, and named `<home>:<step>`. The first home runs each step
+    before the other homes run theirs, so shared caches (git mirrors, the
+    toolchain store, downloads) are filled once and then reused; the other
+    homes then proceed concurrently under `--jobs`.
+    """
+    per_home = per_home_actions()
+    host_plan = dataclasses.replace(
+        plan,
+        actions=[a for a in plan.actions if a not in per_home],
+        **{name: [] for name in HOME_PLAN_FIELDS},
+    )
+    home_plan = dataclasses.replace(
+        plan,
+        packages=[],
+        casks=[],
+        actions=[a for a in plan.actions if a in per_home],
+    )
+    steps = build_steps(ctx, items, host_plan, config)
+    host_names = {s.name for s in steps}
+
+    first: Path | None = None
+    for home in homes:
+        home_ctx = dataclasses.replace(ctx, home=home)
+        own = build_steps(home_ctx, items, home_plan, config)
+        names = {s.name for s in own}
+
+        def qualify(name: str, home: Path = home) -> str:
+            return name if name in host_names else f"{home}:{name}"
+
+        for step in own:
+            after = [qualify(a) for a in step.after if a in host_names | names]
+            if first is not None:
+                after.append(f"{first}:{step.name}")
+            steps.append(
+                Step(
+                    qualify(step.name),
+                    step.modules,
+                    step.fn,
+                    after=after,
+                    inputs=step.inputs,
+                )
+            )
+        steps.append(
+            Step(
+                f"{home}:chown",
+                [],
+                lambda home_ctx=home_ctx: chown_home(home_ctx),
+                after=[f"{home}:{s.name}" for s in own],
+                inputs=str(home),
+            )
+        )
+        first = first or home
+    return steps
+
+
+def execute_steps(ctx: Context, steps: list[Step], args: argparse.Namespace) -> None:
+    """Run steps with the journal/concurrency/event options from `args`."""
+    if args.events:
+        set_event_stream(open_event_stream(args.events))
+    journal = None
+    if not ctx.dry_run:
+        journal_path = (
+            cache_dir() / "journal" / f"{plan_hash(ctx.platform_key, steps)}.jsonl"
+        )
+        journal = StepJournal(journal_path, resume=bool(args.resume))
+        if journal.completed:
+            print(f"Resuming: {len(journal.completed)} step(s) already completed")
+    run_steps(steps, jobs=args.jobs, journal=journal, keep_going=bool(args.keep_going))
+
+
+# ----------------------------- Resolution Matrix -----------------------------
+#
+# `install.py matrix` resolves every profile on every platform in one pass:
+# the dependencies are loaded once, each profile's module list is resolved
+# once (it does not depend on the platform), and each module's items are
+# collected once per platform and shared by every profile that includes it.
+
+
+def lint_selectors(modules: Iterable[Module]) -> list[str]:
+    """Return problems with keys that no platform ever selects (e.g. typos)."""
+    selectors = {"all", "linux", *PLATFORM_KEYS, *map(platform_kind, PLATFORM_KEYS)}
+    managers = {manager_for_platform(p) for p in PLATFORM_KEYS}
+    problems = []
+    for module in modules:
+        keys = [("packages", k) for k, _ in module.packages]
+        keys += [(kind, k) for kind, k, _ in module.selected]
+        for kind, key in keys:
+            if key not in (managers if kind == "packages" else selectors):
+                problems.append(f"module {module.name}: {kind}.{key} is never selected")
+    return problems
+
+
+def resolve_matrix(
+    data: dict[str, Any],
+    platforms: list[str],
+    profiles: list[str],
+    any_of: dict[str, dict[str, str]] | None = None,
+) -> dict[str, Any]:
+    """Resolve each profile on each platform and collect unresolvable entries.
+
+    Args:
+        data: The parsed dependencies.yaml.
+        platforms: The platform keys to resolve on.
+        profiles: The profiles to resolve.
+        any_of: The shipped `any_of.json` releases. Each `any_of` package
+            must have a valid choice for every release of the platform.
+
+    Returns:
+        A mapping with `problems` (schema errors and selector typos) and
+        `combinations`: one entry per platform/profile pair with its
+        `modules`, `plan` and `problems`. `any_of` packages are listed as
+        `a | b`, since choosing one needs the target's package index.
+    """
+    compiled, schema_errors = compile_modules(data.get("modules") or {})
+    registry = action_registry()
+    any_of = any_of or {}
+
+    resolved: dict[str, list[str] | str] = {}
+    for profile in profiles:
+        try:
+            resolved[profile] = resolve_profile_modules(data, [profile])
+        except ValueError as e:
+            resolved[profile] = str(e)
+
+    combinations = []
+    for platform_key in platforms:
+        manager = manager_for_platform(platform_key)
+        selectors = selector_keys(platform_key)
+        releases = sorted(r for r in any_of if release_platform(r) == platform_key)
+        collected: dict[str, ModuleItems] = {}
+        for profile in profiles:
+            module_names = resolved[profile]
+            combo: dict[str, Any] = {"platform": platform_key, "profile": profile}
+            combinations.append(combo)
+            if isinstance(module_names, str):
+                combo.update(modules=[], plan=None, problems=[module_names])
+                continue
+
+            problems = []
+            items = []
+            for name in module_names:
+                if name not in compiled:
+                    problems.append(f"module {name}: invalid (see schema errors)")
+                    continue
+                if name not in collected:
+                    collected[name] = compiled[name].select(manager, selectors)
+                items.append(collected[name])
+                problems.extend(
+                    f"module {name}: unknown action {a!r}"
+                    for a in collected[name].actions
+                    if a not in registry
+                )
+
+            packages = uniq_keep_order(
+                e if isinstance(e, str) else e.label for m in items for e in m.packages
+            )
+            entries = {
+                e.label: e for m in items for e in m.packages if isinstance(e, AnyOf)
+            }
+            problems.extend(
+                f"any_of {label}: no valid choice recorded for {release}"
+                for label, entry in entries.items()
+                for release in releases
+                if any_of[release].get(label) not in entry.options
+            )
+            combo.update(
+                modules=module_names,
+                plan=to_data(merge_plan(items, packages)),
+                problems=problems,
+            )
+    problems = schema_errors + lint_selectors(compiled.values())
+    return {"problems": problems, "combinations": combinations}
+
+
+def print_matrix(matrix: dict[str, Any]) -> None:
+    """Print each combination's plan (grouped per kind) and its problems."""
+    for problem in matrix["problems"]:
+        print(f"! {problem}")
+    for combo in matrix["combinations"]:
+        print(f"== {combo['platform']} / {combo['profile']}")
+        for problem in combo["problems"]:
+            print(f"! {problem}")
+        if combo["plan"] is None:
+            continue
+        print(f"modules ({len(combo['modules'])})")
+        print("  " + " ".join(combo["modules"]))
+        for kind, entries in combo["plan"].items():
+            if not entries:
+                continue
+            print(f"{kind} ({len(entries)})")
+            for entry in entries:
+                if isinstance(entry, dict):
+                    entry = entry.get("name") or json.dumps(entry, sort_keys=True)
+                print(f"  {entry}")
+
+
+# ----------------------------------- CLI -----------------------------------
+
+
+def add_selection_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "--platform",
-        choices=["macos", "ubuntu", "manjaro"],
+        choices=PLATFORM_KEYS,
         help="Override platform detection (otherwise auto-detected)",
     )
     parser.add_argument(
@@ -468,125 +1174,753 @@ def main(argv: list[str]) -> int:
         default=[],
         help="Extra module(s) to include (repeatable)",
     )
+    parser.add_argument(
+        "--no-update",
+        action="store_true",
+        help="Skip package DB updates (brew/apt only)",
+    )
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "--dry-run", action="store_true", help="Print commands without running them"
     )
     parser.add_argument(
-        "--yes",
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Run up to N independent steps concurrently with buffered, prefixed "
+            "output (child stdin is closed, so combine with --yes)"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
         action="store_true",
-        help="Auto-confirm package manager prompts where supported (apt/pacman)",
+        help="Skip steps a previous, interrupted run of the same plan completed",
     )
     parser.add_argument(
-        "--no-update",
+        "--keep-going",
         action="store_true",
-        help="Skip package DB updates (brew/apt only)",
+        help="On failure, skip only dependent steps and continue with the rest",
     )
-    args = parser.parse_args(argv)
+    parser.add_argument(
+        "--events",
+        metavar="fd:N|FILE",
+        help=(
+            "Write NDJSON progress events (plan/step/start/finish/output) to an "
+            "inherited file descriptor (e.g. fd:3) or append them to FILE"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        type=Path,
+        metavar="FILE",
+        help=(
+            "After each run, update FILE (e.g. in node-exporter's textfile "
+            "directory) with Prometheus step, cache and duration metrics"
+        ),
+    )
+
+
+def start_metrics(args: argparse.Namespace) -> None:
+    """Register the Prometheus textfile exporter if `--metrics-textfile` is set.
+
+    Dry runs are not recorded: they would count steps that never ran.
+    """
+    if args.metrics_textfile is None or args.dry_run:
+        return
+    from install_metrics import PrometheusTextfile
 
+    PrometheusTextfile(args.metrics_textfile.resolve()).install()
+
+
+def add_yes_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Auto-confirm package manager prompts where supported (apt/pacman)",
+    )
+
+
+# Bump when the layout of cached selections changes.
+SELECTION_CACHE_FORMAT = 2
+
+
+def selection_cache_path(deps_path: Path, platform_key: str, names: list[str]) -> Path:
+    """Return the compiled-selection cache file for this YAML revision and selection."""
+    st = deps_path.stat()
+    key = json.dumps(
+        [
+            SELECTION_CACHE_FORMAT,
+            str(deps_path),
+            st.st_mtime_ns,
+            st.st_size,
+            platform_key,
+            names,
+        ]
+    )
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return cache_dir() / "selections" / f"{digest}.json"
+
+
+def read_selection_cache(
+    path: Path,
+) -> tuple[list[ModuleItems], dict[str, Any]] | None:
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = [records_from_data(ModuleItems, m) for m in data["items"]]
+        return items, data["config"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_selection_cache(
+    path: Path, items: list[ModuleItems], config: dict[str, Any]
+) -> None:
+    """Best-effort atomic write; a failure only costs the next run a YAML parse."""
+    payload = {"items": to_data(items), "config": config}
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(payload, f, default=str)
+        tmp.replace(path)
+    except (OSError, TypeError, ValueError):
+        tmp.unlink(missing_ok=True)
+
+
+def selection_context(args: argparse.Namespace, *, yes: bool) -> Context:
+    """Build the installation context for the selection arguments."""
     platform_key = args.platform or detect_platform()
-    manager = manager_for_platform(platform_key)
+    return Context(
+        platform_key=platform_key,
+        manager=manager_for_platform(platform_key),
+        repo_root=Path(__file__).resolve().parents[1],
+        dry_run=bool(args.dry_run),
+        yes=yes,
+        do_update=not args.no_update,
+    )
 
-    repo_root = Path(__file__).resolve().parents[1]
-    deps_path = repo_root / "setup" / "dependencies.yaml"
-    data = load_yaml(deps_path)
 
-    module_names = resolve_profile_modules(data, [args.profile, *args.module])
+def load_selection(
+    args: argparse.Namespace, *, yes: bool
+) -> tuple[Context, list[ModuleItems], dict[str, Any]]:
+    """Build the context and per-module items selected by the CLI arguments.
+
+    The validated items are cached per YAML revision and selection, so only
+    the first run after `dependencies.yaml` changes imports and parses YAML.
+    """
+    ctx = selection_context(args, yes=yes)
+    deps_path = ctx.repo_root / "setup" / "dependencies.yaml"
+
+    names = [args.profile, *args.module]
+    cache_path = selection_cache_path(deps_path, ctx.platform_key, names)
+    cached = read_selection_cache(cache_path)
+    cache_result("selection", cached is not None)
+    if cached is not None:
+        return (ctx, *cached)
+
+    data = load_dependencies(deps_path)
+    module_names = resolve_profile_modules(data, names)
     config = data.get("config") or {}
     if not isinstance(config, dict):
         config = {}
 
+    modules = data.get("modules") or {}
+    if not isinstance(modules, dict):
+        raise ValueError("Invalid modules in dependencies.yaml")
+
+    items = collect_module_items(ctx, modules, module_names)
+    write_selection_cache(cache_path, items, config)
+    return ctx, items, config
+
+
+def bundle_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py bundle",
+        description=(
+            "Download everything the selected profile needs into a single "
+            "offline bundle (build it on a host of the target platform)"
+        ),
+    )
+    add_selection_arguments(parser)
+    add_run_arguments(parser)
+    parser.add_argument(
+        "--out",
+        type=Path,
+        required=True,
+        help="Bundle path; a .zst suffix compresses it with zstd",
+    )
+    args = parser.parse_args(argv)
+    start_metrics(args)
+
+    from install_bundle import bundle_steps, require_zstd, write_archive, write_plan
+
+    require_zstd(args.out)
+    ctx, items, config = load_selection(args, yes=True)
+    if not ctx.dry_run and ctx.platform_key != detect_platform():
+        raise RuntimeError(
+            f"A {ctx.platform_key} bundle must be built on a {ctx.platform_key} host"
+        )
+    plan = resolve_plan(ctx, items)
+
+    staging = cache_dir() / "bundle-staging" / args.out.name
+    shutil.rmtree(staging, ignore_errors=True)
+    root = staging / "bundle"
+    write_plan(ctx, items, plan, config, root)
+    execute_steps(ctx, bundle_steps(ctx, items, plan, config, root), args)
+    write_archive(root, args.out.resolve(), dry_run=ctx.dry_run)
+    shutil.rmtree(staging, ignore_errors=True)
+    if not ctx.dry_run:
+        print(f"Wrote {args.out} ({args.out.stat().st_size // (1 << 20)} MiB)")
+    return 0
+
+
+def apply_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py apply",
+        description="Install the plan stored in an offline bundle, without network",
+    )
+    parser.add_argument("--bundle", type=Path, required=True, help="Bundle path")
+    add_yes_argument(parser)
+    add_run_arguments(parser)
+    args = parser.parse_args(argv)
+    start_metrics(args)
+
+    from install_bundle import (
+        extract_bundle,
+        load_bundle_plan,
+        offline_config,
+        offline_environ,
+    )
+
+    root = extract_bundle(args.bundle.resolve())
+    platform_key, items, plan, config = load_bundle_plan(root)
+    if platform_key != detect_platform():
+        raise RuntimeError(f"Bundle targets {platform_key}, not this host")
     ctx = Context(
         platform_key=platform_key,
-        manager=manager,
-        repo_root=repo_root,
+        manager=manager_for_platform(platform_key),
+        repo_root=Path(__file__).resolve().parents[1],
         dry_run=bool(args.dry_run),
         yes=bool(args.yes),
-        do_update=not args.no_update,
+        do_update=False,
+        offline=root,
+    )
+    os.environ.update(offline_environ(root))
+    execute_steps(
+        ctx, build_steps(ctx, items, plan, offline_config(config, root)), args
     )
+    return 0
 
-    modules = data.get("modules") or {}
-    if not isinstance(modules, dict):
-        raise ValueError("Invalid modules in dependencies.yaml")
 
-    pkg_entries: list[Any] = []
-    casks: list[str] = []
-    pip_pkgs: list[str] = []
-    pipx_items: list[Any] = []
-    npm_pkgs: list[str] = []
-    actions: list[str] = []
-
-    for module_name in module_names:
-        module = modules[module_name]
-        if not isinstance(module, dict):
-            raise ValueError(f"Invalid module: {module_name}")
-
-        packages = module.get("packages") or {}
-        if packages is not None:
-            if not isinstance(packages, dict):
-                raise TypeError(f"module {module_name}: packages must be a mapping")
-            manager_entries = packages.get(ctx.manager) or []
-            if not isinstance(manager_entries, list):
-                raise TypeError(
-                    f"module {module_name}: packages[{ctx.manager}] must be a list"
-                )
-            pkg_entries.extend(manager_entries)
-
-        cask_map = module.get("casks") or {}
-        if cask_map:
-            if not isinstance(cask_map, dict):
-                raise TypeError(f"module {module_name}: casks must be a mapping")
-            if ctx.manager == "brew":
-                brew_casks = cask_map.get("brew") or []
-                if not isinstance(brew_casks, list) or not all(
-                    isinstance(x, str) for x in brew_casks
-                ):
-                    raise TypeError(
-                        f"module {module_name}: casks.brew must be a list of strings"
-                    )
-                casks.extend(brew_casks)
-
-        pip_map = module.get("pip")
-        pip_items = collect_selector_map(pip_map, platform_key=ctx.platform_key)
-        if pip_items:
-            if not all(isinstance(x, str) for x in pip_items):
-                raise TypeError(f"module {module_name}: pip entries must be strings")
-            pip_pkgs.extend(pip_items)
-
-        pipx_map = module.get("pipx")
-        pipx_items.extend(collect_selector_map(pipx_map, platform_key=ctx.platform_key))
-
-        npm_map = module.get("npm")
-        npm_items = collect_selector_map(npm_map, platform_key=ctx.platform_key)
-        if npm_items:
-            if not all(isinstance(x, str) for x in npm_items):
-                raise TypeError(f"module {module_name}: npm entries must be strings")
-            npm_pkgs.extend(npm_items)
-
-        action_map = module.get("actions")
-        action_items = collect_selector_map(action_map, platform_key=ctx.platform_key)
-        for a in action_items:
-            if not isinstance(a, str):
-                raise TypeError(f"module {module_name}: action entries must be strings")
-            actions.append(a)
-
-    packages = resolve_package_entries(ctx, pkg_entries)
-    casks = uniq_keep_order(casks)
-    pip_pkgs = uniq_keep_order(pip_pkgs)
-    npm_pkgs = uniq_keep_order(npm_pkgs)
-    actions = uniq_keep_order(actions)
-
-    install_system_packages(ctx, packages, casks=casks)
-    install_pip_packages(ctx, pip_pkgs)
-    install_pipx_packages(ctx, pipx_items)
-
-    for action in actions:
-        fn = ACTIONS.get(action)
-        if fn is None:
-            raise RuntimeError(f"Unknown action: {action}")
-        fn(ctx, config)
-
-    install_npm_packages(ctx, npm_pkgs)
+# Import-time budget for `install.py` itself (interpreter startup excluded).
+# Every run needs argparse, subprocess and dataclasses (about 40ms of it), so
+# the budget leaves room for a loaded host and catches heavy imports (YAML,
+# the action modules) creeping back in rather than small stdlib costs.
+STARTUP_BUDGET_MS = 150
+
+# Modules that must only be imported once a run actually needs them.
+LAZY_MODULES = [
+    "yaml",
+    "install_actions",
+    "install_bundle",
+    "install_deploy",
+    "install_export",
+    "install_metrics",
+    "install_verify",
+    "install_query",
+    "install_watch",
+]
+
+
+def measure_import(runs: int) -> tuple[float, set[str]]:
+    """Import `install` in fresh interpreters under `-X importtime`.
+
+    Returns:
+        The best cumulative import time in milliseconds and the set of modules
+        that import loaded.
+    """
+    best = float("inf")
+    loaded: set[str] = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import install"],
+            cwd=Path(__file__).resolve().parent,
+            check=True,
+            text=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            loaded.add(name)
+            if name == "install":
+                best = min(best, int(fields[1]) / 1000)
+    return best, loaded
+
+
+def startup_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py startup",
+        description=(
+            "Check the installer's import time against a budget and that heavy "
+            "modules stay lazy (exits 1 on violation)"
+        ),
+    )
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5, help="Best of N imports")
+    args = parser.parse_args(argv)
+
+    ms, loaded = measure_import(max(1, args.runs))
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    print(f"import install: {ms:.1f}ms (budget {args.budget_ms:g}ms)")
+    for module in eager:
+        error_print(f"{module} is imported at startup but should be lazy")
+    return 1 if ms > args.budget_ms or eager else 0
+
+
+def compile_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py compile",
+        description=(
+            "Regenerate setup/dependencies.json, the precompiled form of "
+            "dependencies.yaml that lets the installer run without PyYAML"
+        ),
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check that dependencies.json is current (exits 1 if stale)",
+    )
+    args = parser.parse_args(argv)
 
+    deps_path = Path(__file__).resolve().parent / "dependencies.yaml"
+    out = compiled_deps_path(deps_path)
+    if args.check:
+        if load_compiled_deps(deps_path) is None:
+            error_print(f"{out.name} is stale; run: python3 setup/install.py compile")
+            return 1
+        return 0
+    out.write_text(render_compiled_deps(deps_path), encoding="utf-8")
+    print(f"Wrote {out}")
+    return 0
+
+
+def query_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py query",
+        description="Answer questions about dependencies.yaml from its reverse index",
+    )
+    parser.add_argument(
+        "--platform",
+        choices=PLATFORM_KEYS,
+        help="Only consider items selected on this platform",
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    sub = parser.add_subparsers(dest="query", required=True)
+    why = sub.add_parser("why", help="Which modules and profiles bring in NAME")
+    why.add_argument("name")
+    what = sub.add_parser("what", help="The resolved item set of PROFILE")
+    what.add_argument("profile")
+    diff = sub.add_parser("diff", help="Items that differ between two profiles")
+    diff.add_argument("left")
+    diff.add_argument("right")
+    args = parser.parse_args(argv)
+
+    from install_query import query_diff, query_what, query_why
+
+    deps_path = Path(__file__).resolve().parent / "dependencies.yaml"
+    payload = read_compiled_deps(deps_path)
+    if payload is not None:
+        index = payload["index"]
+    else:
+        error_print(
+            f"{compiled_deps_path(deps_path).name} is stale; indexing the YAML "
+            "(run: python3 setup/install.py compile)"
+        )
+        index = build_index(load_yaml(deps_path))
+
+    platform = None
+    if args.platform:
+        platform = (manager_for_platform(args.platform), selector_keys(args.platform))
+    options = {"platform": platform, "as_json": bool(args.json)}
+    try:
+        if args.query == "why":
+            return query_why(index, args.name, **options)
+        if args.query == "what":
+            return query_what(index, args.profile, **options)
+        return query_diff(index, args.left, args.right, **options)
+    except KeyError as e:  # an unknown profile
+        error_print(e.args[0])
+        return 2
+
+
+def matrix_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py matrix",
+        description=(
+            "Resolve every profile on every platform in one pass and report "
+            "unresolvable entries (exits 1 if there are any)"
+        ),
+    )
+    parser.add_argument(
+        "--platform",
+        action="append",
+        choices=PLATFORM_KEYS,
+        help="Platform(s) to resolve (repeatable; default: all)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        help="Profile(s) to resolve (repeatable; default: all)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    data = load_dependencies(Path(__file__).resolve().parent / "dependencies.yaml")
+    profiles = args.profile or list(data.get("profiles") or {})
+    any_of = read_any_of_table(Path(__file__).resolve().parent / "any_of.json")
+    matrix = resolve_matrix(data, args.platform or PLATFORM_KEYS, profiles, any_of)
+    if args.json:
+        sys.stdout.write(json.dumps(matrix, indent=2) + "\n")
+    else:
+        print_matrix(matrix)
+    failed = matrix["problems"] or any(c["problems"] for c in matrix["combinations"])
+    return 1 if failed else 0
+
+
+def export_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py export",
+        description=(
+            "Turn the selected plan into a layer-cached container build: a "
+            "Docker build context, or an OCI image archive built from it"
+        ),
+    )
+    add_selection_arguments(parser)
+    parser.add_argument("--format", choices=["dockerfile", "oci"], default="dockerfile")
+    parser.add_argument(
+        "--out",
+        type=Path,
+        required=True,
+        help="Build context directory (dockerfile) or image archive path (oci)",
+    )
+    parser.add_argument("--base", help="Base image (default: per platform)")
+    parser.add_argument("--tag", help="Image tag (oci)")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Print the build command (oci)"
+    )
+    args = parser.parse_args(argv)
+
+    from install_export import (
+        BASE_IMAGES,
+        build_oci,
+        image_context,
+        plan_layers,
+        write_context,
+    )
+
+    ctx, items, config = load_selection(args, yes=True)
+    if ctx.platform_key not in BASE_IMAGES:
+        parser.error(f"{ctx.platform_key} cannot be exported to a container image")
+    base = args.base or BASE_IMAGES[ctx.platform_key]
+    plan = merge_plan(items, [])
+    check_actions(plan)
+    layers = plan_layers(image_context(ctx), items, plan, config)
+
+    if args.format == "dockerfile":
+        write_context(ctx, layers, args.out, base=base)
+        print(f"Wrote {args.out / 'Dockerfile'} ({len(layers)} layers)")
+        return 0
+    context = cache_dir() / "export" / ctx.platform_key
+    write_context(ctx, layers, context, base=base)
+    build_oci(context, args.out.resolve(), tag=args.tag, dry_run=bool(args.dry_run))
+    return 0
+
+
+def action_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py action",
+        description=(
+            "Run a single action (exported container builds run each action "
+            "as its own layer)"
+        ),
+    )
+    parser.add_argument("name", help="Action name")
+    parser.add_argument(
+        "--platform",
+        choices=PLATFORM_KEYS,
+        help="Override platform detection (otherwise auto-detected)",
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        help=(
+            "JSON file with the `config` sections the action reads "
+            "(default: `config` from dependencies.yaml)"
+        ),
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Print commands without running them"
+    )
+    args = parser.parse_args(argv)
+
+    registry = action_registry()
+    if args.name not in registry:
+        parser.error(f"unknown action: {args.name}")
+    if args.config:
+        with args.config.open("r", encoding="utf-8") as f:
+            config = json.load(f)
+    else:
+        data = load_dependencies(Path(__file__).resolve().parent / "dependencies.yaml")
+        config = data.get("config") or {}
+    platform_key = args.platform or detect_platform()
+    ctx = Context(
+        platform_key=platform_key,
+        manager=manager_for_platform(platform_key),
+        repo_root=Path(__file__).resolve().parents[1],
+        dry_run=bool(args.dry_run),
+        yes=True,
+        do_update=False,
+    )
+    registry[args.name](ctx, config)
+    return 0
+
+
+def any_of_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py any-of",
+        description=(
+            "Probe every `any_of` entry for this host's release and record the "
+            "choices in setup/any_of.json, so hosts on that release never probe"
+        ),
+    )
+    parser.add_argument(
+        "--platform",
+        choices=PLATFORM_KEYS,
+        help="Override platform detection (otherwise auto-detected)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-probe entries this release already has in the table",
+    )
+    args = parser.parse_args(argv)
+
+    platform_key = args.platform or detect_platform()
+    ctx = Context(
+        platform_key=platform_key,
+        manager=manager_for_platform(platform_key),
+        repo_root=Path(__file__).resolve().parents[1],
+        dry_run=False,
+        yes=False,
+        do_update=False,
+    )
+    release = release_key()
+    if release is None:
+        raise RuntimeError("Cannot determine this host's release (/etc/os-release)")
+    path = any_of_table_path(ctx)
+    if args.refresh:
+        releases = read_any_of_table(path)
+        releases.pop(release, None)
+        write_any_of_table(path, releases)
+
+    data = load_dependencies(ctx.repo_root / "setup" / "dependencies.yaml")
+    modules, errors = compile_modules(data.get("modules") or {})
+    if errors:
+        raise SchemaError(errors)
+    selectors = selector_keys(platform_key)
+    entries = {
+        e.label: e
+        for m in modules.values()
+        for e in m.select(ctx.manager, selectors).packages
+        if isinstance(e, AnyOf)
+    }
+    resolve_package_entries(ctx, list(entries.values()), record=path)
+    table = read_any_of_table(path).get(release, {})
+    for label in entries:
+        print(f"{release}: {label} -> {table.get(label, '(none available)')}")
+    return 1 if any(label not in table for label in entries) else 0
+
+
+def watch_main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="install.py watch",
+        description=(
+            "Watch dependencies.yaml and install_actions.py and, on each change, "
+            "apply only the newly selected items and affected actions"
+        ),
+    )
+    add_selection_arguments(parser)
+    add_yes_argument(parser)
+    add_run_arguments(parser)
+    parser.add_argument(
+        "--initial",
+        action="store_true",
+        help="Apply the full selection once before watching",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Polling interval in seconds where inotify is unavailable",
+    )
+    args = parser.parse_args(argv)
+    start_metrics(args)
+
+    from install_watch import (
+        action_sources,
+        changed_actions,
+        delta_items,
+        open_watcher,
+        removed_items,
+        wait_for_changes,
+    )
+
+    ctx = selection_context(args, yes=bool(args.yes))
+    deps_path = Path(__file__).resolve().parent / "dependencies.yaml"
+    actions_path = deps_path.with_name("install_actions.py")
+    names = [args.profile, *args.module]
+    if args.events:
+        set_event_stream(open_event_stream(args.events))
+        args.events = None  # opened once for the whole session
+
+    def load() -> tuple[list[ModuleItems], dict[str, Any]]:
+        data = load_dependencies(deps_path)
+        config = data.get("config") or {}
+        module_names = resolve_profile_modules(data, names)
+        items = collect_module_items(ctx, data.get("modules") or {}, module_names)
+        return items, config if isinstance(config, dict) else {}
+
+    def apply(items: list[ModuleItems], config: dict[str, Any]) -> None:
+        plan = resolve_plan(ctx, items)
+        execute_steps(ctx, build_steps(ctx, items, plan, config), args)
+
+    items, config = load()
+    sources = action_sources()
+    if args.initial:
+        apply(items, config)
+    watcher = open_watcher([deps_path, actions_path], interval=args.interval)
+    print(f"Watching {deps_path.name} and {actions_path.name} (Ctrl-C to stop)")
+    try:
+        while True:
+            changed = wait_for_changes(watcher)
+            print(f"Changed: {', '.join(sorted(changed))}")
+            try:
+                if actions_path.name in changed:
+                    reload_actions()
+                new_items, new_config = load()
+                new_sources = action_sources()
+                rerun = changed_actions(config, new_config, action_config_keys())
+                rerun |= {a for a, src in new_sources.items() if sources.get(a) != src}
+                delta = delta_items(items, new_items, rerun)
+                for kind, gone in removed_items(items, new_items).items():
+                    labels = " ".join(str(to_data(x)) for x in gone)
+                    print(f"No longer selected (not uninstalled): {kind}: {labels}")
+                if delta:
+                    apply(delta, new_config)
+                else:
+                    print("Nothing to apply")
+            except Exception as e:  # keep watching; the next save retries the delta
+                error_print(f"Not applied: {e}")
+                continue
+            items, config, sources = new_items, new_config, new_sources
+    except KeyboardInterrupt:
+        return 0
+
+
+COMMANDS = {
+    "bundle": bundle_main,
+    "apply": apply_main,
+    "startup": startup_main,
+    "compile": compile_main,
+    "query": query_main,
+    "matrix": matrix_main,
+    "watch": watch_main,
+    "export": export_main,
+    "action": action_main,
+    "any-of": any_of_main,
+}
+
+
+def main(argv: list[str]) -> int:
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(
+        description="Install dependencies from setup/dependencies.yaml",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=(
+            "Examples:\n"
+            "  # Install the default profile for this machine\n"
+            "  python3 setup/install.py --profile default\n"
+            "\n"
+            "  # Show what would be executed\n"
+            "  python3 setup/install.py --dry-run\n"
+            "\n"
+            "  # Add a module in addition to the profile\n"
+            "  python3 setup/install.py --profile default --module clangd\n"
+            "\n"
+            "  # Provision several users' homes, sharing downloads between them\n"
+            "  sudo python3 setup/install.py --homes /home/a /home/b --jobs 4 --yes\n"
+            "\n"
+            "  # Build an offline bundle, then install from it on another host\n"
+            "  python3 setup/install.py bundle --platform ubuntu --out b.tar.zst\n"
+            "  python3 setup/install.py apply --bundle b.tar.zst --yes\n"
+        ),
+    )
+    add_selection_arguments(parser)
+    add_yes_argument(parser)
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help=(
+            "Check that the selected profile is already satisfied and print an "
+            "NDJSON report (no installs, no sudo; exits 1 on drift)"
+        ),
+    )
+    parser.add_argument(
+        "--homes",
+        nargs="+",
+        type=Path,
+        metavar="DIR",
+        help=(
+            "Provision these home directories instead of the invoking user's: "
+            "system packages install once, per-user items once per home"
+        ),
+    )
+    add_run_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.homes:
+        if args.verify:
+            parser.error("--homes cannot be combined with --verify")
+        missing = [str(h) for h in args.homes if not h.is_dir()]
+        if missing:
+            parser.error(f"--homes: not a directory: {', '.join(missing)}")
+    start_metrics(args)
+
+    ctx, items, config = load_selection(args, yes=bool(args.yes))
+    if args.verify:
+        from install_verify import verify
+
+        return verify(ctx, items, config)
+
+    plan = resolve_plan(ctx, items)
+    if args.homes:
+        homes = list(dict.fromkeys(h.resolve() for h in args.homes))
+        if not config.get("toolchain_store"):
+            # Toolchains are downloaded once and copied into every home.
+            config = {**config, "toolchain_store": str(cache_dir() / "toolchains")}
+        steps = build_home_steps(ctx, items, plan, config, homes)
+    else:
+        steps = build_steps(ctx, items, plan, config)
+    execute_steps(ctx, steps, args)
     return 0
 
 
@@ -595,4 +1929,12 @@ if __name__ == "__main__":
         raise SystemExit(main(sys.argv[1:]))
     except subprocess.CalledProcessError as e:
         error_print(f"Command failed with exit code {e.returncode}: {e.cmd}")
+        error_print("Re-run with --resume to continue from the failed step.")
         raise
+    except StepsFailed as e:
+        for name, exc in e.failed.items():
+            error_print(f"Step {name} failed: {exc}")
+        for name in e.skipped:
+            error_print(f"Step {name} skipped (depends on a failed step)")
+        error_print("Re-run with --resume to retry only the incomplete steps.")
+        raise SystemExit(1)
@@ -6,7 +6,8 @@ set -euo pipefail
 # Responsibilities:
 # - Detect platform (or honor `--platform <macos|ubuntu|manjaro>`).
 # - Ensure `python3` and `pip` exist (via brew/apt/pacman as needed).
-# - Ensure PyYAML exists (prefer system python; otherwise use a small venv).
+# - Ensure PyYAML exists (prefer system python; otherwise use a small venv),
+#   unless the checked-in `setup/dependencies.json` is current.
 # - Delegate to `setup/install.py` with the original arguments.
 #
 # Tip: use `--dry-run` to print the commands without executing them.
@@ -126,8 +127,10 @@ bootstrap_pyyaml() {
     python3 -m venv "$BOOTSTRAP_VENV"
   fi
 
-  "$BOOTSTRAP_VENV/bin/python" -m pip install --upgrade pip >/dev/null
-  "$BOOTSTRAP_VENV/bin/python" -m pip install pyyaml >/dev/null
+  if ! "$BOOTSTRAP_VENV/bin/python" -c "import yaml" >/dev/null 2>&1; then
+    "$BOOTSTRAP_VENV/bin/python" -m pip install --upgrade pip >/dev/null
+    "$BOOTSTRAP_VENV/bin/python" -m pip install pyyaml >/dev/null
+  fi
   INSTALL_PYTHON="$BOOTSTRAP_VENV/bin/python"
 }
 
@@ -145,7 +148,12 @@ done
 platform="${platform:-$(detect_platform)}"
 
 bootstrap_python "$platform"
-bootstrap_pip "$platform"
-bootstrap_pyyaml
+
+# The checked-in `setup/dependencies.json` replaces PyYAML while it matches
+# `dependencies.yaml`, so a stock python3 needs no pip and no venv.
+if ! python3 "$REPO_ROOT/setup/install.py" compile --check >/dev/null 2>&1; then
+  bootstrap_pip "$platform"
+  bootstrap_pyyaml
+fi
 
 exec "${INSTALL_PYTHON:-python3}" "$REPO_ROOT/setup/install.py" "$@"
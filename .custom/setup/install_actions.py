@@ -7,70 +7,161 @@ These actions are referenced by name from `setup/dependencies.yaml` and executed
 after system/pip/pipx installs. Keeping them in their own module makes the main
 installer easier to read and reduces merge conflicts as this list grows.
 
+Each action registers itself (and its read-only postcondition) by name with
+`register_action`/`register_check`. The installer only imports this module
+once a plan actually schedules an action.
+
 All actions should be safe to run multiple times (idempotent) where feasible.
 """
 
 from __future__ import annotations
 
 import getpass
+import grp
+import hashlib
+import json
 import os
+import shlex
 import shutil
+import subprocess
+import time
 from pathlib import Path
 from typing import Any
 
-from install_core import Context, ensure_home_exists, platform_kind, run, run_bash
+from install_core import (
+    Context,
+    cache_result,
+    cargo_home,
+    ensure_git_mirror,
+    ensure_home_exists,
+    fetch_shared,
+    git_clone_cached,
+    home_cache_dir,
+    home_dir,
+    home_env,
+    platform_kind,
+    register_action,
+    register_check,
+    run,
+    run_bash,
+    run_parallel,
+    rustup_home,
+    shlex_join,
+    user_env,
+)
+from install_deploy import deploy, plan_deploy, read_manifest, same_link, tracked_files
+
+VIM_PLUG_URL = "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim"
+TMUX_CONFIG_URL = "https://github.com/gpakosz/.tmux"
+TPM_URL = "https://github.com/tmux-plugins/tpm"
+NVM_GIT_URL = "https://github.com/nvm-sh/nvm.git"
+
+# Repository files that are not dotfiles (overridable in `config.dotfiles`).
+DOTFILES_EXCLUDE = [".github/*", ".gitignore", ".gitmodules"]
+
+# Repositories each action clones; offline bundles carry mirrors of these.
+ACTION_GIT_SOURCES: dict[str, list[str]] = {
+    "tmux_config": [TMUX_CONFIG_URL, TPM_URL],
+    "nvm_node": [NVM_GIT_URL],
+}
 
 
+@register_action("vim_dirs", per_home=True)
 def action_vim_dirs(ctx: Context, _: dict[str, Any]) -> None:
     """Create Vim/Neovim swap/backup directories."""
-    home = ensure_home_exists()
+    home = ensure_home_exists(ctx)
     run(
         ["mkdir", "-p", str(home / ".vim" / "swap"), str(home / ".vim" / "backup")],
         dry_run=ctx.dry_run,
     )
 
 
+@register_action("vim_plug", per_home=True)
 def action_vim_plug(ctx: Context, _: dict[str, Any]) -> None:
     """Install vim-plug if not already present."""
-    home = ensure_home_exists()
+    home = ensure_home_exists(ctx)
     dest = home / ".vim" / "autoload" / "plug.vim"
     if dest.exists():
         return
     dest.parent.mkdir(parents=True, exist_ok=True)
-    run(
-        [
-            "curl",
-            "-fLo",
-            str(dest),
-            "--create-dirs",
-            "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim",
-        ],
-        dry_run=ctx.dry_run,
-    )
+    url = VIM_PLUG_URL
+    if ctx.offline:
+        url = (ctx.offline / "bootstrap" / "plug.vim").as_uri()
+    elif ctx.home is not None:
+        # Homes provisioned together download it once.
+        url = fetch_shared(url, "plug.vim", dry_run=ctx.dry_run).as_uri()
+    run(["curl", "-fLo", str(dest), "--create-dirs", url], dry_run=ctx.dry_run)
+
 
+@register_action("tmux_config", config=("git_cache",), per_home=True)
+def action_tmux_config(ctx: Context, config: dict[str, Any]) -> None:
+    """Install gpakosz/.tmux and TPM, then link `~/.tmux.conf`.
 
-def action_tmux_config(ctx: Context, _: dict[str, Any]) -> None:
-    """Install gpakosz/.tmux and TPM, then link `~/.tmux.conf`."""
-    home = ensure_home_exists()
+    Both repositories are cloned from the shared local mirror cache (see
+    `git_cache` in dependencies.yaml) rather than from GitHub each time.
+    """
+    home = ensure_home_exists(ctx)
     tmux_dir = home / ".tmux"
     tpm_dir = home / ".tmux" / "plugins" / "tpm"
     if not tmux_dir.exists():
+        git_clone_cached(TMUX_CONFIG_URL, tmux_dir, config, dry_run=ctx.dry_run)
+    # The `dotfiles` action deploys the repository's relative link here.
+    if not same_link(str(tmux_dir / ".tmux.conf"), home / ".tmux.conf"):
         run(
-            ["git", "clone", "https://github.com/gpakosz/.tmux", str(tmux_dir)],
+            ["ln", "-sfn", str(tmux_dir / ".tmux.conf"), str(home / ".tmux.conf")],
             dry_run=ctx.dry_run,
         )
-    run(
-        ["ln", "-sf", str(tmux_dir / ".tmux.conf"), str(home / ".tmux.conf")],
-        dry_run=ctx.dry_run,
-    )
     if not tpm_dir.exists():
         tpm_dir.parent.mkdir(parents=True, exist_ok=True)
-        run(
-            ["git", "clone", "https://github.com/tmux-plugins/tpm", str(tpm_dir)],
-            dry_run=ctx.dry_run,
-        )
+        git_clone_cached(TPM_URL, tpm_dir, config, dry_run=ctx.dry_run)
+
+
+def dotfiles_settings(
+    ctx: Context, config: dict[str, Any]
+) -> tuple[list[str], Path, int]:
+    """Return the excluded paths, backup directory and comparison concurrency."""
+    cfg = config.get("dotfiles") or {}
+    if not isinstance(cfg, dict):
+        cfg = {}
+    exclude = cfg.get("exclude", DOTFILES_EXCLUDE)
+    exclude = [p for p in exclude or [] if isinstance(p, str) and p]
+    backup = cfg.get("backup_dir")
+    if not isinstance(backup, str) or not backup:
+        backup = ".dotfiles-backup"
+    if backup == "~" or backup.startswith("~/"):
+        backup = backup[2:]
+    jobs = cfg.get("jobs", 8)
+    return (
+        exclude,
+        home_dir(ctx) / backup,
+        jobs if isinstance(jobs, int) and jobs > 0 else 8,
+    )
+
+
+def dotfiles_manifest(ctx: Context) -> Path:
+    return home_cache_dir(ctx) / "dotfiles.json"
 
 
+@register_action("dotfiles", config=("dotfiles",), per_home=True)
+def action_dotfiles(ctx: Context, config: dict[str, Any]) -> None:
+    """Deploy the files tracked in this repository into the home directory.
+
+    Only files that differ are written, after a backup (see install_deploy.py);
+    on a converged home this stats each file once and writes nothing.
+    """
+    exclude, backup_dir, jobs = dotfiles_settings(ctx, config)
+    deploy(
+        ctx.repo_root.parent,
+        ensure_home_exists(ctx),
+        exclude=exclude,
+        manifest=dotfiles_manifest(ctx),
+        backup_dir=backup_dir,
+        jobs=jobs,
+        dry_run=ctx.dry_run,
+    )
+
+
+@register_action("docker_enable")
 def action_docker_enable(ctx: Context, _: dict[str, Any]) -> None:
     """Enable Docker on Linux (group membership + systemd enable/start)."""
     if platform_kind(ctx.platform_key) != "linux":
@@ -92,8 +183,17 @@ def action_docker_enable(ctx: Context, _: dict[str, Any]) -> None:
         )
 
 
-def action_rustup_toolchains(ctx: Context, config: dict[str, Any]) -> None:
-    """Ensure rustup exists and install configured toolchains."""
+# -------------------------------- Toolchains --------------------------------
+#
+# Installed rust toolchains and node versions are read once from disk, and
+# only the missing ones are installed. If `config.toolchain_store` names a
+# host-wide directory, missing toolchains are first copied from there, and
+# freshly downloaded ones are copied there for the next home. Copies rather
+# than hardlinks keep each home from sharing (or owning) the store's inodes.
+
+
+def rustup_settings(config: dict[str, Any]) -> tuple[str, list[str]]:
+    """Return the rustup install URL and the configured toolchains."""
     rustup_cfg = config.get("rustup") or {}
 
     if not isinstance(rustup_cfg, dict):
@@ -106,25 +206,11 @@ def action_rustup_toolchains(ctx: Context, config: dict[str, Any]) -> None:
         isinstance(x, str) for x in toolchains
     ):
         toolchains = ["stable", "nightly"]
+    return install_url, toolchains
 
-    if shutil.which("rustup") is None:
-        run_bash(f"curl -sSf {install_url} | sh -s -- -y", dry_run=ctx.dry_run)
 
-    tc_install = " && ".join([f"rustup toolchain install {t}" for t in toolchains])
-    script = f"""
-        set -e
-        if [ -f "$HOME/.cargo/env" ]; then
-          . "$HOME/.cargo/env"
-        fi
-        rustup default stable || true
-        {tc_install}
-    """
-
-    run_bash(script, dry_run=ctx.dry_run)
-
-
-def action_nvm_node(ctx: Context, config: dict[str, Any]) -> None:
-    """Ensure nvm exists and install the configured Node version."""
+def node_settings(ctx: Context, config: dict[str, Any]) -> tuple[str, str | None]:
+    """Return the nvm install URL and the node version for this platform."""
     nvm_cfg = config.get("nvm") or {}
     if not isinstance(nvm_cfg, dict):
         nvm_cfg = {}
@@ -139,29 +225,677 @@ def action_nvm_node(ctx: Context, config: dict[str, Any]) -> None:
         platform_kind(ctx.platform_key)
     )
     if not isinstance(node_version, (str, int, float)) or not str(node_version).strip():
+        return install_url, None
+    return install_url, str(node_version).strip().lstrip("v")
+
+
+def installed_rust_toolchains(home: Path) -> list[str]:
+    """List installed toolchain directory names (e.g. `stable-x86_64-...`)."""
+    try:
+        return sorted(p.name for p in (home / "toolchains").iterdir() if p.is_dir())
+    except OSError:
+        return []
+
+
+def match_toolchain(name: str, installed: list[str]) -> str | None:
+    """Find the installed directory for a toolchain spec like `stable`."""
+    for candidate in installed:
+        if candidate == name or candidate.startswith(f"{name}-"):
+            return candidate
+    return None
+
+
+def installed_node_version(versions: Path, version: str) -> Path | None:
+    """Find the node directory for `version` (e.g. 22 or 22.11.0) in `versions`."""
+    exact = versions / f"v{version}"
+    if exact.is_dir():
+        return exact
+    try:
+        prefix = [p for p in versions.iterdir() if p.name.startswith(f"v{version}.")]
+    except OSError:
+        return None
+    return max(prefix, key=lambda p: p.name) if prefix else None
+
+
+def toolchain_store(config: dict[str, Any]) -> Path | None:
+    store = config.get("toolchain_store")
+    return Path(store).expanduser() if isinstance(store, str) and store else None
+
+
+def link_tree(src: Path, dest: Path, *, dry_run: bool, hardlink: bool = True) -> bool:
+    """Hardlink-copy a directory tree, falling back to a plain copy.
+
+    With `hardlink=False` the tree is always copied, so `dest` shares no
+    inodes with `src`.
+
+    Returns True if `dest` was populated.
+    """
+    attempts = ("-al", "-a") if hardlink else ("-a",)
+    if dry_run:
+        run(["cp", attempts[0], str(src), str(dest)], dry_run=True)
+        return True
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    for flags in attempts:  # hardlinks need the same filesystem
+        if run(["cp", flags, str(src), str(tmp)], check=False).returncode == 0:
+            tmp.rename(dest)
+            return True
+        shutil.rmtree(tmp, ignore_errors=True)
+    return False
+
+
+def publish_to_store(src: Path, dest: Path) -> None:
+    """Best-effort: share a freshly installed toolchain with other homes."""
+    if dest.exists() or not src.is_dir():
+        return
+    try:
+        link_tree(src, dest, dry_run=False, hardlink=False)
+    except OSError:
+        pass
+
+
+@register_action(
+    "rustup_toolchains", config=("rustup", "toolchain_store"), per_home=True
+)
+def action_rustup_toolchains(ctx: Context, config: dict[str, Any]) -> None:
+    """Ensure rustup exists and install only the missing configured toolchains.
+
+    Toolchains in the `toolchain_store` are copied in concurrently. The rest
+    are installed one after another: rustup's downloads and settings.toml are
+    shared by everything in one RUSTUP_HOME, so concurrent installs into it
+    can corrupt them.
+    """
+    install_url, toolchains = rustup_settings(config)
+    env = home_env(ctx)
+    cargo_bin = cargo_home(ctx) / "bin"
+    rustup = (shutil.which("rustup") if ctx.home is None else None) or (
+        str(cargo_bin / "rustup") if (cargo_bin / "rustup").exists() else None
+    )
+    if rustup is None:
+        rustup_init = ctx.offline / "bootstrap" / "rustup-init" if ctx.offline else None
+        if rustup_init and rustup_init.exists():
+            # Toolchains come from the bundle's toolchain store below.
+            run(
+                [str(rustup_init), "-y", "--default-toolchain", "none"],
+                dry_run=ctx.dry_run,
+                env=env,
+            )
+        else:
+            run_bash(
+                f"curl -sSf {install_url} | sh -s -- -y", dry_run=ctx.dry_run, env=env
+            )
+        rustup = str(cargo_bin / "rustup")
+
+    home = rustup_home(ctx)
+    installed = installed_rust_toolchains(home)
+    store = toolchain_store(config)
+    store_rust = store / "rust" if store else None
+    shared = installed_rust_toolchains(store_rust) if store_rust else []
+
+    missing = [t for t in toolchains if not match_toolchain(t, installed)]
+    if store_rust:
+        copied: set[str] = set()
+
+        def copy(t: str) -> None:
+            stored = match_toolchain(t, shared)
+            ok = bool(
+                stored
+                and link_tree(
+                    store_rust / "toolchains" / stored,
+                    home / "toolchains" / stored,
+                    dry_run=ctx.dry_run,
+                    hardlink=False,
+                )
+            )
+            cache_result("toolchain_store", ok)
+            if ok:
+                copied.add(t)
+
+        run_parallel(
+            [lambda t=t: copy(t) for t in missing], jobs=1 if ctx.dry_run else 4
+        )
+        missing = [t for t in missing if t not in copied]
+
+    for t in missing:
+        run(
+            [rustup, "toolchain", "install", "--no-self-update", t],
+            dry_run=ctx.dry_run,
+            env=env,
+        )
+
+    try:
+        settings = (home / "settings.toml").read_text(encoding="utf-8")
+    except OSError:
+        settings = ""
+    if "default_toolchain" not in settings:
+        run([rustup, "default", "stable"], check=False, dry_run=ctx.dry_run, env=env)
+
+    if store_rust and not ctx.dry_run:
+        for t in missing:
+            name = match_toolchain(t, installed_rust_toolchains(home))
+            if name:
+                publish_to_store(
+                    home / "toolchains" / name, store_rust / "toolchains" / name
+                )
+
+
+@register_action("nvm_node", config=("nvm", "toolchain_store"), per_home=True)
+def action_nvm_node(ctx: Context, config: dict[str, Any]) -> None:
+    """Ensure nvm exists and the configured Node version is installed/default.
+
+    nvm is only sourced when the version is missing or not yet the default.
+    """
+    install_url, node_version = node_settings(ctx, config)
+    if node_version is None:
         raise RuntimeError(f"Missing node version for platform {ctx.platform_key}")
-    node_version = str(node_version)
 
-    nvm_dir = Path.home() / ".nvm"
+    env = home_env(ctx)
+    nvm_dir = home_dir(ctx) / ".nvm"
     nvm_sh = nvm_dir / "nvm.sh"
     if not nvm_sh.exists():
-        run_bash(f"curl -sSfL {install_url} | bash", dry_run=ctx.dry_run)
+        run_bash(f"curl -sSfL {install_url} | bash", dry_run=ctx.dry_run, env=env)
+
+    store = toolchain_store(config)
+    store_node = store / "node" if store else None
+    versions = nvm_dir / "versions" / "node"
+    installed = installed_node_version(versions, node_version)
+    if installed is None and store_node:
+        stored = installed_node_version(store_node, node_version)
+        if stored and link_tree(
+            stored, versions / stored.name, dry_run=ctx.dry_run, hardlink=False
+        ):
+            installed = versions / stored.name
+        cache_result("toolchain_store", installed is not None)
+
+    try:
+        default = (nvm_dir / "alias" / "default").read_text(encoding="utf-8").strip()
+    except OSError:
+        default = ""
+    if installed is not None and default.lstrip("v") == node_version:
+        return
 
+    steps = []
+    if installed is None:
+        steps.append(f"nvm install {node_version}")
+    steps.append(f"nvm alias default {node_version}")
     script = f"""
         set -e
         export NVM_DIR="$HOME/.nvm"
         [ -s "$NVM_DIR/nvm.sh" ] && . "$NVM_DIR/nvm.sh"
-        nvm install {node_version}
-        nvm alias default {node_version}
+        {" && ".join(steps)}
     """
-    run_bash(script, dry_run=ctx.dry_run)
+    run_bash(script, dry_run=ctx.dry_run, env=env)
 
+    if store_node and installed is None and not ctx.dry_run:
+        fresh = installed_node_version(versions, node_version)
+        if fresh is not None:
+            publish_to_store(fresh, store_node / fresh.name)
 
-ACTIONS: dict[str, Any] = {
-    "vim_dirs": action_vim_dirs,
-    "vim_plug": action_vim_plug,
-    "tmux_config": action_tmux_config,
-    "docker_enable": action_docker_enable,
-    "rustup_toolchains": action_rustup_toolchains,
-    "nvm_node": action_nvm_node,
-}
+
+# ------------------------------ Neovim Plugins ------------------------------
+#
+# lazy.nvim pins every plugin in `lazy-lock.json` but only clones them, one by
+# one, on the first `nvim` start. `nvim_plugins` fetches them at provisioning
+# time instead: concurrently, shallow, and straight at the pinned commit.
+
+
+def nvim_plugin_settings(
+    ctx: Context, config: dict[str, Any]
+) -> tuple[Path, dict[str, str], int]:
+    """Return the lockfile, plugin name -> clone URL map and fetch concurrency."""
+    cfg = config.get("nvim_plugins") or {}
+    if not isinstance(cfg, dict):
+        cfg = {}
+    lockfile = cfg.get("lockfile")
+    if isinstance(lockfile, str) and lockfile:
+        path = Path(lockfile).expanduser()
+    else:
+        path = home_dir(ctx) / ".config" / "nvim" / "lazy-lock.json"
+        if not path.exists():
+            path = ctx.repo_root.parent / ".config" / "nvim" / "lazy-lock.json"
+    sources = cfg.get("sources") or {}
+    urls = {
+        str(name): src if "://" in src else f"https://github.com/{src}.git"
+        for name, src in sources.items()
+        if isinstance(src, str) and src
+    }
+    jobs = cfg.get("jobs", 8)
+    return path, urls, jobs if isinstance(jobs, int) and jobs > 0 else 8
+
+
+def lazy_plugin_dir(ctx: Context) -> Path:
+    """Return lazy.nvim's install root (`stdpath("data") .. "/lazy"`)."""
+    data = user_env(ctx, "XDG_DATA_HOME") or str(home_dir(ctx) / ".local" / "share")
+    return Path(data) / (os.environ.get("NVIM_APPNAME") or "nvim") / "lazy"
+
+
+def git_head(repo: Path) -> str | None:
+    """Resolve a checkout's HEAD commit from `.git` without spawning git."""
+    git_dir = repo / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[len("ref: ") :]
+        try:
+            return (git_dir / ref).read_text(encoding="utf-8").strip()
+        except OSError:
+            pass
+        for line in (git_dir / "packed-refs").read_text(encoding="utf-8").splitlines():
+            sha, _, name = line.partition(" ")
+            if name == ref:
+                return sha
+    except OSError:
+        pass
+    return None
+
+
+def fetch_pinned_plugin(
+    dest: Path,
+    url: str,
+    branch: str,
+    commit: str,
+    *,
+    dry_run: bool,
+    source: str | None = None,
+) -> None:
+    """Shallow-fetch `commit` into `dest` and check it out on `branch`.
+
+    `source` (e.g. a local mirror) is fetched from instead of `url`, which
+    stays the `origin` remote.
+    """
+    fresh = not (dest / ".git").exists()
+    repo = dest.with_name(dest.name + ".tmp") if fresh else dest
+    git = ["git", "-C", str(repo)]
+    if fresh:
+        if not dry_run:
+            shutil.rmtree(repo, ignore_errors=True)
+        run(["git", "init", "--quiet", str(repo)], dry_run=dry_run)
+        run([*git, "remote", "add", "origin", url], dry_run=dry_run)
+    # Existing (e.g. lazy.nvim's own full) clones keep their history.
+    depth = ["--depth", "1"] if fresh or (repo / ".git" / "shallow").exists() else []
+    remote = source or "origin"
+    run([*git, "fetch", "--quiet", *depth, remote, commit], dry_run=dry_run)
+    run([*git, "checkout", "--quiet", "-B", branch, commit], dry_run=dry_run)
+    # Let lazy.nvim's own update checks track the locked branch.
+    run([*git, "config", f"branch.{branch}.remote", "origin"], dry_run=dry_run)
+    run(
+        [*git, "config", f"branch.{branch}.merge", f"refs/heads/{branch}"],
+        dry_run=dry_run,
+    )
+    if fresh and not dry_run:
+        shutil.rmtree(dest, ignore_errors=True)
+        repo.rename(dest)
+
+
+def read_lazy_lock(path: Path) -> dict[str, dict[str, str]]:
+    """Return `name -> {"branch", "commit"}` from a lazy-lock.json."""
+    with path.open("r", encoding="utf-8") as f:
+        lock = json.load(f)
+    return {
+        name: entry
+        for name, entry in lock.items()
+        if isinstance(entry, dict) and isinstance(entry.get("commit"), str)
+    }
+
+
+@register_action("nvim_plugins", config=("nvim_plugins", "git_cache"), per_home=True)
+def action_nvim_plugins(ctx: Context, config: dict[str, Any]) -> None:
+    """Fetch every plugin pinned in lazy-lock.json into lazy.nvim's data dir.
+
+    Plugins already at their locked commit are skipped without running git;
+    the rest are fetched concurrently (`config.nvim_plugins.jobs`). When
+    provisioning `--homes`, they are fetched from the shared git mirror cache
+    so each plugin is downloaded once per host.
+    """
+    lockfile, urls, jobs = nvim_plugin_settings(ctx, config)
+    if not lockfile.exists():
+        print(f"nvim_plugins: {lockfile} not found; skipping")
+        return
+    root = lazy_plugin_dir(ctx)
+    if not ctx.dry_run:
+        root.mkdir(parents=True, exist_ok=True)
+
+    fetches = []
+    for name, entry in sorted(read_lazy_lock(lockfile).items()):
+        dest = root / name
+        if git_head(dest) == entry["commit"]:
+            continue
+        url = urls.get(name)
+        if url is None:
+            print(f"nvim_plugins: no source for {name}; lazy.nvim will clone it")
+            continue
+        fetches.append(
+            lambda dest=dest, url=url, entry=entry: fetch_pinned_plugin(
+                dest,
+                url,
+                entry.get("branch") or "main",
+                entry["commit"],
+                dry_run=ctx.dry_run,
+                source=(
+                    ensure_git_mirror(url, config, dry_run=ctx.dry_run).as_uri()
+                    if ctx.home is not None
+                    else None
+                ),
+            )
+        )
+    run_parallel(fetches, jobs=1 if ctx.dry_run else jobs)
+
+
+# Bump when the generated snippet format changes so existing caches rebuild.
+SHELL_ENV_FORMAT = 2
+
+BREW_CANDIDATES = [
+    "/opt/homebrew/bin/brew",
+    "/usr/local/bin/brew",
+    "/home/linuxbrew/.linuxbrew/bin/brew",
+]
+
+
+def shell_env_inputs(home: Path) -> list[Path]:
+    """Return the files whose changes invalidate the precomputed shell env.
+
+    `.bashrc`/`.zshrc` check the per-user ones with `-nt` before sourcing the
+    snippet; keep their lists in sync with this one.
+    """
+    nvm_dir = home / ".nvm"
+    return [
+        nvm_dir / "nvm.sh",
+        nvm_dir / "alias" / "default",
+        nvm_dir / "versions" / "node",
+        home / ".dir_colors",
+        Path("/etc/DIR_COLORS"),
+        *(Path(p) for p in BREW_CANDIDATES),
+    ]
+
+
+def shell_env_fingerprint(home: Path) -> str:
+    """Hash the stat of every input so unchanged hosts skip regeneration."""
+    digest = hashlib.sha256(f"format={SHELL_ENV_FORMAT}".encode())
+    for path in shell_env_inputs(home):
+        try:
+            st = path.stat()
+            digest.update(f"{path}:{st.st_mtime_ns}:{st.st_size}\n".encode())
+        except OSError:
+            digest.update(f"{path}:missing\n".encode())
+    return digest.hexdigest()
+
+
+def capture(cmd: list[str]) -> str | None:
+    """Run a command and return its stdout, or None if it failed."""
+    try:
+        result = subprocess.run(
+            cmd,
+            check=False,
+            text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def render_shell_env(home: Path) -> str:
+    """Evaluate the slow shell-startup snippets once and render static exports.
+
+    Anything that cannot be resolved now falls back to the original dynamic
+    form, so the snippet is always correct (just not always fast).
+    """
+    lines: list[str] = []
+
+    nvm_dir = home / ".nvm"
+    lines.append(f"export NVM_DIR={shlex.quote(str(nvm_dir))}")
+    node_version = None
+    if (nvm_dir / "nvm.sh").exists():
+        out = capture(
+            [
+                "bash",
+                "-c",
+                'export NVM_DIR="$1"; . "$NVM_DIR/nvm.sh" --no-use; nvm version default',
+                "bash",
+                str(nvm_dir),
+            ]
+        )
+        node_version = (out or "").strip() or None
+    node_bin = nvm_dir / "versions" / "node" / (node_version or "") / "bin"
+    if node_version and node_bin.is_dir():
+        lines.extend(
+            [
+                f"export NVM_BIN={shlex.quote(str(node_bin))}",
+                f'export PATH={shlex.quote(str(node_bin))}:"$PATH"',
+                "# nvm itself is loaded on first use.",
+                'nvm() { unset -f nvm; . "$NVM_DIR/nvm.sh"; nvm "$@"; }',
+            ]
+        )
+    else:
+        lines.append('[ -s "$NVM_DIR/nvm.sh" ] && \\. "$NVM_DIR/nvm.sh"')
+
+    # A function, so `.zshrc` applies it where it used to eval `brew shellenv`
+    # and PATH precedence stays the same.
+    brew = next((p for p in BREW_CANDIDATES if os.access(p, os.X_OK)), None)
+    brew_env = capture([brew, "shellenv"]) if brew else None
+    lines.append("dotfiles_brew_shellenv() {")
+    if brew_env:
+        lines.append(brew_env.strip())
+    else:
+        lines.append('  command -v brew >/dev/null 2>&1 && eval "$(brew shellenv)"')
+    lines.append("}")
+
+    if shutil.which("dircolors") is not None:
+        args = ["dircolors", "-b"]
+        for candidate in (home / ".dir_colors", Path("/etc/DIR_COLORS")):
+            if candidate.is_file():
+                args.append(str(candidate))
+                break
+        colors = capture(args)
+        if colors:
+            lines.append(colors.strip())
+
+    return "\n".join(lines) + "\n"
+
+
+def time_shell_startup(shell: str, runs: int, env: dict[str, str]) -> float:
+    """Return the median wall time (seconds) of an interactive shell start."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [shell, "-i", "-c", "exit"],
+            check=False,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+@register_action("shell_env", config=("shell_env",), per_home=True)
+def action_shell_env(ctx: Context, config: dict[str, Any]) -> None:
+    """Precompute the slow parts of shell startup into a static env snippet.
+
+    `.bashrc`/`.zshrc` source the snippet instead of sourcing nvm, evaluating
+    `brew shellenv` and running `dircolors`. The snippet is rebuilt only when
+    its inputs change; set `DOTFILES_NO_SHELL_ENV=1` to bypass it. The
+    startup benchmark is skipped when provisioning `--homes`.
+    """
+    shell_cfg = config.get("shell_env") or {}
+    if not isinstance(shell_cfg, dict):
+        shell_cfg = {}
+    bench_runs = shell_cfg.get("bench_runs", 5)
+    if not isinstance(bench_runs, int) or bench_runs < 0:
+        bench_runs = 5
+
+    home = ensure_home_exists(ctx)
+    snippet = home_cache_dir(ctx) / "shell_env.sh"
+    fingerprint = shell_env_fingerprint(home)
+    header = f"# dotfiles shell env; inputs={fingerprint}\n"
+
+    try:
+        current = snippet.read_text(encoding="utf-8")
+    except OSError:
+        current = ""
+    if current.startswith(header):
+        return
+
+    if ctx.dry_run:
+        print("+ write", shlex_join([str(snippet)]))
+        return
+
+    snippet.parent.mkdir(parents=True, exist_ok=True)
+    tmp = snippet.with_suffix(".tmp")
+    tmp.write_text(header + render_shell_env(home), encoding="utf-8")
+    tmp.replace(snippet)
+
+    if not bench_runs or ctx.home is not None:
+        return
+    for shell in ("bash", "zsh"):
+        if shutil.which(shell) is None:
+            continue
+        env = dict(os.environ)
+        env["DOTFILES_NO_SHELL_ENV"] = "1"
+        before = time_shell_startup(shell, bench_runs, env)
+        env.pop("DOTFILES_NO_SHELL_ENV")
+        after = time_shell_startup(shell, bench_runs, env)
+        print(
+            f"{shell} interactive startup: {before * 1000:.0f}ms -> "
+            f"{after * 1000:.0f}ms (median of {bench_runs})"
+        )
+
+
+# ------------------------------ Postconditions ------------------------------
+#
+# Read-only checks used by `install.py --verify`. Each returns None when the
+# action's result is in place, or a short description of the drift. They must
+# not run package managers, sudo, or anything slower than a stat or two.
+
+
+@register_check("vim_dirs")
+def check_vim_dirs(ctx: Context, _: dict[str, Any]) -> str | None:
+    home = home_dir(ctx)
+    missing = [
+        str(p)
+        for p in (home / ".vim" / "swap", home / ".vim" / "backup")
+        if not p.is_dir()
+    ]
+    return f"missing {', '.join(missing)}" if missing else None
+
+
+@register_check("vim_plug")
+def check_vim_plug(ctx: Context, _: dict[str, Any]) -> str | None:
+    dest = home_dir(ctx) / ".vim" / "autoload" / "plug.vim"
+    return None if dest.is_file() else f"missing {dest}"
+
+
+@register_check("tmux_config")
+def check_tmux_config(ctx: Context, _: dict[str, Any]) -> str | None:
+    home = home_dir(ctx)
+    tmux_dir = home / ".tmux"
+    for path in (tmux_dir / ".tmux.conf", tmux_dir / "plugins" / "tpm"):
+        if not path.exists():
+            return f"missing {path}"
+    link = home / ".tmux.conf"
+    if not same_link(str(tmux_dir / ".tmux.conf"), link):
+        return f"{link} does not link to {tmux_dir / '.tmux.conf'}"
+    return None
+
+
+@register_check("nvim_plugins")
+def check_nvim_plugins(ctx: Context, config: dict[str, Any]) -> str | None:
+    lockfile, urls, _ = nvim_plugin_settings(ctx, config)
+    try:
+        lock = read_lazy_lock(lockfile)
+    except (OSError, ValueError):
+        return None
+    root = lazy_plugin_dir(ctx)
+    stale = [
+        name
+        for name, entry in lock.items()
+        if name in urls and git_head(root / name) != entry["commit"]
+    ]
+    if stale:
+        return f"{len(stale)} plugin(s) not at their locked commit: {', '.join(stale)}"
+    return None
+
+
+@register_check("dotfiles")
+def check_dotfiles(ctx: Context, config: dict[str, Any]) -> str | None:
+    root = ctx.repo_root.parent
+    home = home_dir(ctx)
+    if root.resolve() == home.resolve():
+        return None
+    exclude, _, jobs = dotfiles_settings(ctx, config)
+    known = read_manifest(dotfiles_manifest(ctx), root)
+    changes, _ = plan_deploy(root, home, tracked_files(root, exclude), known, jobs=jobs)
+    if not changes:
+        return None
+    shown = ", ".join(c.path for c in changes[:5])
+    more = f" and {len(changes) - 5} more" if len(changes) > 5 else ""
+    return f"{len(changes)} file(s) differ from the repository: {shown}{more}"
+
+
+@register_check("docker_enable")
+def check_docker_enable(ctx: Context, _: dict[str, Any]) -> str | None:
+    if platform_kind(ctx.platform_key) != "linux":
+        return None
+    user = os.environ.get("SUDO_USER") or os.environ.get("USER") or getpass.getuser()
+    try:
+        members = grp.getgrnam("docker").gr_mem
+    except KeyError:
+        return "docker group does not exist"
+    if user and user not in members:
+        return f"{user} is not in the docker group"
+    if shutil.which("systemctl") is not None:
+        enabled = capture(["systemctl", "is-enabled", "docker"])
+        if (enabled or "").strip() != "enabled":
+            return "docker service is not enabled"
+    return None
+
+
+@register_check("rustup_toolchains")
+def check_rustup_toolchains(ctx: Context, config: dict[str, Any]) -> str | None:
+    _, toolchains = rustup_settings(config)
+    home = rustup_home(ctx)
+    installed = installed_rust_toolchains(home)
+    if not installed:
+        return f"no toolchains under {home}"
+    missing = [t for t in toolchains if not match_toolchain(t, installed)]
+    return f"missing toolchains {', '.join(missing)}" if missing else None
+
+
+@register_check("nvm_node")
+def check_nvm_node(ctx: Context, config: dict[str, Any]) -> str | None:
+    _, version = node_settings(ctx, config)
+    nvm_dir = home_dir(ctx) / ".nvm"
+    if not (nvm_dir / "nvm.sh").is_file():
+        return f"missing {nvm_dir / 'nvm.sh'}"
+    if version is None:
+        return None
+    if installed_node_version(nvm_dir / "versions" / "node", version) is None:
+        return f"node v{version} is not installed"
+    try:
+        default = (nvm_dir / "alias" / "default").read_text(encoding="utf-8").strip()
+    except OSError:
+        default = ""
+    if default.lstrip("v") != version:
+        return f"nvm default is {default or 'unset'}, expected {version}"
+    return None
+
+
+@register_check("shell_env")
+def check_shell_env(ctx: Context, _: dict[str, Any]) -> str | None:
+    home = home_dir(ctx)
+    snippet = home_cache_dir(ctx) / "shell_env.sh"
+    header = f"# dotfiles shell env; inputs={shell_env_fingerprint(home)}\n"
+    try:
+        with snippet.open("r", encoding="utf-8") as f:
+            current = f.readline()
+    except OSError:
+        return f"missing {snippet}"
+    return None if current == header else f"{snippet} is stale"
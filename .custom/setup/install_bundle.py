@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+
+"""
+Offline bundles for `setup/install.py bundle` and `setup/install.py apply`.
+
+A bundle is a single tar file (optionally zstd-compressed) holding everything
+an air-gapped host needs to converge a profile without network access:
+
+  index.json          content index (always the first member, see below)
+  plan.json           the resolved plan: platform, module items and config
+  packages/<manager>/ .deb / .pkg.tar.* archives, or a Homebrew cache
+  pip/, pipx/         wheels and sdists from `pip download`
+  npm-cache/          an npm cache primed by a throwaway global install
+  bootstrap/          nvm/vim-plug scripts, rustup-init and node dist files
+  git/                bare mirrors of every repository the actions clone
+  toolchains/         installed rust toolchains, laid out as a toolchain store
+
+The tar is written uncompressed with a fixed-size `index.json` placeholder as
+its first member. Once every member is written, the index is patched in place
+with each member's data offset, size, mode and sha256. `apply` maps the
+(decompressed) tar with mmap, reads the index at offset 512 and copies each
+member straight out of the mapping, without walking the tar headers.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import platform as py_platform
+import shutil
+import tarfile
+from pathlib import Path
+from typing import Any
+
+from install_actions import (
+    ACTION_GIT_SOURCES,
+    NVM_GIT_URL,
+    VIM_PLUG_URL,
+    installed_rust_toolchains,
+    link_tree,
+    match_toolchain,
+    node_settings,
+    rustup_settings,
+    toolchain_store,
+)
+from install_core import (
+    NPM_PREAMBLE,
+    Context,
+    InstallPlan,
+    ModuleItems,
+    Step,
+    cache_dir,
+    ensure_git_mirror,
+    git_mirror_path,
+    records_from_data,
+    run,
+    run_bash,
+    rustup_home,
+    shlex_join,
+    to_data,
+)
+
+BUNDLE_FORMAT = 1
+INDEX_NAME = "index.json"
+TAR_BLOCK = 512
+NODE_DIST_URL = "https://nodejs.org/dist"
+RUSTUP_DIST_URL = "https://static.rust-lang.org/rustup/dist"
+
+
+# ------------------------------ Host Triples --------------------------------
+
+
+def node_dist_prefix(version: str) -> str:
+    """Return the nodejs.org dist name for this host, e.g. `node-v22.11.0-linux-x64`."""
+    system = "darwin" if py_platform.system() == "Darwin" else "linux"
+    machine = py_platform.machine().lower()
+    arch = {"x86_64": "x64", "amd64": "x64", "aarch64": "arm64"}.get(machine, machine)
+    return f"node-v{version}-{system}-{arch}"
+
+
+def rust_host_triple() -> str:
+    machine = py_platform.machine().lower()
+    arch = {"amd64": "x86_64", "arm64": "aarch64"}.get(machine, machine)
+    if py_platform.system() == "Darwin":
+        return f"{arch}-apple-darwin"
+    return f"{arch}-unknown-linux-gnu"
+
+
+# ------------------------------ Staging Steps -------------------------------
+
+
+def download(url: str, dest: Path, *, dry_run: bool) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    run(["curl", "-fsSL", "-o", str(dest), url], dry_run=dry_run)
+
+
+def stage_packages(
+    ctx: Context, packages: list[str], casks: list[str], dest: Path
+) -> None:
+    """Download system package archives, including their full dependency closure.
+
+    The closure is resolved against an empty package database, so the bundle
+    also covers hosts that have less installed than the one building it.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    user = os.environ.get("USER") or str(os.getuid())
+
+    if ctx.manager == "apt":
+        (dest / "partial").mkdir(exist_ok=True)
+        empty_status = dest / "partial" / "status"
+        empty_status.touch()
+        if ctx.do_update:
+            run(["sudo", "apt-get", "update"], dry_run=ctx.dry_run)
+        cmd = ["sudo", "apt-get", "install", "-y", "--download-only"]
+        cmd += ["-o", f"Dir::Cache::archives={dest}"]
+        cmd += ["-o", f"Dir::State::status={empty_status}"]
+        run([*cmd, *packages], dry_run=ctx.dry_run)
+        run(["sudo", "chown", "-R", user, str(dest)], dry_run=ctx.dry_run)
+        shutil.rmtree(dest / "partial", ignore_errors=True)
+        (dest / "lock").unlink(missing_ok=True)
+        return
+
+    if ctx.manager == "pacman":
+        dbpath = dest.parent / "pacman-db"
+        dbpath.mkdir(parents=True, exist_ok=True)
+        cmd = ["sudo", "pacman", "-Syw", "--noconfirm"]
+        cmd += ["--cachedir", str(dest), "--dbpath", str(dbpath)]
+        run([*cmd, *packages], dry_run=ctx.dry_run)
+        run(["sudo", "chown", "-R", user, str(dest), str(dbpath)], dry_run=ctx.dry_run)
+        shutil.rmtree(dbpath, ignore_errors=True)
+        return
+
+    if ctx.manager == "brew":
+        env = dict(os.environ, HOMEBREW_CACHE=str(dest))
+        if packages:
+            run(["brew", "fetch", "--deps", *packages], dry_run=ctx.dry_run, env=env)
+        if casks:
+            run(["brew", "fetch", "--cask", *casks], dry_run=ctx.dry_run, env=env)
+        return
+
+    raise RuntimeError(f"Unsupported package manager: {ctx.manager}")
+
+
+def stage_python(ctx: Context, plan: InstallPlan, root: Path) -> None:
+    """Download pip packages and pipx applications (with dependencies)."""
+    pip = ["python3", "-m", "pip", "download", "--quiet", "-d"]
+    if plan.pip:
+        run([*pip, str(root / "pip"), *plan.pip], dry_run=ctx.dry_run)
+    for item in plan.pipx:
+        run([*pip, str(root / "pipx"), item.name], dry_run=ctx.dry_run)
+    if plan.pipx:
+        # pipx seeds each venv with pip itself.
+        run([*pip, str(root / "pipx"), "pip"], dry_run=ctx.dry_run)
+
+
+def stage_npm(ctx: Context, packages: list[str], root: Path) -> None:
+    """Prime an npm cache by installing `packages` into a throwaway prefix."""
+    prefix = root.parent / "npm-prefix"
+    script = NPM_PREAMBLE + shlex_join(
+        [
+            "npm",
+            "install",
+            "-g",
+            "--prefix",
+            str(prefix),
+            "--cache",
+            str(root / "npm-cache"),
+            *packages,
+        ]
+    )
+    run_bash(script, dry_run=ctx.dry_run)
+    shutil.rmtree(prefix, ignore_errors=True)
+
+
+def stage_bootstrap(
+    ctx: Context, plan: InstallPlan, config: dict[str, Any], root: Path
+) -> None:
+    """Download the installer scripts and binaries that actions fetch at runtime."""
+    boot = root / "bootstrap"
+    if "vim_plug" in plan.actions:
+        download(VIM_PLUG_URL, boot / "plug.vim", dry_run=ctx.dry_run)
+    if "rustup_toolchains" in plan.actions:
+        url = f"{RUSTUP_DIST_URL}/{rust_host_triple()}/rustup-init"
+        download(url, boot / "rustup-init", dry_run=ctx.dry_run)
+        if not ctx.dry_run:
+            (boot / "rustup-init").chmod(0o755)
+    if "nvm_node" in plan.actions:
+        install_url, version = node_settings(ctx, config)
+        download(install_url, boot / "nvm-install.sh", dry_run=ctx.dry_run)
+        if version is not None:
+            # nvm resolves versions via index.tab and picks .tar.xz or .tar.gz.
+            download(
+                f"{NODE_DIST_URL}/index.tab",
+                boot / "node" / "index.tab",
+                dry_run=ctx.dry_run,
+            )
+            base = f"{NODE_DIST_URL}/v{version}"
+            dist = boot / "node" / f"v{version}"
+            name = node_dist_prefix(version)
+            for file in ("SHASUMS256.txt", f"{name}.tar.xz", f"{name}.tar.gz"):
+                download(f"{base}/{file}", dist / file, dry_run=ctx.dry_run)
+
+
+def stage_git(
+    ctx: Context, plan: InstallPlan, config: dict[str, Any], root: Path
+) -> None:
+    """Copy the (refreshed) local mirrors of every repository actions clone."""
+    urls = [u for a in plan.actions for u in ACTION_GIT_SOURCES.get(a, [])]
+    for url in dict.fromkeys(urls):
+        mirror = ensure_git_mirror(url, config, dry_run=ctx.dry_run)
+        link_tree(mirror, git_mirror_path(root / "git", url), dry_run=ctx.dry_run)
+
+
+def stage_toolchains(ctx: Context, config: dict[str, Any], root: Path) -> None:
+    """Copy this host's configured rust toolchains into a bundled toolchain store.
+
+    Toolchains that are not installed here are skipped with a warning; `apply`
+    then needs network access for them.
+    """
+    _, toolchains = rustup_settings(config)
+    store = toolchain_store(config)
+    sources = [rustup_home(ctx)] + ([store / "rust"] if store else [])
+    for t in toolchains:
+        for home in sources:
+            name = match_toolchain(t, installed_rust_toolchains(home))
+            if name:
+                dest = root / "toolchains" / "rust" / "toolchains" / name
+                link_tree(home / "toolchains" / name, dest, dry_run=ctx.dry_run)
+                break
+        else:
+            print(f"warning: rust toolchain {t!r} is not installed; not bundled")
+
+
+def bundle_steps(
+    ctx: Context,
+    items: list[ModuleItems],
+    plan: InstallPlan,
+    config: dict[str, Any],
+    root: Path,
+) -> list[Step]:
+    """Return the (independent) download steps that populate a staging tree."""
+
+    def owners(pick: Any) -> list[str]:
+        return [m.name for m in items if pick(m)]
+
+    steps: list[Step] = []
+    if plan.packages or plan.casks:
+        dest = root / "packages" / ctx.manager
+        steps.append(
+            Step(
+                "packages",
+                owners(lambda m: m.packages or m.casks),
+                lambda: stage_packages(ctx, plan.packages, plan.casks, dest),
+            )
+        )
+    if plan.pip or plan.pipx:
+        steps.append(
+            Step(
+                "python",
+                owners(lambda m: m.pip or m.pipx),
+                lambda: stage_python(ctx, plan, root),
+            )
+        )
+    if plan.npm:
+        steps.append(
+            Step("npm", owners(lambda m: m.npm), lambda: stage_npm(ctx, plan.npm, root))
+        )
+    if plan.actions:
+        steps.append(
+            Step(
+                "bootstrap",
+                owners(lambda m: m.actions),
+                lambda: stage_bootstrap(ctx, plan, config, root),
+            )
+        )
+    if any(a in ACTION_GIT_SOURCES for a in plan.actions):
+        steps.append(
+            Step(
+                "git",
+                owners(lambda m: any(a in ACTION_GIT_SOURCES for a in m.actions)),
+                lambda: stage_git(ctx, plan, config, root),
+            )
+        )
+    if "rustup_toolchains" in plan.actions:
+        steps.append(
+            Step(
+                "toolchains",
+                owners(lambda m: "rustup_toolchains" in m.actions),
+                lambda: stage_toolchains(ctx, config, root),
+            )
+        )
+    return steps
+
+
+def write_plan(
+    ctx: Context,
+    items: list[ModuleItems],
+    plan: InstallPlan,
+    config: dict[str, Any],
+    root: Path,
+) -> None:
+    payload = {
+        "format": BUNDLE_FORMAT,
+        "platform": ctx.platform_key,
+        "manager": ctx.manager,
+        "items": to_data(items),
+        "plan": to_data(plan),
+        "config": config,
+    }
+    root.mkdir(parents=True, exist_ok=True)
+    with (root / "plan.json").open("w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, default=str)
+
+
+# ------------------------------ Archive Format ------------------------------
+
+
+def _walk(root: Path) -> list[tuple[str, Path]]:
+    """Return `(arcname, path)` for every entry under `root`, parents first."""
+    out = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        base = Path(dirpath)
+        for name in [*dirnames, *sorted(filenames)]:
+            path = base / name
+            out.append((path.relative_to(root).as_posix(), path))
+    return sorted(out)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def require_zstd(path: Path) -> None:
+    """Fail early if `path` needs the `zstd` CLI and it is not installed."""
+    if path.suffix == ".zst" and shutil.which("zstd") is None:
+        raise RuntimeError(f"zstd is required for {path.name}; install zstd first")
+
+
+def write_archive(root: Path, out: Path, *, dry_run: bool) -> None:
+    """Pack `root` into an indexed tar at `out` (zstd-compressed for `.zst`)."""
+    compress = out.suffix == ".zst"
+    tar_path = out.with_name(out.name[: -len(".zst")]) if compress else out
+    if dry_run:
+        print(f"+ tar -C {root} -cf {tar_path} {INDEX_NAME} .")
+        if compress:
+            run(
+                ["zstd", "-q", "-T0", "--rm", "-f", str(tar_path), "-o", str(out)],
+                dry_run=True,
+            )
+        return
+
+    entries = _walk(root)
+    hashes = {
+        arc: _sha256(p) for arc, p in entries if p.is_file() and not p.is_symlink()
+    }
+    reserve = TAR_BLOCK * (8 + sum(len(arc) + 200 for arc, _ in entries) // TAR_BLOCK)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(tar_path, "w", format=tarfile.PAX_FORMAT) as tar:
+        header = tarfile.TarInfo(INDEX_NAME)
+        header.size = reserve
+        header.mode = 0o644
+        tar.addfile(header, _Padding(reserve))
+        for arc, path in entries:
+            tar.add(path, arcname=arc, recursive=False)
+
+    files: dict[str, dict[str, Any]] = {}
+    with tarfile.open(tar_path, "r") as tar:
+        for member in tar:
+            if member.name == INDEX_NAME:
+                continue
+            entry: dict[str, Any] = {"mode": member.mode & 0o7777}
+            if member.isdir():
+                entry["type"] = "dir"
+            elif member.issym():
+                entry.update(type="symlink", target=member.linkname)
+            elif member.isfile():
+                entry.update(
+                    type="file",
+                    offset=member.offset_data,
+                    size=member.size,
+                    sha256=hashes[member.name],
+                )
+            else:
+                continue
+            files[member.name] = entry
+
+    index = json.dumps(
+        {"format": BUNDLE_FORMAT, "files": files}, separators=(",", ":")
+    ).encode("utf-8")
+    if len(index) > reserve:
+        raise RuntimeError(f"bundle index overflow ({len(index)} > {reserve} bytes)")
+    with tar_path.open("r+b") as f:
+        f.seek(TAR_BLOCK)
+        f.write(index.ljust(reserve, b" "))
+
+    if compress:
+        run(["zstd", "-q", "-T0", "--rm", "-f", str(tar_path), "-o", str(out)])
+
+
+class _Padding:
+    """File-like source of spaces used for the index placeholder."""
+
+    def __init__(self, size: int) -> None:
+        self._left = size
+
+    def read(self, n: int = -1) -> bytes:
+        n = self._left if n < 0 else min(n, self._left)
+        self._left -= n
+        return b" " * n
+
+
+def read_index(mapped: mmap.mmap) -> dict[str, Any]:
+    """Read the content index from the first member of a mapped bundle."""
+    header = tarfile.TarInfo.frombuf(
+        mapped[:TAR_BLOCK], tarfile.ENCODING, "surrogateescape"
+    )
+    if header.name != INDEX_NAME:
+        raise ValueError("not a setup bundle (missing leading index.json)")
+    index = json.loads(mapped[TAR_BLOCK : TAR_BLOCK + header.size])
+    if index.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"unsupported bundle format: {index.get('format')!r}")
+    return index
+
+
+def extract_bundle(bundle: Path) -> Path:
+    """Extract `bundle` under the cache (once) and return the extracted root.
+
+    Members are copied straight from a memory map of the tar at the offsets
+    recorded in the index, and each file's sha256 is verified. A `.zst`
+    bundle is decompressed next to the extracted trees for the duration of
+    the call only.
+    """
+    if bundle.suffix != ".zst":
+        return extract_tar(bundle)
+    require_zstd(bundle)
+    tar_path = cache_dir() / "bundles" / f"{bundle.name[: -len('.zst')]}.{os.getpid()}"
+    tar_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        run(["zstd", "-q", "-d", "-f", str(bundle), "-o", str(tar_path)])
+        return extract_tar(tar_path)
+    finally:
+        tar_path.unlink(missing_ok=True)
+
+
+def extract_tar(tar_path: Path) -> Path:
+    with tar_path.open("rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        index = read_index(mapped)
+        blob = json.dumps(index, sort_keys=True).encode("utf-8")
+        root = cache_dir() / "bundles" / hashlib.sha256(blob).hexdigest()[:16]
+        if (root / ".complete").exists():
+            return root
+
+        tmp = root.with_name(root.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            with memoryview(mapped) as view:
+                for name, entry in sorted(index["files"].items()):
+                    extract_member(view, tmp, name, entry)
+        except BaseException:
+            # A corrupt member must not leave a partial tree in the cache.
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    shutil.rmtree(root, ignore_errors=True)
+    tmp.rename(root)
+    (root / ".complete").touch()
+    return root
+
+
+def extract_member(
+    view: memoryview, root: Path, name: str, entry: dict[str, Any]
+) -> None:
+    """Write the index entry for `name` from the mapped bundle under `root`."""
+    dest = root / name
+    if entry["type"] == "dir":
+        dest.mkdir(parents=True, exist_ok=True)
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if entry["type"] == "symlink":
+        os.symlink(entry["target"], dest)
+        return
+    with view[entry["offset"] : entry["offset"] + entry["size"]] as data:
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise ValueError(f"bundle member {name} is corrupt")
+        with dest.open("wb") as out:
+            out.write(data)
+    dest.chmod(entry["mode"])
+
+
+# ------------------------------- Offline Apply -------------------------------
+
+
+def load_bundle_plan(
+    root: Path,
+) -> tuple[str, list[ModuleItems], InstallPlan, dict[str, Any]]:
+    """Return the platform, module items, plan and config stored in a bundle."""
+    with (root / "plan.json").open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = [records_from_data(ModuleItems, m) for m in data["items"]]
+    plan = records_from_data(InstallPlan, data["plan"])
+    return data["platform"], items, plan, data["config"]
+
+
+def offline_config(config: dict[str, Any], root: Path) -> dict[str, Any]:
+    """Point the URL/cache settings that actions use at the bundle contents."""
+    config = dict(config)
+    # Mirrors are never refreshed offline.
+    config["git_cache"] = {"dir": str(root / "git"), "ttl_seconds": 1 << 62}
+    if (root / "toolchains").is_dir():
+        config["toolchain_store"] = str(root / "toolchains")
+    nvm_script = root / "bootstrap" / "nvm-install.sh"
+    if nvm_script.exists():
+        nvm_cfg = config.get("nvm")
+        nvm_cfg = dict(nvm_cfg) if isinstance(nvm_cfg, dict) else {}
+        nvm_cfg["install_url"] = nvm_script.as_uri()
+        config["nvm"] = nvm_cfg
+    return config
+
+
+def offline_environ(root: Path) -> dict[str, str]:
+    """Environment that keeps nvm and Homebrew on the bundle contents."""
+    env = {
+        "NVM_NODEJS_ORG_MIRROR": (root / "bootstrap" / "node").as_uri(),
+        "NVM_SOURCE": git_mirror_path(root / "git", NVM_GIT_URL).as_uri(),
+        "HOMEBREW_NO_AUTO_UPDATE": "1",
+    }
+    if (root / "packages" / "brew").is_dir():
+        env["HOMEBREW_CACHE"] = str(root / "packages" / "brew")
+    return env
@@ -3,9 +3,19 @@
 """
 Shared primitives for the data-driven installer.
 
-This module is intentionally small and dependency-free so that:
-  - `setup/install.py` can stay focused on parsing YAML + orchestration
-  - action implementations can live in their own module without circular imports
+Everything here is needed by `setup/install.py` and by the action modules, so
+it lives below both (no circular imports) and uses only the standard library:
+
+  - event stream and hooks (`--events`, `register_hook`)
+  - command execution with per-step output capture
+  - the plan model, and the step scheduler with its resume journal
+  - ecosystem inventories shared by installs and `--verify`
+  - the action registry
+  - the git mirror cache and shared downloads
+  - home-directory helpers for `--homes`
+
+Subsystems used by a single command live in their own lazily imported
+modules instead (install_verify, install_bundle, install_deploy, ...).
 
 All paths are resolved from `__file__` in the caller and/or from `Context.repo_root`,
 so execution is stable regardless of the current working directory.
@@ -13,10 +23,25 @@ so execution is stable regardless of the current working directory.
 
 from __future__ import annotations
 
+import codecs
+import fcntl
+import hashlib
+import importlib
+import json
+import os
+import re
+import selectors
 import shlex
+import shutil
 import subprocess
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import IO, Any, Callable, Iterator, Union
 
 
 def shlex_join(parts: list[str]) -> str:
@@ -24,6 +49,255 @@ def shlex_join(parts: list[str]) -> str:
     return " ".join(shlex.quote(p) for p in parts)
 
 
+# ------------------------------- Event Stream -------------------------------
+
+
+class EventStream:
+    """Thread-safe NDJSON writer for installer progress events.
+
+    Every line carries a wall-clock timestamp, the event name and, when
+    emitted from inside a step, the step name and the modules it serves.
+    """
+
+    def __init__(self, fp: IO[str]) -> None:
+        self._fp = fp
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields: Any) -> None:
+        record: dict[str, Any] = {"ts": round(time.time(), 6), "event": event}
+        step = getattr(_current, "step", None)
+        if step is not None and "step" not in fields:
+            record["step"] = step.name
+            record["modules"] = step.modules
+        record.update(fields)
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+
+
+_events: EventStream | None = None
+_current = threading.local()
+
+
+def open_event_stream(target: str) -> EventStream:
+    """Open `--events` output: `fd:N` for an inherited descriptor, else a file."""
+    if target.startswith("fd:"):
+        fp = os.fdopen(int(target[3:]), "w", buffering=1, encoding="utf-8")
+    else:
+        fp = open(target, "a", buffering=1, encoding="utf-8")
+    return EventStream(fp)
+
+
+def set_event_stream(stream: EventStream | None) -> None:
+    global _events
+    _events = stream
+
+
+def emit(event: str, **fields: Any) -> None:
+    """Emit a progress event if an event stream is configured."""
+    if _events is not None:
+        _events.emit(event, **fields)
+
+
+# ----------------------------------- Hooks -----------------------------------
+#
+# In-process callbacks around steps, commands and caches, e.g. for metrics
+# (see install_metrics.py). Each event passes these keyword arguments:
+#
+#   pre_step       step
+#   post_step      step, status ("ok", "failed" or "skipped"), seconds, reason
+#   command        cmd, returncode (None if it could not start), seconds
+#   cache          cache (e.g. "selection", "git_mirror"), hit
+#   run_complete   steps, ok, seconds
+#
+# Hooks run on the thread that raised the event, so they must be thread-safe.
+# A failing hook is reported and never fails the install.
+
+HOOK_EVENTS = ("pre_step", "post_step", "command", "cache", "run_complete")
+
+HookFn = Callable[..., None]
+
+_hooks: dict[str, list[HookFn]] = {event: [] for event in HOOK_EVENTS}
+
+
+def register_hook(event: str, fn: HookFn) -> HookFn:
+    """Call `fn(**fields)` on every `event` (one of `HOOK_EVENTS`)."""
+    if event not in _hooks:
+        raise ValueError(f"Unknown hook event: {event}")
+    _hooks[event].append(fn)
+    return fn
+
+
+def call_hooks(event: str, **fields: Any) -> None:
+    for fn in _hooks[event]:
+        try:
+            fn(**fields)
+        except Exception as e:
+            write_terminal([f"warning: {event} hook failed: {e}"], stream=sys.stderr)
+
+
+def current_step() -> Step | None:
+    """Return the step the calling thread is running, if any."""
+    return getattr(_current, "step", None)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    """Report a lookup in one of the installer's caches (events and hooks)."""
+    emit("cache", cache=cache, hit=hit)
+    if _hooks["cache"]:
+        call_hooks("cache", cache=cache, hit=hit)
+
+
+# ------------------------------ Output Capture ------------------------------
+
+_terminal_lock = threading.Lock()
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def write_terminal(lines: list[str], *, stream: IO[str] | None = None) -> None:
+    """Write whole lines to the terminal without interleaving other writers."""
+    out = stream or sys.stdout
+    with _terminal_lock:
+        out.write("".join(line + "\n" for line in lines))
+        out.flush()
+
+
+class OutputCapture:
+    """Bounded capture of a concurrently running step's child output.
+
+    Lines are retained in a ring buffer capped at `max_chars`, so apt/rustup
+    logs of any size cost a fixed amount of memory. Progress is echoed as
+    `[step]`-prefixed lines at most once per `interval` (only the newest
+    `live_lines` of each burst), and the retained tail is written out in full
+    only when the step fails.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        *,
+        max_chars: int = 256 * 1024,
+        interval: float = 1.0,
+        live_lines: int = 3,
+    ) -> None:
+        self.label = label
+        self.max_chars = max_chars
+        self.interval = interval
+        self.live_lines = live_lines
+        self._lines: deque[str] = deque()
+        self._size = 0
+        self._partial = ""
+        self._pending = 0
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def feed(self, text: str) -> None:
+        with self._lock:
+            parts = _LINE_BREAK.split(self._partial + text)
+            self._partial = parts.pop()[-self.max_chars :]
+            for line in parts:
+                self._lines.append(line)
+                self._size += len(line) + 1
+                self._pending += 1
+            while self._size > self.max_chars and len(self._lines) > 1:
+                self._size -= len(self._lines.popleft()) + 1
+
+    def flush_live(self, *, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending or (
+                not force and now - self._last_flush < self.interval
+            ):
+                return
+            count = min(self._pending, self.live_lines, len(self._lines))
+            shown = [self._lines[-i] for i in range(count, 0, -1)]
+            skipped = self._pending - count
+            self._pending = 0
+            self._last_flush = now
+        prefix = f"[{self.label}] "
+        lines = [f"{prefix}... {skipped} more line(s)"] if skipped else []
+        write_terminal(lines + [prefix + line for line in shown])
+
+    def dump_tail(self) -> None:
+        with self._lock:
+            lines = list(self._lines)
+            if self._partial:
+                lines.append(self._partial)
+        if not lines:
+            return
+        prefix = f"[{self.label}] "
+        header = f"{prefix}---- output tail ({len(lines)} line(s)) ----"
+        write_terminal([header, *(prefix + line for line in lines)], stream=sys.stderr)
+
+
+def _run_captured(
+    cmd: list[str], capture: OutputCapture, *, check: bool, env: dict[str, str] | None
+) -> subprocess.CompletedProcess[str]:
+    """Run `cmd` with its output read through non-blocking pipes into `capture`."""
+    emit("start", cmd=cmd)
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    sel = selectors.DefaultSelector()
+    for pipe, name in ((proc.stdout, "stdout"), (proc.stderr, "stderr")):
+        assert pipe is not None
+        os.set_blocking(pipe.fileno(), False)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        sel.register(pipe, selectors.EVENT_READ, (name, decoder))
+    while sel.get_map():
+        for key, _ in sel.select(timeout=capture.interval):
+            name, decoder = key.data
+            try:
+                chunk = os.read(key.fd, 65536)
+            except BlockingIOError:
+                continue
+            text = decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+            if text:
+                capture.feed(text)
+                emit("output", stream=name, data=text)
+        capture.flush_live()
+    sel.close()
+    returncode = proc.wait()
+    capture.flush_live(force=True)
+    emit(
+        "finish",
+        cmd=cmd,
+        returncode=returncode,
+        seconds=round(time.monotonic() - start, 6),
+    )
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return subprocess.CompletedProcess(cmd, returncode)
+
+
+# ---------------------------- Command Execution -----------------------------
+
+
+def _pump(src: int, dest: IO[str], stream: str, step: Step | None) -> None:
+    """Copy a child's output to our own stream, emitting each chunk as it goes."""
+    _current.step = step
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = os.read(src, 65536)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            dest.write(text)
+            dest.flush()
+            emit("output", stream=stream, data=text)
+        if not chunk:
+            break
+    os.close(src)
+
+
 def run(
     cmd: list[str],
     *,
@@ -33,9 +307,113 @@ def run(
 ) -> subprocess.CompletedProcess[str] | None:
     """Run a command (argv style), optionally as a dry-run."""
     if dry_run:
-        print("+", shlex_join(cmd))
+        write_terminal(["+ " + shlex_join(cmd)])
+        emit("start", cmd=cmd, dry_run=True)
         return None
-    return subprocess.run(cmd, check=check, text=True, env=env)
+    if not _hooks["command"]:
+        return _run(cmd, check=check, env=env)
+    start = time.monotonic()
+    returncode = None
+    try:
+        result = _run(cmd, check=check, env=env)
+        returncode = result.returncode
+        return result
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+        raise
+    finally:
+        call_hooks(
+            "command",
+            cmd=cmd,
+            returncode=returncode,
+            seconds=time.monotonic() - start,
+        )
+
+
+def _run(
+    cmd: list[str], *, check: bool, env: dict[str, str] | None
+) -> subprocess.CompletedProcess[str]:
+    """Run `cmd` for real: captured inside a step, with events, or passed through."""
+    capture = getattr(_current, "capture", None)
+    if capture is not None:
+        return _run_captured(cmd, capture, check=check, env=env)
+    if _events is None:
+        return subprocess.run(cmd, check=check, text=True, env=env)
+
+    emit("start", cmd=cmd)
+    start = time.monotonic()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    try:
+        proc = subprocess.Popen(cmd, stdout=out_w, stderr=err_w, env=env)
+    except OSError as e:
+        for fd in (out_r, out_w, err_r, err_w):
+            os.close(fd)
+        emit("finish", cmd=cmd, error=str(e), seconds=time.monotonic() - start)
+        raise
+    os.close(out_w)
+    os.close(err_w)
+    step = getattr(_current, "step", None)
+    pumps = [
+        threading.Thread(target=_pump, args=(out_r, sys.stdout, "stdout", step)),
+        threading.Thread(target=_pump, args=(err_r, sys.stderr, "stderr", step)),
+    ]
+    for t in pumps:
+        t.start()
+    returncode = proc.wait()
+    for t in pumps:
+        t.join()
+    emit(
+        "finish",
+        cmd=cmd,
+        returncode=returncode,
+        seconds=round(time.monotonic() - start, 6),
+    )
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return subprocess.CompletedProcess(cmd, returncode)
+
+
+def run_parallel(fns: list[Callable[[], None]], *, jobs: int = 4) -> None:
+    """Call independent functions concurrently within the current step.
+
+    Worker threads inherit the caller's step and output capture, so their
+    `run()` output and events are attributed exactly like the caller's. The
+    first exception is re-raised once all workers have finished.
+    """
+    if len(fns) <= 1 or jobs <= 1:
+        for fn in fns:
+            fn()
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    step = getattr(_current, "step", None)
+    capture = getattr(_current, "capture", None)
+
+    def worker(fn: Callable[[], None]) -> None:
+        _current.step = step
+        _current.capture = capture
+        fn()
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(fns))) as pool:
+        futures = [pool.submit(worker, fn) for fn in fns]
+    for future in futures:
+        future.result()
+
+
+def run_many(
+    cmds: list[list[str]],
+    *,
+    dry_run: bool = False,
+    jobs: int = 4,
+    env: dict[str, str] | None = None,
+) -> None:
+    """Run independent commands concurrently within the current step."""
+    if dry_run:
+        for cmd in cmds:
+            run(cmd, dry_run=True)
+        return
+    run_parallel([lambda cmd=cmd: run(cmd, env=env) for cmd in cmds], jobs=jobs)
 
 
 def run_bash(
@@ -49,6 +427,20 @@ def run_bash(
     return run(["bash", "-lc", script], check=check, dry_run=dry_run, env=env)
 
 
+# Makes `npm` available to non-interactive shells on systems using nvm.
+NPM_PREAMBLE = """
+    set -e
+    if ! command -v npm >/dev/null 2>&1; then
+      export NVM_DIR="$HOME/.nvm"
+      [ -s "$NVM_DIR/nvm.sh" ] && . "$NVM_DIR/nvm.sh"
+    fi
+    if ! command -v npm >/dev/null 2>&1; then
+      echo "npm not found. Install Node.js first (e.g. include the languages-node module)." >&2
+      exit 1
+    fi
+"""
+
+
 @dataclass(frozen=True)
 class Context:
     """Context for installation operations."""
@@ -59,6 +451,858 @@ class Context:
     dry_run: bool
     yes: bool
     do_update: bool
+    # Root of an extracted offline bundle; installs then never touch the network.
+    offline: Path | None = None
+    # Home directory to provision (`--homes`); None is the invoking user's.
+    home: Path | None = None
+
+
+# -------------------------------- Plan Model ---------------------------------
+#
+# dependencies.yaml is compiled in one pass (`compile_modules`) into immutable,
+# hashable records, so later stages never re-walk or re-validate raw mappings.
+# A record's JSON form (`to_data`) is its YAML form, so selection caches and
+# bundles are read back through the same parsers.
+
+# Item kinds keyed by platform selector (`all`, `linux`, `macos`, ...).
+SELECTOR_KINDS = (
+    "pip",
+    "pipx",
+    "npm",
+    "go",
+    "cargo",
+    "rustup_components",
+    "dotnet_tools",
+    "binaries",
+    "actions",
+)
+MODULE_KEYS = {"packages", "casks", *SELECTOR_KINDS}
+
+
+class SchemaError(ValueError):
+    """Raised with every schema problem found by one compile pass."""
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__("Invalid dependencies.yaml:\n  " + "\n  ".join(errors))
+        self.errors = errors
+
+
+@dataclass(frozen=True)
+class AnyOf:
+    """`{any_of: [...]}`: the first candidate the package manager knows wins."""
+
+    __slots__ = ("options",)
+    options: tuple[str, ...]
+
+    @property
+    def label(self) -> str:
+        return " | ".join(self.options)
+
+    def to_data(self) -> dict[str, Any]:
+        return {"any_of": list(self.options)}
+
+
+# A system package: a plain (interned) name or an `AnyOf`.
+PackageEntry = Union[str, AnyOf]
+# An action name; resolved against the action registry when a plan is built.
+ActionRef = str
+
+
+@dataclass(frozen=True)
+class PipxItem:
+    """A pipx application, optionally pinned to a Python interpreter."""
+
+    __slots__ = ("name", "python")
+    name: str
+    python: str | None
+
+    def to_data(self) -> Any:
+        return {"name": self.name, "python": self.python} if self.python else self.name
+
+
+@dataclass(frozen=True)
+class Binary:
+    """A sha256-pinned download installed as an executable."""
+
+    __slots__ = ("name", "url", "sha256", "dest")
+    name: str
+    url: str
+    sha256: str
+    dest: str | None
+
+    def to_data(self) -> dict[str, Any]:
+        data = {"name": self.name, "url": self.url, "sha256": self.sha256}
+        return {**data, "dest": self.dest} if self.dest else data
+
+
+def _name(value: Any) -> str:
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"expected a non-empty string, got {value!r}")
+    return sys.intern(value)
+
+
+def _optional_name(value: Any) -> str | None:
+    return None if value is None else _name(value)
+
+
+def parse_package(value: Any) -> PackageEntry:
+    if isinstance(value, dict) and set(value) == {"any_of"}:
+        options = value["any_of"]
+        if not isinstance(options, list) or not options:
+            raise ValueError(f"any_of must be a non-empty list, got {options!r}")
+        return AnyOf(tuple(_name(o) for o in options))
+    return _name(value)
+
+
+def parse_pipx(value: Any) -> PipxItem:
+    if isinstance(value, dict) and set(value) <= {"name", "python"}:
+        return PipxItem(_name(value.get("name")), _optional_name(value.get("python")))
+    return PipxItem(_name(value), None)
+
+
+def parse_binary(value: Any) -> Binary:
+    if not isinstance(value, dict) or not set(value) <= {
+        "name",
+        "url",
+        "sha256",
+        "dest",
+    }:
+        raise ValueError(f"expected {{name, url, sha256, dest?}}, got {value!r}")
+    return Binary(
+        _name(value.get("name")),
+        _name(value.get("url")),
+        _name(value.get("sha256")).lower(),
+        _optional_name(value.get("dest")),
+    )
+
+
+# Per-kind parsers for a single item, raising ValueError on bad input.
+ITEM_PARSERS: dict[str, Callable[[Any], Any]] = {
+    "packages": parse_package,
+    "casks": _name,
+    "pipx": parse_pipx,
+    "binaries": parse_binary,
+    **{k: _name for k in SELECTOR_KINDS if k not in {"pipx", "binaries"}},
+}
+
+
+@dataclass(frozen=True)
+class Module:
+    """A compiled module.
+
+    `packages` holds `(manager, entries)` pairs and `selected` holds
+    `(kind, selector, entries)` triples, all as tuples of parsed records.
+    """
+
+    __slots__ = ("name", "packages", "casks", "selected")
+    name: str
+    packages: tuple[tuple[str, tuple[PackageEntry, ...]], ...]
+    casks: tuple[str, ...]
+    selected: tuple[tuple[str, str, tuple[Any, ...]], ...]
+
+    def select(self, manager: str, selectors: list[str]) -> ModuleItems:
+        """Return the items this module installs for `manager`/`selectors`.
+
+        Args:
+            manager: The host package manager (`brew`, `apt`, `pacman`).
+            selectors: Selector keys in order of precedence.
+        """
+        items = ModuleItems(name=self.name)
+        items.packages.extend(dict(self.packages).get(manager, ()))
+        if manager == "brew":
+            items.casks.extend(self.casks)
+        by_key = {(kind, key): entries for kind, key, entries in self.selected}
+        for kind in SELECTOR_KINDS:
+            out = getattr(items, kind)
+            for key in selectors:
+                out.extend(by_key.get((kind, key), ()))
+        return items
+
+
+def compile_items(
+    where: str, kind: str, values: Any, errors: list[str]
+) -> tuple[Any, ...]:
+    """Parse a list of `kind` items, appending every failure to `errors`."""
+    if not isinstance(values, list):
+        errors.append(f"{where}: expected a list, got {type(values).__name__}")
+        return ()
+    out = []
+    for i, value in enumerate(values):
+        try:
+            out.append(ITEM_PARSERS[kind](value))
+        except ValueError as e:
+            errors.append(f"{where}[{i}]: {e}")
+    return tuple(out)
+
+
+def compile_module(name: str, raw: Any, errors: list[str]) -> Module | None:
+    if not isinstance(raw, dict):
+        errors.append(f"module {name}: expected a mapping")
+        return None
+    count = len(errors)
+    for key in raw.keys() - MODULE_KEYS:
+        errors.append(f"module {name}: unknown key {key!r}")
+    casks = raw.get("casks")
+    for key in casks.keys() - {"brew"} if isinstance(casks, dict) else []:
+        errors.append(f"module {name}: casks.{key}: casks are brew-only")
+
+    def keyed(kind: str) -> list[tuple[str, tuple[Any, ...]]]:
+        value = raw.get(kind)
+        if value is None:
+            return []
+        if kind in SELECTOR_KINDS and isinstance(value, list):
+            value = {"all": value}
+        if not isinstance(value, dict):
+            errors.append(f"module {name}: {kind} must be a mapping")
+            return []
+        return [
+            (sys.intern(key), compile_items(f"{name}.{kind}.{key}", kind, v, errors))
+            for key, v in value.items()
+            if v is not None
+        ]
+
+    module = Module(
+        name=sys.intern(name),
+        packages=tuple(keyed("packages")),
+        casks=dict(keyed("casks")).get("brew", ()),
+        selected=tuple(
+            (kind, key, entries)
+            for kind in SELECTOR_KINDS
+            for key, entries in keyed(kind)
+        ),
+    )
+    return module if len(errors) == count else None
+
+
+def compile_modules(modules: Any) -> tuple[dict[str, Module], list[str]]:
+    """Compile the `modules` mapping of dependencies.yaml in a single pass.
+
+    Returns:
+        The modules that compiled cleanly, and every schema error found (one
+        message per bad item, not just the first).
+    """
+    if not isinstance(modules, dict):
+        return {}, ["modules: expected a mapping"]
+    errors: list[str] = []
+    out = {}
+    for name, raw in modules.items():
+        module = compile_module(str(name), raw, errors)
+        if module is not None:
+            out[module.name] = module
+    return out, errors
+
+
+def to_data(value: Any) -> Any:
+    """Return the JSON (= YAML) form of records and records inside containers."""
+    if hasattr(value, "to_data"):
+        return value.to_data()
+    if isinstance(value, (list, tuple)):
+        return [to_data(v) for v in value]
+    if isinstance(value, (ModuleItems, InstallPlan)):
+        return {k: to_data(v) for k, v in vars(value).items()}
+    if isinstance(value, dict):
+        return {k: to_data(v) for k, v in value.items()}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+@dataclass
+class ModuleItems:
+    """Validated installable items contributed by a single module."""
+
+    name: str
+    packages: list[PackageEntry] = field(default_factory=list)
+    casks: list[str] = field(default_factory=list)
+    pip: list[str] = field(default_factory=list)
+    pipx: list[PipxItem] = field(default_factory=list)
+    npm: list[str] = field(default_factory=list)
+    go: list[str] = field(default_factory=list)
+    cargo: list[str] = field(default_factory=list)
+    rustup_components: list[str] = field(default_factory=list)
+    dotnet_tools: list[str] = field(default_factory=list)
+    binaries: list[Binary] = field(default_factory=list)
+    actions: list[ActionRef] = field(default_factory=list)
+
+
+@dataclass
+class InstallPlan:
+    """Deduplicated items to install, merged across all selected modules."""
+
+    packages: list[str] = field(default_factory=list)
+    casks: list[str] = field(default_factory=list)
+    pip: list[str] = field(default_factory=list)
+    pipx: list[PipxItem] = field(default_factory=list)
+    npm: list[str] = field(default_factory=list)
+    go: list[str] = field(default_factory=list)
+    cargo: list[str] = field(default_factory=list)
+    rustup_components: list[str] = field(default_factory=list)
+    dotnet_tools: list[str] = field(default_factory=list)
+    binaries: list[Binary] = field(default_factory=list)
+    actions: list[ActionRef] = field(default_factory=list)
+
+
+def records_from_data(cls: Callable[..., Any], data: dict[str, Any]) -> Any:
+    """Rebuild a `ModuleItems`/`InstallPlan` from its `to_data` form.
+
+    Raises:
+        SchemaError: If any item does not parse.
+    """
+    errors: list[str] = []
+    fields = {
+        k: list(compile_items(k, k, v, errors)) if k in ITEM_PARSERS else v
+        for k, v in data.items()
+    }
+    if errors:
+        raise SchemaError(errors)
+    return cls(**fields)
+
+
+@dataclass
+class Step:
+    """A unit of installer work, attributed to the modules that requested it."""
+
+    name: str
+    modules: list[str]
+    fn: Callable[[], None]
+    after: list[str] = field(default_factory=list)
+    # Everything the step acts on; part of the plan hash used by the journal.
+    inputs: Any = None
+
+
+@contextmanager
+def step_scope(step: Step) -> Iterator[None]:
+    """Mark `step` as the current step and emit its begin/end events."""
+    previous = getattr(_current, "step", None)
+    _current.step = step
+    start = time.monotonic()
+    emit("step", phase="begin")
+    call_hooks("pre_step", step=step)
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        seconds = time.monotonic() - start
+        emit("step", phase="end", status=status, seconds=round(seconds, 6))
+        call_hooks("post_step", step=step, status=status, seconds=seconds, reason=None)
+        _current.step = previous
+
+
+def _run_captured_step(step: Step) -> None:
+    capture = OutputCapture(step.name)
+    _current.capture = capture
+    try:
+        with step_scope(step):
+            step.fn()
+    except BaseException:
+        capture.dump_tail()
+        raise
+    finally:
+        _current.capture = None
+
+
+def _run_passthrough_step(step: Step) -> None:
+    with step_scope(step):
+        step.fn()
+
+
+def plan_hash(platform_key: str, steps: list[Step]) -> str:
+    """Hash everything that defines a plan, so journals never cross plans."""
+    payload = {
+        "platform": platform_key,
+        "steps": [[s.name, s.inputs] for s in steps],
+    }
+    blob = json.dumps(payload, sort_keys=True, default=to_data).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+class StepJournal:
+    """Write-ahead journal of completed steps for one plan.
+
+    Each completed step is appended as a JSON line and fsync'd before the
+    next step is scheduled, so a crash or failure never loses progress.
+    """
+
+    def __init__(self, path: Path, *, resume: bool) -> None:
+        self.path = path
+        self.completed: set[str] = set()
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    self.completed.add(json.loads(line)["step"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # torn final write
+        self._fp = path.open("a" if resume else "w", encoding="utf-8")
+
+    def record(self, step: Step) -> None:
+        line = json.dumps({"step": step.name, "ts": round(time.time(), 6)})
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+
+    def finish(self) -> None:
+        """Close the journal and drop it once the whole plan has completed."""
+        self._fp.close()
+        self.path.unlink(missing_ok=True)
+
+
+class StepsFailed(RuntimeError):
+    """Raised after a `keep_going` run in which one or more steps failed."""
+
+    def __init__(self, failed: dict[str, BaseException], skipped: list[str]) -> None:
+        self.failed = failed
+        self.skipped = skipped
+        names = ", ".join(failed)
+        super().__init__(
+            f"{len(failed)} step(s) failed ({names}); "
+            f"{len(skipped)} dependent step(s) skipped"
+        )
+
+
+def run_steps(
+    steps: list[Step],
+    *,
+    jobs: int = 1,
+    journal: StepJournal | None = None,
+    keep_going: bool = False,
+) -> None:
+    """Execute steps, announcing the plan first.
+
+    With `jobs == 1` steps run one at a time, in list order except that each
+    step follows its `after` dependencies, with their output passed straight
+    through. Otherwise up to `jobs` steps whose `after` dependencies have
+    completed run concurrently, each with bounded output capture.
+
+    Steps already recorded in `journal` are skipped, and every newly completed
+    step is recorded. By default the first failure stops new steps from
+    starting and is re-raised; with `keep_going`, only steps that depend on a
+    failed step are skipped and `StepsFailed` is raised at the end.
+    """
+    emit(
+        "plan",
+        steps=[{"step": s.name, "modules": s.modules, "after": s.after} for s in steps],
+    )
+    start = time.monotonic()
+    ok = False
+    try:
+        _schedule_steps(steps, jobs=jobs, journal=journal, keep_going=keep_going)
+        ok = True
+    finally:
+        call_hooks("run_complete", steps=steps, ok=ok, seconds=time.monotonic() - start)
+
+
+def _dependency_order(steps: list[Step]) -> list[Step]:
+    """Return `steps` in list order, moving each after its `after` dependencies."""
+    by_name = {s.name: s for s in steps}
+    ordered: list[Step] = []
+    placed: dict[str, bool] = {}  # False while a step's dependencies are visited
+
+    def visit(step: Step) -> None:
+        state = placed.get(step.name)
+        if state is False:
+            raise RuntimeError(f"Unsatisfiable step dependencies: {step.name}")
+        if state:
+            return
+        placed[step.name] = False
+        for dep in step.after:
+            if dep in by_name:
+                visit(by_name[dep])
+        placed[step.name] = True
+        ordered.append(step)
+
+    for step in steps:
+        visit(step)
+    return ordered
+
+
+def _schedule_steps(
+    steps: list[Step],
+    *,
+    jobs: int,
+    journal: StepJournal | None,
+    keep_going: bool,
+) -> None:
+    known = {s.name for s in steps}
+    completed = journal.completed if journal is not None else set()
+    done: set[str] = set()
+    failed: dict[str, BaseException] = {}
+    skipped: list[str] = []
+
+    def admit(step: Step) -> bool:
+        """Return True if `step` should run now; record skips otherwise."""
+        if step.name in completed:
+            done.add(step.name)
+            emit(
+                "step",
+                step=step.name,
+                modules=step.modules,
+                phase="skip",
+                reason="journal",
+            )
+            cache_result("journal", True)
+            call_hooks(
+                "post_step", step=step, status="skipped", seconds=0.0, reason="journal"
+            )
+            return False
+        blockers = [d for d in step.after if d in failed or d in skipped]
+        if blockers:
+            skipped.append(step.name)
+            reason = f"dependency failed: {', '.join(blockers)}"
+            emit(
+                "step",
+                step=step.name,
+                modules=step.modules,
+                phase="skip",
+                reason=reason,
+            )
+            call_hooks(
+                "post_step", step=step, status="skipped", seconds=0.0, reason=reason
+            )
+            return False
+        return True
+
+    def settle(step: Step, exc: BaseException | None) -> None:
+        if exc is None:
+            done.add(step.name)
+            if journal is not None:
+                journal.record(step)
+        else:
+            failed[step.name] = exc
+
+    if jobs <= 1:
+        for step in _dependency_order(steps):
+            if not admit(step):
+                continue
+            try:
+                _run_passthrough_step(step)
+            except Exception as e:
+                if not keep_going:
+                    raise
+                settle(step, e)
+                continue
+            settle(step, None)
+    else:
+        from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+        pending = list(steps)
+        running: dict[Future[None], Step] = {}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for step in list(pending):
+                    if any(
+                        d in known
+                        and d not in done
+                        and d not in failed
+                        and d not in skipped
+                        for d in step.after
+                    ):
+                        continue
+                    pending.remove(step)
+                    if admit(step):
+                        running[pool.submit(_run_captured_step, step)] = step
+                if not running:
+                    if pending:
+                        raise RuntimeError(
+                            f"Unsatisfiable step dependencies: {[s.name for s in pending]}"
+                        )
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    settle(running.pop(future), future.exception())
+                if failed and not keep_going:
+                    pending.clear()
+        if failed and not keep_going:
+            raise next(iter(failed.values()))
+
+    if failed:
+        raise StepsFailed(failed, skipped)
+    if journal is not None:
+        journal.finish()
+
+
+def cache_dir() -> Path:
+    """Return the installer's cache directory (`$XDG_CACHE_HOME/dotfiles`)."""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "dotfiles"
+
+
+# --------------------------- Ecosystem Inventories ---------------------------
+#
+# Read-only lookups of what language tool installers have already installed,
+# shared by the installer (to skip those items) and `--verify`.
+
+
+def cargo_home(ctx: Context) -> Path:
+    return Path(user_env(ctx, "CARGO_HOME") or home_dir(ctx) / ".cargo")
+
+
+def tool_path(name: str, fallback: Path) -> str:
+    """Return `name` from PATH, else `fallback` (e.g. before a new login shell)."""
+    return shutil.which(name) or str(fallback / name)
+
+
+def go_bin_dir(ctx: Context) -> Path:
+    """Return where `go install` puts binaries, without running `go env`."""
+    gobin = user_env(ctx, "GOBIN")
+    if gobin:
+        return Path(gobin)
+    gopath = user_env(ctx, "GOPATH") or str(home_dir(ctx) / "go")
+    return Path(gopath.split(os.pathsep)[0]) / "bin"
+
+
+def go_binary_name(package: str) -> str:
+    """`mvdan.cc/sh/v3/cmd/shfmt@latest` -> `shfmt` (major-version suffixes skipped)."""
+    parts = package.split("@", 1)[0].rstrip("/").split("/")
+    if len(parts) > 1 and re.fullmatch(r"v\d+", parts[-1]):
+        parts.pop()
+    return parts[-1]
+
+
+def installed_cargo_crates(ctx: Context) -> set[str]:
+    """Return crate names recorded by `cargo install` in `.crates2.json`."""
+    try:
+        with (cargo_home(ctx) / ".crates2.json").open("r", encoding="utf-8") as f:
+            installs = json.load(f).get("installs") or {}
+    except (OSError, ValueError, AttributeError):
+        return set()
+    return {key.split(" ", 1)[0] for key in installs}
+
+
+def rustup_home(ctx: Context) -> Path:
+    return Path(user_env(ctx, "RUSTUP_HOME") or home_dir(ctx) / ".rustup")
+
+
+def installed_rustup_components(
+    ctx: Context, toolchain: str = "stable"
+) -> set[str] | None:
+    """Return components installed in a toolchain, read from its manifest."""
+    home = rustup_home(ctx)
+    try:
+        dirs = [
+            p for p in (home / "toolchains").iterdir() if p.name.startswith(toolchain)
+        ]
+        manifest = dirs[0] / "lib" / "rustlib" / "components"
+        lines = manifest.read_text(encoding="utf-8").split()
+    except (OSError, IndexError):
+        return None
+    # Entries carry the host triple, e.g. `rust-analyzer-x86_64-unknown-linux-gnu`.
+    out = set(lines)
+    for line in lines:
+        out.add(re.sub(r"-(x86_64|aarch64|arm64|i686)-.*$", "", line))
+    return out
+
+
+def dotnet_tool_installed(ctx: Context, tool: str) -> bool:
+    store = home_dir(ctx) / ".dotnet" / "tools" / ".store"
+    return (store / tool.lower()).is_dir()
+
+
+def binary_dest(ctx: Context, binary: Binary) -> Path:
+    """Return the install path of a `binaries` item (default `~/.local/bin/<name>`)."""
+    if not binary.dest:
+        return home_dir(ctx) / ".local" / "bin" / binary.name
+    if binary.dest == "~" or binary.dest.startswith("~/"):
+        return home_dir(ctx) / binary.dest[2:]
+    return Path(binary.dest)
+
+
+def file_matches_sha256(path: Path, sha256: str) -> bool:
+    digest = hashlib.sha256()
+    try:
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return False
+    return digest.hexdigest() == sha256.lower()
+
+
+# ------------------------------ Action Registry ------------------------------
+
+# Modules whose import registers actions; loaded on the first registry lookup.
+ACTION_MODULES = ["install_actions"]
+
+ActionFn = Callable[[Context, dict[str, Any]], None]
+CheckFn = Callable[[Context, dict[str, Any]], "str | None"]
+
+_actions: dict[str, ActionFn] = {}
+_action_checks: dict[str, CheckFn] = {}
+_action_config: dict[str, tuple[str, ...]] = {}
+_per_home_actions: set[str] = set()
+
+
+def register_action(
+    name: str, *, config: tuple[str, ...] = (), per_home: bool = False
+) -> Callable[[ActionFn], ActionFn]:
+    """Register the decorated function as the action called `name`.
+
+    Args:
+        name: The action name used in dependencies.yaml.
+        config: The `config` sections the action reads; `watch` re-runs the
+            action when one of them changes.
+        per_home: The action sets up a home directory (`home_dir(ctx)`), so
+            `--homes` runs it once per home instead of once per host.
+    """
+
+    def decorate(fn: ActionFn) -> ActionFn:
+        if name in _actions and _actions[name] is not fn:
+            raise ValueError(f"Duplicate action: {name}")
+        _actions[name] = fn
+        _action_config[name] = config
+        if per_home:
+            _per_home_actions.add(name)
+        return fn
+
+    return decorate
+
+
+def register_check(name: str) -> Callable[[CheckFn], CheckFn]:
+    """Register the decorated function as the `--verify` postcondition of `name`."""
+
+    def decorate(fn: CheckFn) -> CheckFn:
+        _action_checks[name] = fn
+        return fn
+
+    return decorate
+
+
+def _load_action_modules() -> None:
+    for module in ACTION_MODULES:
+        importlib.import_module(module)
+
+
+def action_registry() -> dict[str, ActionFn]:
+    """Return all registered actions, importing their modules on first use."""
+    _load_action_modules()
+    return _actions
+
+
+def action_checks() -> dict[str, CheckFn]:
+    """Return all registered action postconditions."""
+    _load_action_modules()
+    return _action_checks
+
+
+def action_config_keys() -> dict[str, tuple[str, ...]]:
+    """Return the `config` sections each registered action reads."""
+    _load_action_modules()
+    return _action_config
+
+
+def per_home_actions() -> set[str]:
+    """Return the actions registered with `per_home=True`."""
+    _load_action_modules()
+    return _per_home_actions
+
+
+def reload_actions() -> None:
+    """Re-import the action modules after their source changed on disk."""
+    _actions.clear()
+    _action_checks.clear()
+    _action_config.clear()
+    _per_home_actions.clear()
+    for module in ACTION_MODULES:
+        if module in sys.modules:
+            importlib.reload(sys.modules[module])
+        else:
+            importlib.import_module(module)
+
+
+# ------------------------------ Git Mirror Cache -----------------------------
+
+DEFAULT_GIT_CACHE_TTL = 24 * 60 * 60
+
+
+def git_cache_settings(config: dict[str, Any]) -> tuple[Path, int]:
+    """Return the mirror cache directory and refresh TTL from `config.git_cache`."""
+    git_cfg = config.get("git_cache") or {}
+    if not isinstance(git_cfg, dict):
+        git_cfg = {}
+    directory = git_cfg.get("dir")
+    base = (
+        Path(directory).expanduser()
+        if isinstance(directory, str)
+        else cache_dir() / "git"
+    )
+    ttl = git_cfg.get("ttl_seconds", DEFAULT_GIT_CACHE_TTL)
+    if not isinstance(ttl, int) or ttl < 0:
+        ttl = DEFAULT_GIT_CACHE_TTL
+    return base, ttl
+
+
+def git_mirror_path(base: Path, url: str) -> Path:
+    """Map a clone URL to its bare mirror, e.g. `<base>/github.com/org/repo.git`."""
+    rest = url.split("://", 1)[-1].split("@", 1)[-1].replace(":", "/")
+    rest = rest.rstrip("/")
+    if not rest.endswith(".git"):
+        rest += ".git"
+    return base.joinpath(*[p for p in rest.split("/") if p not in ("", ".", "..")])
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive `flock` on `path` (created if missing) for the block."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def ensure_git_mirror(url: str, config: dict[str, Any], *, dry_run: bool) -> Path:
+    """Create or refresh (at most once per TTL) the local bare mirror of `url`."""
+    base, ttl = git_cache_settings(config)
+    mirror = git_mirror_path(base, url)
+    stamp = mirror / "dotfiles-fetched"
+    if dry_run:
+        if not mirror.exists():
+            run(["git", "clone", "--mirror", url, str(mirror)], dry_run=True)
+        return mirror
+
+    # Concurrent installs (e.g. several homes on one host) share one fetch.
+    with file_lock(mirror.with_name(mirror.name + ".lock")):
+        if not mirror.exists():
+            cache_result("git_mirror", False)
+            tmp = mirror.with_name(mirror.name + ".tmp")
+            if tmp.exists():
+                shutil.rmtree(tmp)
+            run(["git", "clone", "--quiet", "--mirror", url, str(tmp)])
+            tmp.rename(mirror)
+            stamp.touch()
+            return mirror
+        try:
+            age = time.time() - stamp.stat().st_mtime
+        except OSError:
+            age = float("inf")
+        # A stale mirror still goes to the network, so it counts as a miss.
+        cache_result("git_mirror", age < ttl)
+        if age >= ttl:
+            run(["git", "--git-dir", str(mirror), "remote", "update", "--prune"])
+            stamp.touch()
+    return mirror
+
+
+def git_clone_cached(
+    url: str, dest: Path, config: dict[str, Any], *, dry_run: bool
+) -> None:
+    """Clone `url` into `dest` from the shared local mirror instead of the network.
+
+    The checkout is a local clone of the mirror (objects are hardlinked when
+    on the same filesystem), so it stays valid even if the cache is removed;
+    `origin` is then pointed back at the upstream URL.
+
+    `--local` is not passed: with it, git fails instead of copying when the
+    mirror is on another filesystem (a separate /home, a cache mount).
+    """
+    mirror = ensure_git_mirror(url, config, dry_run=dry_run)
+    run(["git", "clone", "--quiet", str(mirror), str(dest)], dry_run=dry_run)
+    run(["git", "-C", str(dest), "remote", "set-url", "origin", url], dry_run=dry_run)
 
 
 def platform_kind(platform_key: str) -> str:
@@ -68,8 +1312,122 @@ def platform_kind(platform_key: str) -> str:
     return platform_key
 
 
-def ensure_home_exists() -> Path:
-    """Ensure the user's home directory exists and return it."""
-    home = Path.home()
+# ------------------------------ Home Directories ------------------------------
+#
+# Everything an install writes under a home directory goes through `ctx`, so
+# one process can provision many homes (`--homes`). Child processes get
+# `home_env(ctx)`: HOME points at the target home, and per-user variables that
+# would redirect tools to the invoking user's files are dropped.
+
+USER_ENV_VARS = {
+    "CARGO_HOME",
+    "RUSTUP_HOME",
+    "GOPATH",
+    "GOBIN",
+    "NVM_DIR",
+    "NVM_BIN",
+    "PIPX_HOME",
+    "PIPX_BIN_DIR",
+    "XDG_CACHE_HOME",
+    "XDG_CONFIG_HOME",
+    "XDG_DATA_HOME",
+    "XDG_STATE_HOME",
+}
+
+
+def home_dir(ctx: Context) -> Path:
+    """Return the home directory `ctx` installs into."""
+    return ctx.home or Path.home()
+
+
+def user_env(ctx: Context, name: str) -> str | None:
+    """Return a per-user environment variable, ignored when provisioning `--homes`."""
+    return os.environ.get(name) if ctx.home is None else None
+
+
+def home_env(ctx: Context) -> dict[str, str] | None:
+    """Return the environment for commands that install into `ctx`'s home."""
+    if ctx.home is None:
+        return None
+    env = {k: v for k, v in os.environ.items() if k not in USER_ENV_VARS}
+    env["HOME"] = str(ctx.home)
+    return env
+
+
+def home_cache_dir(ctx: Context) -> Path:
+    """Return the installer's per-user cache directory for `ctx`'s home."""
+    return cache_dir() if ctx.home is None else ctx.home / ".cache" / "dotfiles"
+
+
+def ensure_home_exists(ctx: Context) -> Path:
+    """Ensure the home directory `ctx` installs into exists and return it."""
+    home = home_dir(ctx)
     home.mkdir(parents=True, exist_ok=True)
     return home
+
+
+def chown_home(ctx: Context) -> None:
+    """Give the files the installer created in a provisioned home to its owner.
+
+    Only root-owned files whose inode changed since this home was last chowned
+    (recorded in its installer cache) are handed over, so files the user or an
+    administrator put there are left alone. Files with several links (git
+    objects hardlinked from a mirror) stay root-owned so one user cannot
+    modify what other homes share.
+    """
+    if ctx.home is None or not hasattr(os, "geteuid") or os.geteuid() != 0:
+        return
+    st = ctx.home.stat()
+    if st.st_uid == 0:
+        return
+    marker = home_cache_dir(ctx) / "chowned"
+    started = time.time()
+    cmd = ["find", str(ctx.home), "-xdev", "-uid", "0"]
+    try:
+        # One second of slack for filesystems with coarse timestamps.
+        cmd += ["-newerct", f"@{int(marker.stat().st_mtime) - 1}"]
+    except OSError:
+        pass
+    cmd += ["(", "-type", "d", "-o", "-links", "1", ")"]
+    cmd += ["-exec", "chown", "-h", f"{st.st_uid}:{st.st_gid}", "{}", "+"]
+    run(cmd, dry_run=ctx.dry_run)
+    if not ctx.dry_run:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        os.utime(marker, (started, started))
+        os.chown(marker, st.st_uid, st.st_gid)
+
+
+# How long a `fetch_shared` download is reused before it is fetched again.
+DEFAULT_DOWNLOAD_TTL = 24 * 60 * 60
+
+
+def fetch_shared(
+    url: str, name: str, *, dry_run: bool, ttl: int = DEFAULT_DOWNLOAD_TTL
+) -> Path:
+    """Download `url` into the shared cache and return its path.
+
+    The download is reused by every home on the host until it is `ttl`
+    seconds old, then fetched again (like the git mirrors' refresh).
+    """
+    dest = cache_dir() / "downloads" / name
+    try:
+        age = time.time() - dest.stat().st_mtime
+    except OSError:
+        age = float("inf")
+    if dry_run:
+        if age >= ttl:
+            run(["curl", "-fLo", str(dest), "--create-dirs", url], dry_run=True)
+        return dest
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with file_lock(dest.with_name(dest.name + ".lock")):
+        try:
+            age = time.time() - dest.stat().st_mtime
+        except OSError:
+            age = float("inf")
+        cache_result("download", age < ttl)
+        if age >= ttl:
+            tmp = dest.with_name(dest.name + ".tmp")
+            run(["curl", "-fsSLo", str(tmp), url])
+            tmp.replace(dest)
+    return dest
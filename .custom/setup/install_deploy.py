@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+"""
+Hash-diffed dotfile deployment for the `dotfiles` action.
+
+Every file this repository tracks (`git ls-files`, minus
+`config.dotfiles.exclude`) is deployed to the same path under the home
+directory:
+
+  - files whose content (or symlink target) already matches are not written
+  - missing files are created
+  - differing files are backed up under `<backup_dir>/<timestamp>/` and
+    replaced
+
+Files are compared on a thread pool: sizes first, then SHA-256 of both
+sides. A manifest in the installer's per-user cache records the stat of each
+pair once it is known to match, so redeploying to a converged home only
+stats files.
+
+New content is staged next to each destination first. The backups and the
+`os.replace` onto every destination then run as one batch, so a failure while
+staging leaves the home untouched. Staged files left over by a failure are
+removed.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import fnmatch
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import stat
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+# Bump when the manifest layout changes.
+MANIFEST_FORMAT = 1
+
+# (source size, source mtime_ns, dest size, dest mtime_ns, dest inode)
+Stamp = tuple[int, int, int, int, int]
+
+
+@dataclasses.dataclass
+class Change:
+    path: str
+    src: Path
+    dest: Path
+    exists: bool
+
+
+# --------------------------------- Comparing ---------------------------------
+
+
+def tracked_files(root: Path, exclude: list[str]) -> list[str]:
+    """Return the paths git tracks under `root` (with submodules), minus `exclude`."""
+    try:
+        result = subprocess.run(
+            ["git", "-C", str(root), "ls-files", "-z", "--recurse-submodules"],
+            check=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(f"Cannot list the files tracked in {root}: {e}") from e
+    paths = os.fsdecode(result.stdout).split("\0")
+    return [
+        p
+        for p in paths
+        if p and not any(fnmatch.fnmatchcase(p, pattern) for pattern in exclude)
+    ]
+
+
+def file_digest(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def same_link(target: str, dest: Path) -> bool:
+    """Return whether the symlink `dest` points where `target` would."""
+    try:
+        current = os.readlink(dest)
+    except OSError:
+        return False
+    if current == target:
+        return True
+    return os.path.normpath(dest.parent / current) == os.path.normpath(
+        dest.parent / target
+    )
+
+
+def compare(src: Path, dest: Path, known: list[int] | None) -> str | Stamp:
+    """Compare one deployed file with its source.
+
+    Args:
+        src: The file (or symlink) in the repository.
+        dest: Where it is deployed.
+        known: The manifest stamp recorded when the two last matched.
+
+    Returns:
+        The pair's stamp when they match, else "create", "update", or "skip"
+        for sources that are neither files nor symlinks (uninitialized
+        submodules, files deleted from the work tree).
+    """
+    try:
+        src_st = os.lstat(src)
+    except FileNotFoundError:
+        return "skip"
+    if not (stat.S_ISREG(src_st.st_mode) or stat.S_ISLNK(src_st.st_mode)):
+        return "skip"
+    try:
+        dest_st = os.lstat(dest)
+    except (FileNotFoundError, NotADirectoryError):
+        return "create"
+    stamp = (
+        src_st.st_size,
+        src_st.st_mtime_ns,
+        dest_st.st_size,
+        dest_st.st_mtime_ns,
+        dest_st.st_ino,
+    )
+    if known is not None and tuple(known) == stamp:
+        return stamp
+    if stat.S_ISLNK(src_st.st_mode):
+        same = stat.S_ISLNK(dest_st.st_mode) and same_link(os.readlink(src), dest)
+    else:
+        same = (
+            stat.S_ISREG(dest_st.st_mode)
+            and dest_st.st_size == src_st.st_size
+            and not (dest_st.st_mode ^ src_st.st_mode) & stat.S_IXUSR
+            and file_digest(src) == file_digest(dest)
+        )
+    return stamp if same else "update"
+
+
+def plan_deploy(
+    root: Path,
+    home: Path,
+    paths: list[str],
+    known: dict[str, Any],
+    *,
+    jobs: int,
+) -> tuple[list[Change], dict[str, Stamp]]:
+    """Return the files to write and the stamps of those already deployed."""
+
+    def check(path: str) -> str | Stamp:
+        return compare(root / path, home / path, known.get(path))
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(check, paths))
+    changes = []
+    matched = {}
+    for path, result in zip(paths, results):
+        if isinstance(result, tuple):
+            matched[path] = result
+        elif result != "skip":
+            changes.append(Change(path, root / path, home / path, result == "update"))
+    return changes, matched
+
+
+# -------------------------------- Deploying ---------------------------------
+
+
+def staging_path(change: Change) -> Path:
+    return change.dest.with_name(f".{change.dest.name}.dotfiles-tmp")
+
+
+def stage(change: Change) -> Path:
+    """Write `change`'s new content next to its destination and return it."""
+    change.dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = staging_path(change)
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()  # left behind by an interrupted run
+    if change.src.is_symlink():
+        os.symlink(os.readlink(change.src), tmp)
+    else:
+        shutil.copy2(change.src, tmp)
+    return tmp
+
+
+def back_up(path: Path, backup: Path) -> None:
+    """Keep `path` at `backup`, as a hardlink where possible."""
+    backup.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, backup, follow_symlinks=False)
+    except OSError:  # directories, or another filesystem
+        shutil.move(str(path), str(backup))
+
+
+def run_backup_dir(base: Path) -> Path:
+    """Create and return a new, timestamped backup directory under `base`."""
+    base.mkdir(parents=True, exist_ok=True)
+    name = time.strftime("%Y%m%d-%H%M%S")
+    for n in itertools.count():
+        path = base / (name if n == 0 else f"{name}-{n}")
+        try:
+            path.mkdir()
+        except FileExistsError:
+            continue
+        return path
+    raise AssertionError("unreachable")
+
+
+def stamp_of(src: Path, dest: Path) -> Stamp:
+    src_st = os.lstat(src)
+    dest_st = os.lstat(dest)
+    return (
+        src_st.st_size,
+        src_st.st_mtime_ns,
+        dest_st.st_size,
+        dest_st.st_mtime_ns,
+        dest_st.st_ino,
+    )
+
+
+def read_manifest(path: Path, root: Path) -> dict[str, Any]:
+    """Return the stamps recorded for deployments from `root` ({} if none)."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if (
+        not isinstance(data, dict)
+        or data.get("format") != MANIFEST_FORMAT
+        or data.get("source") != str(root)
+        or not isinstance(data.get("files"), dict)
+    ):
+        return {}
+    return data["files"]
+
+
+def write_manifest(path: Path, root: Path, files: dict[str, Stamp]) -> None:
+    data = {"format": MANIFEST_FORMAT, "source": str(root), "files": files}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, sort_keys=True), encoding="utf-8")
+    tmp.replace(path)
+
+
+def deploy(
+    root: Path,
+    home: Path,
+    *,
+    exclude: list[str],
+    manifest: Path,
+    backup_dir: Path,
+    jobs: int,
+    dry_run: bool,
+) -> list[Change]:
+    """Deploy the files tracked in `root` into `home`.
+
+    Args:
+        root: The repository work tree.
+        home: The home directory to deploy into.
+        exclude: `fnmatch` patterns of repository paths not to deploy.
+        manifest: The stamp manifest for this home.
+        backup_dir: Where replaced files are kept, in a per-run subdirectory.
+        jobs: How many files to compare or stage concurrently.
+        dry_run: Print what would change without writing anything.
+
+    Returns:
+        The files that were (or, in a dry run, would be) written.
+    """
+    if root.resolve() == home.resolve():
+        return []  # a bare-repo checkout: the home is the work tree
+    known = read_manifest(manifest, root)
+    paths = tracked_files(root, exclude)
+    changes, matched = plan_deploy(root, home, paths, known, jobs=jobs)
+
+    if dry_run:
+        for change in changes:
+            print(f"+ {'update' if change.exists else 'create'} {change.dest}")
+        return changes
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            staged = list(pool.map(stage, changes))
+        backups = run_backup_dir(backup_dir) if any(c.exists for c in changes) else None
+        for change, tmp in zip(changes, staged):
+            if backups is not None and change.exists:
+                back_up(change.dest, backups / change.path)
+            os.replace(tmp, change.dest)
+    finally:
+        # Whatever failed, leave no staged files behind in the home.
+        for change in changes:
+            tmp = staging_path(change)
+            if tmp.is_symlink() or tmp.exists():
+                tmp.unlink()
+    for change in changes:
+        matched[change.path] = stamp_of(change.src, change.dest)
+
+    if {p: list(s) for p, s in matched.items()} != known:
+        write_manifest(manifest, root, matched)
+    if changes:
+        updated = sum(1 for c in changes if c.exists)
+        print(
+            f"dotfiles: {len(changes) - updated} created, {updated} updated"
+            + (f" (previous versions in {backups})" if updated else "")
+            + f", {len(matched) - len(changes)} unchanged"
+        )
+    return changes
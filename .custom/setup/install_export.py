@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+"""
+Container builds for `setup/install.py export`.
+
+`export --format dockerfile` turns a resolved plan into a Docker build
+context; `--format oci` also builds it into an OCI image archive.
+
+Each package manager's transaction is a single `RUN`, i.e. one layer, and
+the layers go from the most stable and expensive (system packages,
+toolchains) to the most frequently edited (Neovim plugins, npm tools). A
+layer's instruction and files depend only on its own items. Editing one npm
+package in `dependencies.yaml` therefore changes only the last instruction,
+and Docker's layer cache rebuilds only that layer.
+
+BuildKit cache mounts keep package-manager download caches out of the image
+and reuse them across builds.
+"""
+
+from __future__ import annotations
+
+import json
+import shlex
+import shutil
+import textwrap
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable
+
+from install_core import (
+    NPM_PREAMBLE,
+    AnyOf,
+    Context,
+    InstallPlan,
+    ModuleItems,
+    PackageEntry,
+    action_config_keys,
+    binary_dest,
+    run,
+    shlex_join,
+)
+
+BASE_IMAGES = {"ubuntu": "ubuntu:24.04", "manjaro": "manjarolinux/base:latest"}
+
+# Where the build context's `dotfiles/` and `layers/` land in the image.
+IMAGE_ROOT = Path("/opt/dotfiles")
+IMAGE_HOME = Path("/root")
+
+# Layers ahead of the actions, most stable and expensive first.
+FIRST_LAYERS = [
+    "packages",
+    "action:rustup_toolchains",
+    "action:nvm_node",
+    "rustup_components",
+    "cargo",
+    "go",
+    "dotnet_tools",
+    "binaries",
+    "pip",
+    "pipx",
+]
+# Layers behind the remaining actions; these change most often.
+LAST_LAYERS = ["action:nvim_plugins", "npm"]
+
+# Actions that make no sense in an image (no systemd, no login user, and no
+# repository checkout to deploy dotfiles from).
+SKIPPED_ACTIONS = {"docker_enable", "dotfiles"}
+
+# Installer modules that action layers run (`install.py action <name>`).
+INSTALLER_FILES = [
+    "install.py",
+    "install_core.py",
+    "install_actions.py",
+    "install_deploy.py",
+]
+
+# The interpreter `install.py action` layers need; base images lack it.
+INSTALLER_PACKAGES = {"apt": "python3", "pacman": "python"}
+
+# BuildKit cache mounts per layer; package databases are mounted
+# `sharing=locked` so concurrent builds do not corrupt them.
+CACHE_MOUNTS = {
+    "apt": ["/var/cache/apt", "/var/lib/apt"],
+    "pacman": ["/var/cache/pacman/pkg"],
+    "pip": ["/root/.cache/pip"],
+    "pipx": ["/root/.cache/pip"],
+    "npm": ["/root/.npm"],
+    "go": ["/root/go/pkg/mod", "/root/.cache/go-build"],
+    "cargo": ["/root/.cargo/registry", "/root/.cargo/git"],
+    # Clones from here copy objects when the mount is another filesystem.
+    "action:tmux_config": ["/root/.cache/dotfiles/git"],
+}
+
+
+@dataclass
+class Layer:
+    """One cached image layer: an optional `COPY` of its inputs and a `RUN`."""
+
+    name: str
+    modules: list[str]
+    script: list[str]
+    mounts: list[str] = field(default_factory=list)
+    # Build-context files (relative to `layers/<slug>/`) the script reads.
+    files: dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def slug(self) -> str:
+        return self.name.replace(":", "-")
+
+
+# --------------------------------- Scripts ----------------------------------
+
+
+def package_script(ctx: Context, entries: list[PackageEntry]) -> list[str]:
+    """Install system packages in one transaction, resolving `any_of` in the image."""
+    names = sorted({e for e in entries if isinstance(e, str)})
+    choices = [e for e in entries if isinstance(e, AnyOf)]
+    picks = [f"$(pick {shlex_join(list(e.options))})" for e in choices]
+    if ctx.manager == "apt":
+        probe = 'apt-cache show "$p" >/dev/null 2>&1'
+        script = [
+            # Keep downloaded .debs in the cache mount instead of deleting them.
+            "rm -f /etc/apt/apt.conf.d/docker-clean",
+            "apt-get update",
+        ]
+        install = ["apt-get", "install", "-y"]
+    elif ctx.manager == "pacman":
+        probe = 'pacman -Si "$p" >/dev/null 2>&1 || pacman -Sg "$p" >/dev/null 2>&1'
+        script = []
+        install = ["pacman", "-Syu", "--needed", "--noconfirm"]
+    else:
+        raise RuntimeError(f"Cannot export {ctx.manager} packages to a container")
+    if picks:
+        script.append(
+            'pick() { for p in "$@"; do if '
+            + probe
+            + '; then echo "$p"; return; fi; done; echo "$1"; }'
+        )
+    script.append(" ".join([shlex_join([*install, *names]), *picks]))
+    return script
+
+
+def pipx_script(plan: InstallPlan) -> list[str]:
+    script = []
+    for item in sorted(plan.pipx, key=lambda i: i.name):
+        cmd = ["pipx", "install", item.name]
+        if item.python:
+            cmd.extend(["--python", item.python])
+        script.append(shlex_join(cmd))
+    return script
+
+
+def binary_script(ctx: Context, plan: InstallPlan) -> list[str]:
+    """Download, verify and install each pinned binary."""
+    script = []
+    for binary in sorted(plan.binaries, key=lambda b: b.name):
+        dest = binary_dest(ctx, binary)
+        tmp = shlex.quote(f"{dest}.download")
+        script += [
+            shlex_join(["mkdir", "-p", str(dest.parent)]),
+            f"curl -fsSL -o {tmp} {shlex.quote(binary.url)}",
+            f"echo {shlex.quote(f'{binary.sha256}  {dest}.download')} | sha256sum -c -",
+            f"chmod 755 {tmp}",
+            f"mv {tmp} {shlex.quote(str(dest))}",
+        ]
+    return script
+
+
+def npm_script(plan: InstallPlan) -> list[str]:
+    preamble = textwrap.dedent(NPM_PREAMBLE).strip().splitlines()
+    return [*preamble, shlex_join(["npm", "i", "-g", *sorted(plan.npm)])]
+
+
+SCRIPTS: dict[str, Callable[[Context, InstallPlan], list[str]]] = {
+    "pip": lambda ctx, plan: [
+        shlex_join(["python3", "-m", "pip", "install", "--user", *sorted(plan.pip)])
+    ],
+    "pipx": lambda ctx, plan: pipx_script(plan),
+    "go": lambda ctx, plan: [shlex_join(["go", "install", p]) for p in sorted(plan.go)],
+    "cargo": lambda ctx, plan: [
+        shlex_join(["cargo", "install", "--locked", *sorted(plan.cargo)])
+    ],
+    "rustup_components": lambda ctx, plan: [
+        shlex_join(["rustup", "component", "add", *sorted(plan.rustup_components)])
+    ],
+    "dotnet_tools": lambda ctx, plan: [
+        shlex_join(["dotnet", "tool", "install", "--global", t])
+        for t in sorted(plan.dotnet_tools)
+    ],
+    "binaries": binary_script,
+    "npm": lambda ctx, plan: npm_script(plan),
+}
+
+
+# --------------------------------- Layers -----------------------------------
+
+
+def action_layer(
+    ctx: Context, action: str, modules: list[str], config: dict[str, Any]
+) -> Layer:
+    """Run one action through `install.py action` with only the config it reads.
+
+    The action's config file is the layer's only input besides the installer
+    code, so unrelated edits to `dependencies.yaml` keep the layer cached.
+    """
+    layer_dir = IMAGE_ROOT / "layers" / f"action-{action}"
+    sections = {
+        key: config[key]
+        for key in action_config_keys().get(action, ())
+        if key in config
+    }
+    files: dict[str, bytes] = {}
+    if action == "shell_env":
+        # Benchmarking shell startup during a build measures nothing useful.
+        sections["shell_env"] = {**(sections.get("shell_env") or {}), "bench_runs": 0}
+    if action == "nvim_plugins":
+        # The image gets this repo's lockfile, not the exporting user's.
+        plugins = sections.get("nvim_plugins") or {}
+        lockfile = plugins.get("lockfile") or (
+            ctx.repo_root.parent / ".config" / "nvim" / "lazy-lock.json"
+        )
+        lockfile = Path(lockfile).expanduser()
+        if lockfile.exists():
+            files["lazy-lock.json"] = lockfile.read_bytes()
+        sections["nvim_plugins"] = {
+            **plugins,
+            "lockfile": str(layer_dir / "lazy-lock.json"),
+        }
+    if "toolchain_store" in sections:
+        sections["toolchain_store"] = None
+    files["config.json"] = (
+        json.dumps(sections, sort_keys=True, indent=2, default=str) + "\n"
+    ).encode()
+    installer = IMAGE_ROOT / ctx.repo_root.name / "setup" / "install.py"
+    script = [
+        shlex_join(
+            [
+                "python3",
+                str(installer),
+                "action",
+                action,
+                "--platform",
+                ctx.platform_key,
+                "--config",
+                str(layer_dir / "config.json"),
+            ]
+        )
+    ]
+    return Layer(
+        f"action:{action}",
+        modules,
+        script,
+        mounts=CACHE_MOUNTS.get(f"action:{action}", []),
+        files=files,
+    )
+
+
+def plan_layers(
+    ctx: Context,
+    items: list[ModuleItems],
+    plan: InstallPlan,
+    config: dict[str, Any],
+) -> list[Layer]:
+    """Return the plan's layers, most stable first (see `FIRST_LAYERS`).
+
+    Args:
+        ctx: The context of the image (`home` is the image user's home).
+        items: Per-module items, in install order.
+        plan: The merged plan; its `packages` are ignored in favour of the
+            unresolved entries in `items`, which are resolved in the image.
+        config: The shared `config` mapping from dependencies.yaml.
+    """
+
+    def owners(pick: Any) -> list[str]:
+        return [m.name for m in items if pick(m)]
+
+    actions = [a for a in plan.actions if a not in SKIPPED_ACTIONS]
+    middle = [
+        f"action:{a}"
+        for a in actions
+        if f"action:{a}" not in FIRST_LAYERS and f"action:{a}" not in LAST_LAYERS
+    ]
+
+    layers = []
+    for name in [*FIRST_LAYERS, *middle, *LAST_LAYERS]:
+        if name == "packages":
+            entries = [e for m in items for e in m.packages]
+            interpreter = INSTALLER_PACKAGES[ctx.manager]
+            if actions and interpreter not in entries:
+                entries.append(interpreter)
+            if entries:
+                layers.append(
+                    Layer(
+                        name,
+                        owners(lambda m: m.packages),
+                        package_script(ctx, entries),
+                        mounts=CACHE_MOUNTS[ctx.manager],
+                    )
+                )
+        elif name.startswith("action:"):
+            action = name[len("action:") :]
+            if action in actions:
+                modules = owners(lambda m: action in m.actions)
+                layers.append(action_layer(ctx, action, modules, config))
+        elif getattr(plan, name):
+            layers.append(
+                Layer(
+                    name,
+                    owners(lambda m: getattr(m, name)),
+                    SCRIPTS[name](ctx, plan),
+                    mounts=CACHE_MOUNTS.get(name, []),
+                )
+            )
+    return layers
+
+
+# -------------------------------- Rendering ---------------------------------
+
+
+def render_run(layer: Layer) -> str:
+    sharing = ",sharing=locked" if layer.name == "packages" else ""
+    mounts = "".join(
+        f"--mount=type=cache,target={target}{sharing} " for target in layer.mounts
+    )
+    if len(layer.script) == 1:
+        return f"RUN {mounts}{layer.script[0]}"
+    script = layer.script if layer.script[0] == "set -e" else ["set -e", *layer.script]
+    body = "\n".join(script)
+    return f"RUN {mounts}<<'EOF'\n{body}\nEOF"
+
+
+def render_dockerfile(ctx: Context, layers: list[Layer], base: str) -> str:
+    """Render the Dockerfile for `layers` on top of the `base` image."""
+    home = str(IMAGE_HOME)
+    env = [
+        f"HOME={home}",
+        f"NVM_DIR={home}/.nvm",
+        f"PATH={home}/.local/bin:{home}/.cargo/bin:{home}/go/bin:"
+        f"{home}/.dotnet/tools:$PATH",
+        # The image is the environment; there is no system Python to protect.
+        "PIP_BREAK_SYSTEM_PACKAGES=1",
+    ]
+    if ctx.manager == "apt":
+        env.append("DEBIAN_FRONTEND=noninteractive")
+    lines = [
+        "# syntax=docker/dockerfile:1",
+        f"# Generated by `setup/install.py export` for {ctx.platform_key}.",
+        f"FROM {base}",
+        'SHELL ["/bin/bash", "-o", "pipefail", "-c"]',
+        "ENV " + " \\\n    ".join(env),
+    ]
+    copied_installer = False
+    for layer in layers:
+        lines.append("")
+        lines.append(f"# {layer.name} ({', '.join(layer.modules) or 'no module'})")
+        if layer.name.startswith("action:") and not copied_installer:
+            lines.append(f"COPY dotfiles/ {IMAGE_ROOT}/")
+            copied_installer = True
+        if layer.files:
+            target = IMAGE_ROOT / "layers" / layer.slug
+            lines.append(f"COPY layers/{layer.slug}/ {target}/")
+        lines.append(render_run(layer))
+    return "\n".join(lines) + "\n"
+
+
+def write_context(ctx: Context, layers: list[Layer], out: Path, *, base: str) -> None:
+    """Write a Docker build context (Dockerfile, installer, layer inputs) to `out`."""
+    for name in ("dotfiles", "layers"):
+        shutil.rmtree(out / name, ignore_errors=True)
+    out.mkdir(parents=True, exist_ok=True)
+    (out / "Dockerfile").write_text(
+        render_dockerfile(ctx, layers, base), encoding="utf-8"
+    )
+    if any(layer.name.startswith("action:") for layer in layers):
+        setup = out / "dotfiles" / ctx.repo_root.name / "setup"
+        setup.mkdir(parents=True)
+        for name in INSTALLER_FILES:
+            shutil.copy2(ctx.repo_root / "setup" / name, setup / name)
+    for layer in layers:
+        for name, content in layer.files.items():
+            path = out / "layers" / layer.slug / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+
+def build_oci(context: Path, out: Path, *, tag: str | None, dry_run: bool) -> None:
+    """Build the context with BuildKit and write an OCI image archive to `out`."""
+    if shutil.which("docker") is None and not dry_run:
+        raise RuntimeError("--format oci needs `docker buildx` to build the image.")
+    cmd = ["docker", "buildx", "build", "--output", f"type=oci,dest={out}"]
+    if tag:
+        cmd += ["--tag", tag]
+    run([*cmd, str(context)], dry_run=dry_run)
+
+
+def image_context(ctx: Context) -> Context:
+    """Return the context of the image build, whose user is root."""
+    return replace(ctx, home=IMAGE_HOME)
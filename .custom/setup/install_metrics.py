@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+Prometheus textfile exporter for `setup/install.py --metrics-textfile FILE`.
+
+node-exporter's textfile collector serves every `*.prom` file in its
+`--collector.textfile.directory`. The exporter registers installer hooks
+(see `register_hook` in install_core.py) and rewrites FILE after every run.
+Counters and histograms accumulate across runs, so graphing their `rate()`
+shows provisioning performance over time.
+
+  dotfiles_install_module_duration_seconds   histogram: time in a module's steps per run
+  dotfiles_install_steps_total               counter: steps by status (ok/failed/skipped)
+  dotfiles_install_failures_total            counter: failed steps per module
+  dotfiles_install_cache_requests_total      counter: installer cache lookups by hit/miss
+  dotfiles_install_commands_total            counter: commands run by status
+  dotfiles_install_command_seconds_total     counter: time spent in commands
+  dotfiles_install_runs_total                counter: runs by result
+  dotfiles_install_last_run_*                gauges: timestamp, duration, success
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from install_core import Step, file_lock, register_hook
+
+PREFIX = "dotfiles_install_"
+
+# Provisioning steps take seconds to tens of minutes.
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+METRICS = {
+    "module_duration_seconds": (
+        "histogram",
+        "Seconds spent in the steps serving a module, per run.",
+    ),
+    "steps_total": ("counter", "Installer steps by status."),
+    "failures_total": ("counter", "Failed installer steps per module."),
+    "cache_requests_total": ("counter", "Installer cache lookups by result."),
+    "commands_total": ("counter", "Commands run by the installer, by status."),
+    "command_seconds_total": ("counter", "Seconds spent in installer commands."),
+    "runs_total": ("counter", "Installer runs by result."),
+    "last_run_timestamp_seconds": ("gauge", "Unix time the last run finished."),
+    "last_run_duration_seconds": ("gauge", "Wall time of the last run."),
+    "last_run_success": ("gauge", "1 if the last run succeeded, else 0."),
+}
+
+# `name{labels} value` as written by `render_textfile`.
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$")
+BUCKET_BOUND = re.compile(r'(?:^\{|,)le="([^"]*)"')
+
+# A series is its full sample name plus its rendered label set.
+Series = tuple[str, str]
+
+
+def format_labels(**labels: Any) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        escaped = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def read_textfile(path: Path) -> dict[Series, float]:
+    """Return the samples of a textfile written by a previous run."""
+    samples: dict[Series, float] = {}
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return samples
+    for line in lines:
+        match = SAMPLE.match(line)
+        if match is None or not match.group(1).startswith(PREFIX):
+            continue
+        try:
+            value = float(match.group(3))
+        except ValueError:
+            continue
+        samples[(match.group(1), match.group(2) or "")] = value
+    return samples
+
+
+def metric_name(series_name: str) -> str:
+    """Map a sample name (e.g. `..._bucket`) back to its metric in `METRICS`."""
+    name = series_name[len(PREFIX) :]
+    for suffix in ("_bucket", "_sum", "_count"):
+        base = name[: -len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ("",))[0] == "histogram":
+            return base
+    return name
+
+
+def series_order(series: Series) -> tuple[str, str, float]:
+    """Sort key placing histogram buckets in increasing `le` order."""
+    name, labels = series
+    match = BUCKET_BOUND.search(labels)
+    if match is None:
+        return name, labels, 0.0
+    return name, BUCKET_BOUND.sub("", labels), float(match.group(1))
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_textfile(samples: dict[Series, float]) -> str:
+    lines = []
+    by_metric: dict[str, list[Series]] = {}
+    for series in samples:
+        by_metric.setdefault(metric_name(series[0]), []).append(series)
+    for name, series_list in sorted(by_metric.items()):
+        kind, help_text = METRICS.get(name, ("untyped", ""))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for series in sorted(series_list, key=series_order):
+            lines.append(f"{series[0]}{series[1]} {format_value(samples[series])}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusTextfile:
+    """Collect installer metrics through hooks and write them after each run."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # Per-run increments, merged into the file's totals on `run_complete`.
+        self._counts: dict[Series, float] = {}
+        self._module_seconds: dict[str, float] = {}
+
+    def install(self) -> None:
+        register_hook("post_step", self.on_post_step)
+        register_hook("command", self.on_command)
+        register_hook("cache", self.on_cache)
+        register_hook("run_complete", self.on_run_complete)
+
+    def _add(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        series = (PREFIX + name, format_labels(**labels))
+        self._counts[series] = self._counts.get(series, 0.0) + value
+
+    def on_post_step(
+        self, step: Step, status: str, seconds: float, reason: str | None
+    ) -> None:
+        with self._lock:
+            self._add("steps_total", status=status)
+            if status == "skipped":
+                return
+            for module in step.modules:
+                self._module_seconds[module] = (
+                    self._module_seconds.get(module, 0.0) + seconds
+                )
+                if status == "failed":
+                    self._add("failures_total", module=module)
+
+    def on_command(
+        self, cmd: list[str], returncode: int | None, seconds: float
+    ) -> None:
+        with self._lock:
+            self._add("commands_total", status="ok" if returncode == 0 else "failed")
+            self._add("command_seconds_total", seconds)
+
+    def on_cache(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            self._add(
+                "cache_requests_total", cache=cache, result="hit" if hit else "miss"
+            )
+
+    def on_run_complete(self, steps: list[Step], ok: bool, seconds: float) -> None:
+        with self._lock:
+            for module, total in self._module_seconds.items():
+                self._observe("module_duration_seconds", total, module=module)
+            self._add("runs_total", result="ok" if ok else "failed")
+            gauges = {
+                (PREFIX + "last_run_timestamp_seconds", ""): round(time.time(), 3),
+                (PREFIX + "last_run_duration_seconds", ""): round(seconds, 3),
+                (PREFIX + "last_run_success", ""): 1.0 if ok else 0.0,
+            }
+            # Runs sharing the file (e.g. several homes) must not drop each
+            # other's increments between the read and the write.
+            with file_lock(self.path.with_name(f".{self.path.name}.lock")):
+                samples = read_textfile(self.path)
+                for series, value in self._counts.items():
+                    samples[series] = samples.get(series, 0.0) + value
+                samples.update(gauges)
+                self._write(samples)
+            self._counts.clear()
+            self._module_seconds.clear()
+
+    def _observe(self, name: str, value: float, **labels: Any) -> None:
+        # Every bucket is written, so each series has the full set of `le`s.
+        for le in DURATION_BUCKETS:
+            self._add(f"{name}_bucket", 1.0 if value <= le else 0.0, le=le, **labels)
+        self._add(f"{name}_bucket", le="+Inf", **labels)
+        self._add(f"{name}_sum", value, **labels)
+        self._add(f"{name}_count", **labels)
+
+    def _write(self, samples: dict[Series, float]) -> None:
+        """Replace the textfile atomically, so the collector never reads half of it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(render_textfile(samples), encoding="utf-8")
+        tmp.chmod(0o644)
+        tmp.replace(self.path)
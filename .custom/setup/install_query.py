@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+Read-only questions about `dependencies.yaml` for `setup/install.py query`.
+
+  why <name>          which modules (and through them, profiles) bring in an item
+  what <profile>      the fully resolved item set of a profile, per manager/kind
+  diff <a> <b>        items one profile has and the other does not
+
+All answers come from the reverse index stored in the checked-in
+`dependencies.json` (see `build_index` in install.py), so a lookup is a JSON
+load plus a few dictionary reads and is cheap enough for pre-commit hooks.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+from typing import Any
+
+# A platform filter: the platform's package manager and its selector keys.
+PlatformFilter = tuple[str, list[str]]
+
+# Item kinds whose entries are keyed by package manager rather than selector.
+MANAGER_KINDS = {"apt": "apt", "pacman": "pacman", "brew": "brew", "cask": "brew"}
+
+
+def group_name(kind: str, selector: str | None, platform: PlatformFilter | None) -> str:
+    if selector is None or platform is not None:
+        return kind
+    return f"{kind}[{selector}]"
+
+
+def visible(kind: str, selector: str | None, platform: PlatformFilter | None) -> bool:
+    """Return True if a row applies to the filtered platform (or no filter)."""
+    if platform is None:
+        return True
+    manager, selectors = platform
+    if kind in MANAGER_KINDS:
+        return MANAGER_KINDS[kind] == manager
+    return selector in selectors
+
+
+def resolve_items(
+    index: dict[str, Any], profile: str, platform: PlatformFilter | None
+) -> dict[str, list[str]]:
+    """Return `group -> labels` for every item `profile` installs."""
+    modules = index["profiles"].get(profile)
+    if modules is None:
+        raise KeyError(f"Unknown profile: {profile}")
+    groups: dict[str, dict[str, None]] = {}
+    for module in modules:
+        for kind, selector, label in index["module_items"].get(module, []):
+            if visible(kind, selector, platform):
+                group = group_name(kind, selector, platform)
+                groups.setdefault(group, {})[label] = None
+    return {group: list(labels) for group, labels in sorted(groups.items())}
+
+
+def write_json(value: Any) -> None:
+    sys.stdout.write(json.dumps(value, indent=2) + "\n")
+
+
+def query_why(
+    index: dict[str, Any],
+    name: str,
+    *,
+    platform: PlatformFilter | None = None,
+    as_json: bool = False,
+) -> int:
+    """Print every module/profile that brings in `name`; exits 1 if none does."""
+    rows = [
+        {
+            "module": module,
+            "kind": group_name(kind, selector, platform),
+            "item": label,
+            "profiles": index["module_profiles"].get(module, []),
+        }
+        for module, kind, selector, label in index["items"].get(name, [])
+        if visible(kind, selector, platform)
+    ]
+    if as_json:
+        write_json(rows)
+    else:
+        for row in rows:
+            profiles = ", ".join(row["profiles"]) or "(no profile)"
+            print(
+                f"{row['kind']:<14} {row['item']:<28} "
+                f"module {row['module']:<20} profiles: {profiles}"
+            )
+        if not rows:
+            print(f"{name}: not referenced by any module", file=sys.stderr)
+    return 0 if rows else 1
+
+
+def query_what(
+    index: dict[str, Any],
+    profile: str,
+    *,
+    platform: PlatformFilter | None = None,
+    as_json: bool = False,
+) -> int:
+    """Print the resolved item set of `profile`, grouped per manager/kind."""
+    groups = resolve_items(index, profile, platform)
+    if as_json:
+        write_json({"modules": index["profiles"][profile], "items": groups})
+        return 0
+    print(f"modules ({len(index['profiles'][profile])})")
+    print("  " + " ".join(index["profiles"][profile]))
+    for group, labels in groups.items():
+        print(f"{group} ({len(labels)})")
+        for label in labels:
+            print(f"  {label}")
+    return 0
+
+
+def query_diff(
+    index: dict[str, Any],
+    left: str,
+    right: str,
+    *,
+    platform: PlatformFilter | None = None,
+    as_json: bool = False,
+) -> int:
+    """Print items only in `left` (-) or only in `right` (+); exits 1 if they differ."""
+    a = resolve_items(index, left, platform)
+    b = resolve_items(index, right, platform)
+    out: dict[str, dict[str, list[str]]] = {}
+    for group in sorted(set(a) | set(b)):
+        only_a = [x for x in a.get(group, []) if x not in set(b.get(group, []))]
+        only_b = [x for x in b.get(group, []) if x not in set(a.get(group, []))]
+        if only_a or only_b:
+            out[group] = {"-": only_a, "+": only_b}
+    if as_json:
+        write_json(out)
+    else:
+        print(f"--- {left}")
+        print(f"+++ {right}")
+        for group, change in out.items():
+            print(f"@@ {group}")
+            for label in change["-"]:
+                print(f"-{label}")
+            for label in change["+"]:
+                print(f"+{label}")
+    return 1 if out else 0
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+Read-only drift detection for `setup/install.py --verify`.
+
+Verification answers "is this host already converged?" without touching it:
+no package-manager transactions, no sudo, no network. Each source of truth
+(installed system packages, pip distributions, pipx venvs, the global npm
+root, cargo/rustup manifests, action postconditions) is queried once, concurrently, and every
+selected item is then checked against those inventories in memory.
+
+The report is NDJSON on stdout: one line per checked item followed by a
+summary line. The exit code is 1 if anything drifted, 0 otherwise.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from install_core import (
+    AnyOf,
+    Context,
+    ModuleItems,
+    action_checks,
+    binary_dest,
+    dotnet_tool_installed,
+    file_matches_sha256,
+    go_bin_dir,
+    go_binary_name,
+    home_dir,
+    installed_cargo_crates,
+    installed_rustup_components,
+    platform_kind,
+    user_env,
+)
+
+# ------------------------------- Inventories --------------------------------
+
+
+def capture_lines(cmd: list[str]) -> list[str] | None:
+    """Run a read-only query and return its stdout lines (None on failure)."""
+    if shutil.which(cmd[0]) is None:
+        return None
+    result = subprocess.run(
+        cmd,
+        check=False,
+        text=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.splitlines()
+
+
+def installed_system_packages(ctx: Context) -> set[str] | None:
+    """Return the names of installed system packages (and pacman groups)."""
+    if ctx.manager == "apt":
+        lines = capture_lines(
+            ["dpkg-query", "-W", "-f=${Package}\t${db:Status-Abbrev}\n"]
+        )
+        if lines is None:
+            return None
+        out = set()
+        for line in lines:
+            name, _, status = line.partition("\t")
+            if status.startswith("ii"):
+                out.add(name)
+                out.add(name.split(":", 1)[0])
+        return out
+
+    if ctx.manager == "pacman":
+        lines = capture_lines(["pacman", "-Qq"])
+        if lines is None:
+            return None
+        out = set(lines)
+        # Groups such as `base-devel` are satisfied by their installed members.
+        out.update(line.split()[0] for line in capture_lines(["pacman", "-Qg"]) or [])
+        return out
+
+    if ctx.manager == "brew":
+        lines = capture_lines(["brew", "list", "--formula", "-1", "--full-name"])
+        if lines is None:
+            return None
+        return {name.rsplit("/", 1)[-1] for name in lines} | set(lines)
+
+    return None
+
+
+def installed_casks(ctx: Context) -> set[str] | None:
+    if ctx.manager != "brew":
+        return set()
+    lines = capture_lines(["brew", "list", "--cask", "-1"])
+    return set(lines) if lines is not None else None
+
+
+def normalize_dist_name(name: str) -> str:
+    """Normalize a Python distribution name (PEP 503)."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def installed_pip_distributions() -> set[str] | None:
+    """Return normalized distribution names visible to the target `python3`.
+
+    This deliberately avoids `pip list`, which costs far more than the import
+    system scan below.
+    """
+    lines = capture_lines(
+        [
+            "python3",
+            "-c",
+            "import importlib.metadata as m\n"
+            "for d in m.distributions(): print(d.metadata['Name'])",
+        ]
+    )
+    if lines is None:
+        return None
+    return {normalize_dist_name(line) for line in lines if line}
+
+
+def pipx_venv_root(ctx: Context) -> Path:
+    home = user_env(ctx, "PIPX_HOME")
+    if home:
+        return Path(home) / "venvs"
+    xdg = home_dir(ctx) / ".local" / "share" / "pipx" / "venvs"
+    legacy = home_dir(ctx) / ".local" / "pipx" / "venvs"
+    return xdg if xdg.is_dir() or not legacy.is_dir() else legacy
+
+
+def npm_global_root(ctx: Context, config: dict[str, Any]) -> Path | None:
+    """Locate the global `node_modules` directory without starting nvm."""
+    lines = capture_lines(["npm", "root", "-g"]) if ctx.home is None else None
+    if lines:
+        return Path(lines[0])
+    nvm_cfg = config.get("nvm") or {}
+    if not isinstance(nvm_cfg, dict):
+        return None
+    versions = nvm_cfg.get("node_versions") or {}
+    if not isinstance(versions, dict):
+        return None
+    version = versions.get(ctx.platform_key) or versions.get(
+        platform_kind(ctx.platform_key)
+    )
+    if version is None:
+        return None
+    node_dir = (
+        home_dir(ctx) / ".nvm" / "versions" / "node" / f"v{str(version).lstrip('v')}"
+    )
+    return node_dir / "lib" / "node_modules"
+
+
+# --------------------------------- Checking ---------------------------------
+
+
+def verify(ctx: Context, items: list[ModuleItems], config: dict[str, Any]) -> int:
+    """Check every selected item and print an NDJSON drift report.
+
+    Args:
+        ctx: The installation context.
+        items: Per-module items selected for this host.
+        config: The shared `config` mapping from dependencies.yaml.
+
+    Returns:
+        The process exit code: 0 when converged, 1 on drift.
+    """
+    start = time.monotonic()
+    actions = list(dict.fromkeys(a for m in items for a in m.actions))
+
+    probes: dict[str, Callable[[], Any]] = {
+        "packages": lambda: installed_system_packages(ctx),
+        "casks": lambda: installed_casks(ctx),
+        "pip": installed_pip_distributions,
+        "npm": lambda: npm_global_root(ctx, config),
+        "cargo": lambda: installed_cargo_crates(ctx),
+        "rustup_components": lambda: installed_rustup_components(ctx),
+    }
+    checks = action_checks() if actions else {}
+    for action in actions:
+        check = checks.get(action)
+        if check is not None:
+            probes[f"action:{action}"] = lambda check=check: check(ctx, config) or ""
+
+    with ThreadPoolExecutor(max_workers=min(16, len(probes))) as pool:
+        futures = {name: pool.submit(fn) for name, fn in probes.items()}
+        inventory = {}
+        for name, future in futures.items():
+            try:
+                inventory[name] = future.result()
+            except Exception as e:  # a broken probe is drift, not a crash
+                inventory[name] = e
+
+    records: list[dict[str, Any]] = []
+
+    def record(module: str, kind: str, item: str, ok: bool, detail: str = "") -> None:
+        entry: dict[str, Any] = {"module": module, "kind": kind, "item": item, "ok": ok}
+        if detail:
+            entry["detail"] = detail
+        records.append(entry)
+
+    def in_inventory(name: str, inv: Any) -> tuple[bool, str]:
+        if isinstance(inv, Exception):
+            return False, f"query failed: {inv}"
+        if inv is None:
+            return False, "package manager not available"
+        return name in inv, ""
+
+    pipx_root = pipx_venv_root(ctx)
+    gobin = go_bin_dir(ctx)
+    seen_actions: set[str] = set()
+    for module in items:
+        for entry in module.packages:
+            options = entry.options if isinstance(entry, AnyOf) else (entry,)
+            found = [o for o in options if in_inventory(o, inventory["packages"])[0]]
+            _, detail = in_inventory(options[0], inventory["packages"])
+            label = " | ".join(options)
+            record(module.name, ctx.manager, label, bool(found), detail)
+        for cask in module.casks:
+            ok, detail = in_inventory(cask, inventory["casks"])
+            record(module.name, "cask", cask, ok, detail)
+        for pkg in module.pip:
+            name = normalize_dist_name(re.split(r"[<>=!~\[; ]", pkg, 1)[0])
+            ok, detail = in_inventory(name, inventory["pip"])
+            record(module.name, "pip", pkg, ok, detail)
+        for item in module.pipx:
+            record(module.name, "pipx", item.name, (pipx_root / item.name).is_dir())
+        for pkg in module.npm:
+            root = inventory["npm"]
+            name = pkg.rsplit("@", 1)[0] if pkg.rfind("@") > 0 else pkg
+            if isinstance(root, Path):
+                record(module.name, "npm", pkg, (root / name).is_dir())
+            else:
+                record(module.name, "npm", pkg, False, "npm global root not found")
+        for pkg in module.go:
+            record(module.name, "go", pkg, (gobin / go_binary_name(pkg)).exists())
+        for crate in module.cargo:
+            ok, detail = in_inventory(crate, inventory["cargo"])
+            record(module.name, "cargo", crate, ok, detail)
+        for component in module.rustup_components:
+            ok, detail = in_inventory(component, inventory["rustup_components"])
+            record(module.name, "rustup_component", component, ok, detail)
+        for tool in module.dotnet_tools:
+            record(module.name, "dotnet_tool", tool, dotnet_tool_installed(ctx, tool))
+        for binary in module.binaries:
+            ok = file_matches_sha256(binary_dest(ctx, binary), binary.sha256)
+            record(module.name, "binary", binary.name, ok)
+        for action in module.actions:
+            if action in seen_actions:
+                continue
+            seen_actions.add(action)
+            result = inventory.get(f"action:{action}")
+            if result is None:
+                record(module.name, "action", action, True, "no postcondition")
+            elif isinstance(result, Exception):
+                record(module.name, "action", action, False, f"check failed: {result}")
+            else:
+                record(module.name, "action", action, not result, result)
+
+    drift = sum(1 for r in records if not r["ok"])
+    out = sys.stdout
+    for r in records:
+        out.write(json.dumps(r, separators=(",", ":")) + "\n")
+    summary = {
+        "summary": True,
+        "platform": ctx.platform_key,
+        "checked": len(records),
+        "drift": drift,
+        "seconds": round(time.monotonic() - start, 3),
+    }
+    out.write(json.dumps(summary, separators=(",", ":")) + "\n")
+    out.flush()
+    return 1 if drift else 0
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+"""
+File watching and plan deltas for `setup/install.py watch`.
+
+`watch` keeps one process (with PyYAML and the action modules imported)
+running. Each save of `dependencies.yaml` or `install_actions.py` applies
+only what changed:
+
+  - items newly selected by any module (packages, pip, npm, ...)
+  - actions newly selected, whose `config` sections changed, or whose
+    source changed
+
+Items that are no longer selected are reported, never uninstalled.
+
+On Linux, changes are picked up through inotify (via libc, so no extra
+dependency). Elsewhere the files are polled.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import inspect
+import linecache
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Any, Protocol
+
+from install_core import SELECTOR_KINDS, ModuleItems, action_registry
+
+# Every list-valued field of `ModuleItems`.
+ITEM_KINDS = ("packages", "casks", *SELECTOR_KINDS)
+
+# ---------------------------------- Watchers ---------------------------------
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# Editors either rewrite a file in place or rename a new copy over it.
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Watcher(Protocol):
+    def wait(self, timeout: float | None) -> set[str]:
+        """Block until a watched file changes and return the changed names.
+
+        Returns an empty set if `timeout` seconds pass without a change.
+        """
+        ...
+
+
+class InotifyWatcher:
+    """Watch files through Linux inotify, one watch per parent directory."""
+
+    def __init__(self, paths: list[Path]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._names: dict[int, set[str]] = {}
+        for directory in {p.parent for p in paths}:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {directory}")
+            self._names[wd] = {p.name for p in paths if p.parent == directory}
+
+    def wait(self, timeout: float | None) -> set[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed: set[str] = set()
+        while True:
+            try:
+                buf = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                wd, _, _, length = EVENT_HEADER.unpack_from(buf, offset)
+                start = offset + EVENT_HEADER.size
+                name = os.fsdecode(buf[start : start + length].rstrip(b"\0"))
+                offset = start + length
+                if name in self._names.get(wd, ()):
+                    changed.add(name)
+
+
+class PollWatcher:
+    """Watch files by polling their mtime and size."""
+
+    def __init__(self, paths: list[Path], interval: float) -> None:
+        self._paths = paths
+        self._interval = interval
+        self._stamps = {p: self._stamp(p) for p in paths}
+
+    @staticmethod
+    def _stamp(path: Path) -> tuple[int, int] | None:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def wait(self, timeout: float | None) -> set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self._paths:
+                stamp = self._stamp(path)
+                if stamp != self._stamps[path]:
+                    self._stamps[path] = stamp
+                    changed.add(path.name)
+            if changed:
+                return changed
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return set()
+            time.sleep(delay)
+
+
+def open_watcher(paths: list[Path], *, interval: float) -> Watcher:
+    """Return an inotify watcher on Linux, else (or if it fails) a poller."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher(paths, interval)
+
+
+def wait_for_changes(watcher: Watcher, *, settle: float = 0.2) -> set[str]:
+    """Wait for a change, then until no further change arrives for `settle` s.
+
+    Editors often write a file in several steps; this applies them as one.
+    """
+    changed = watcher.wait(None)
+    while True:
+        more = watcher.wait(settle)
+        if not more:
+            return changed
+        changed |= more
+
+
+# ---------------------------------- Deltas -----------------------------------
+
+
+def action_sources() -> dict[str, str]:
+    """Return the source of every registered action, as loaded right now."""
+    linecache.checkcache()
+    return {name: inspect.getsource(fn) for name, fn in action_registry().items()}
+
+
+def changed_actions(
+    before: dict[str, Any],
+    after: dict[str, Any],
+    config_keys: dict[str, tuple[str, ...]],
+) -> set[str]:
+    """Return the actions that read a `config` section that differs."""
+    changed = {k for k in before.keys() | after.keys() if before.get(k) != after.get(k)}
+    return {name for name, keys in config_keys.items() if changed.intersection(keys)}
+
+
+def delta_items(
+    before: list[ModuleItems], after: list[ModuleItems], rerun: set[str]
+) -> list[ModuleItems]:
+    """Return, per module, the items of `after` that `before` did not select.
+
+    Items are compared across modules, so moving one between modules installs
+    nothing. Actions in `rerun` are included even if already selected.
+    """
+    seen = {kind: {x for m in before for x in getattr(m, kind)} for kind in ITEM_KINDS}
+    out = []
+    for module in after:
+        delta = ModuleItems(name=module.name)
+        for kind in ITEM_KINDS:
+            getattr(delta, kind).extend(
+                x
+                for x in getattr(module, kind)
+                if x not in seen[kind] or (kind == "actions" and x in rerun)
+            )
+        if any(getattr(delta, kind) for kind in ITEM_KINDS):
+            out.append(delta)
+    return out
+
+
+def removed_items(
+    before: list[ModuleItems], after: list[ModuleItems]
+) -> dict[str, list[Any]]:
+    """Return `kind -> items` selected by `before` but no longer by `after`."""
+    out = {}
+    for kind in ITEM_KINDS:
+        kept = {x for m in after for x in getattr(m, kind)}
+        gone = list(
+            dict.fromkeys(x for m in before for x in getattr(m, kind) if x not in kept)
+        )
+        if gone:
+            out[kind] = gone
+    return out
@@ -1,9 +1,16 @@
 import os
 import os.path
 import fnmatch
+import hashlib
+import json
 import logging
+import queue
+import sqlite3
+import threading
+import time
 import ycm_core
 import re
+import sys
 
 BASE_FLAGS = [
         '-Wall',
@@ -45,6 +52,59 @@ HEADER_DIRECTORIES = [
         'include'
         ]
 
+# Flags survive editor restarts in this database. Rows are keyed by file and
+# invalidated whenever the compilation database (or include tree) they were
+# derived from changes path or mtime, the nearest .clang_complete changes, or
+# this file (and so BASE_FLAGS) is edited.
+FLAG_CACHE_PATH = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'ycm',
+        'flags.sqlite3')
+
+_flag_cache = None
+_flag_cache_lock = threading.Lock()
+
+# Prewarming stores thousands of rows; they are committed in transactions of
+# this many rows instead of one commit (and fsync) per file.
+FLAG_CACHE_BATCH = 256
+_pending_flag_rows = []
+
+# An include tree's mtime is the newest of its directories', so adding or
+# removing a header anywhere in it invalidates the flags derived from it.
+# Walking the tree is reused for this many seconds.
+INCLUDE_MTIME_TTL = 2.0
+_include_mtimes = {}
+_include_mtimes_lock = threading.Lock()
+_include_flags = {}
+
+# Number of background threads that compute flags for the rest of a project
+# (one with a compile_commands.json) once its first file is opened. Set to 0
+# to disable prewarming.
+PREWARM_WORKERS = 4
+
+# Directories that never contain files worth prewarming.
+PREWARM_SKIP_DIRECTORIES = [
+        '.git',
+        '.hg',
+        '.svn',
+        'node_modules'
+        ]
+
+# Thousands of translation units usually share the same handful of flag
+# lists, so every flag list is stored once as an interned tuple and shared by
+# all files (and rewrites) that produce it.
+_interned_flags = {}
+_absolute_flags = {}
+_interned_flags_lock = threading.Lock()
+
+_warm_flags = {}
+_conf_hash = None
+_compilation_dbs = {}
+_compilation_dbs_lock = threading.Lock()
+_prewarm_queue = None
+_prewarm_lock = threading.Lock()
+_prewarmed_sources = set()
+
 def IsHeaderFile(filename):
     extension = os.path.splitext(filename)[1]
     return extension in HEADER_EXTENSIONS
@@ -70,7 +130,7 @@ def GetCompilationInfoForFile(database, filename):
         return None
     return database.GetCompilationInfoForFile(filename)
 
-def FindNearest(path, target, build_folder):
+def FindNearest(path, target, build_folder=None):
     candidate = os.path.join(path, target)
     if(os.path.isfile(candidate) or os.path.isdir(candidate)):
         logging.info("Found nearest " + target + " at " + candidate)
@@ -88,7 +148,22 @@ def FindNearest(path, target, build_folder):
 
     return FindNearest(parent, target, build_folder)
 
+def InternFlags(flags):
+    flags = tuple(sys.intern(str(flag)) for flag in flags)
+    with _interned_flags_lock:
+        return _interned_flags.setdefault(flags, flags)
+
 def MakeRelativePathsInFlagsAbsolute(flags, working_directory):
+    flags = InternFlags(flags)
+    key = (flags, working_directory)
+    absolute_flags = _absolute_flags.get(key)
+    if absolute_flags is None:
+        absolute_flags = InternFlags(
+                RewriteRelativePathsInFlags(flags, working_directory))
+        _absolute_flags[key] = absolute_flags
+    return absolute_flags
+
+def RewriteRelativePathsInFlags(flags, working_directory):
     if not working_directory:
         return list(flags)
     new_flags = []
@@ -128,23 +203,162 @@ def FlagsForClangComplete(root):
 def FlagsForInclude(root):
     try:
         include_path = FindNearest(root, 'include')
+        mtime = IncludeTreeMTime(include_path)
+        cached = _include_flags.get(include_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
         flags = []
         for dirroot, dirnames, filenames in os.walk(include_path):
             for dir_path in dirnames:
                 real_path = os.path.join(dirroot, dir_path)
-                flags = flags + ["-I" + real_path]
+                flags.append("-I" + real_path)
+        _include_flags[include_path] = (mtime, flags)
         return flags
     except:
         return None
 
-def FlagsForCompilationDatabase(root, filename):
+def OpenFlagCache():
+    global _flag_cache
+    if _flag_cache is None:
+        try:
+            cache_dir = os.path.dirname(FLAG_CACHE_PATH)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            _flag_cache = sqlite3.connect(FLAG_CACHE_PATH, check_same_thread=False)
+            # Rows keyed by mtime alone (the first layout) are never valid.
+            _flag_cache.execute('DROP TABLE IF EXISTS flags')
+            _flag_cache.execute(
+                    'CREATE TABLE IF NOT EXISTS flag_rows ('
+                    'filename TEXT PRIMARY KEY, '
+                    'source TEXT NOT NULL, '
+                    'stamp TEXT NOT NULL, '
+                    'flags TEXT NOT NULL)')
+            _flag_cache.commit()
+        except (OSError, sqlite3.Error) as e:
+            logging.info("Persistent flag cache disabled: " + str(e))
+            _flag_cache = False
+    return _flag_cache or None
+
+def LoadCachedFlags(filename, source, stamp):
+    with _flag_cache_lock:
+        cache = OpenFlagCache()
+        if not cache:
+            return None
+        try:
+            row = cache.execute(
+                    'SELECT flags FROM flag_rows WHERE filename = ? AND source = ? AND stamp = ?',
+                    (filename, source, stamp)).fetchone()
+        except sqlite3.Error:
+            return None
+    if not row:
+        return None
+    logging.info("Loaded cached flags for " + filename)
+    return InternFlags(json.loads(row[0]))
+
+def StoreCachedFlags(filename, source, stamp, flags, batch=False):
+    with _flag_cache_lock:
+        _pending_flag_rows.append((filename, source, stamp, json.dumps(list(flags))))
+        if batch and len(_pending_flag_rows) < FLAG_CACHE_BATCH:
+            return
+        WritePendingFlags()
+
+def FlushCachedFlags():
+    with _flag_cache_lock:
+        WritePendingFlags()
+
+def WritePendingFlags():
+    # Callers hold _flag_cache_lock.
+    cache = OpenFlagCache()
+    rows = list(_pending_flag_rows)
+    del _pending_flag_rows[:]
+    if not cache or not rows:
+        return
     try:
-        # Last argument of next function is the name of the build folder for
-        # out of source projects
-        compilation_db_path = FindNearest(root, 'compile_commands.json', 'build')
-        compilation_db_dir = os.path.dirname(compilation_db_path)
+        with cache:
+            cache.executemany('INSERT OR REPLACE INTO flag_rows VALUES (?, ?, ?, ?)', rows)
+    except sqlite3.Error as e:
+        logging.info("Unable to store " + str(len(rows)) + " cached flags: " + str(e))
+
+def FindFlagSource(root):
+    # Last argument of next function is the name of the build folder for
+    # out of source projects
+    for target, build_folder in (('compile_commands.json', 'build'), ('include', None)):
+        try:
+            return FindNearest(root, target, build_folder)
+        except RuntimeError:
+            continue
+    return None
+
+def IncludeTreeMTime(include_path):
+    now = time.monotonic()
+    with _include_mtimes_lock:
+        cached = _include_mtimes.get(include_path)
+        if cached and now - cached[0] < INCLUDE_MTIME_TTL:
+            return cached[1]
+    newest = os.path.getmtime(include_path)
+    for dirroot, dirnames, filenames in os.walk(include_path):
+        for dir_path in dirnames:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(dirroot, dir_path)))
+            except OSError:
+                continue
+    with _include_mtimes_lock:
+        _include_mtimes[include_path] = (now, newest)
+    return newest
+
+def FlagSourceForFile(root):
+    source = FindFlagSource(root)
+    try:
+        if not source:
+            mtime = None
+        elif os.path.isdir(source):
+            mtime = IncludeTreeMTime(source)
+        else:
+            mtime = os.path.getmtime(source)
+    except OSError:
+        mtime = None
+    return source, mtime
+
+def ConfHash():
+    # Changes whenever this file (and so BASE_FLAGS) is edited.
+    global _conf_hash
+    if _conf_hash is None:
+        digest = hashlib.sha1(json.dumps(BASE_FLAGS).encode('utf-8'))
+        try:
+            with open(os.path.realpath(__file__), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            pass
+        _conf_hash = digest.hexdigest()
+    return _conf_hash
+
+def FlagStamp(root, mtime):
+    # Everything the flags computed for `root` depend on besides their source
+    # path, or None when there is no flag source to key them on.
+    if mtime is None:
+        return None
+    try:
+        clang_complete_mtime = os.path.getmtime(FindNearest(root, '.clang_complete'))
+    except (OSError, RuntimeError):
+        clang_complete_mtime = None
+    return json.dumps([mtime, clang_complete_mtime, ConfHash()])
+
+def LoadCompilationDatabase(compilation_db_dir, mtime):
+    # Prewarming asks for flags of thousands of files from the same database,
+    # so keep the loaded database around until it changes on disk.
+    with _compilation_dbs_lock:
+        loaded = _compilation_dbs.get(compilation_db_dir)
+        if loaded and loaded[0] == mtime:
+            return loaded[1]
         logging.info("Set compilation database directory to " + compilation_db_dir)
-        compilation_db =  ycm_core.CompilationDatabase(compilation_db_dir)
+        compilation_db = ycm_core.CompilationDatabase(compilation_db_dir)
+        _compilation_dbs[compilation_db_dir] = (mtime, compilation_db)
+        return compilation_db
+
+def FlagsForCompilationDatabase(compilation_db_path, filename, mtime=None):
+    try:
+        compilation_db_dir = os.path.dirname(compilation_db_path)
+        compilation_db = LoadCompilationDatabase(compilation_db_dir, mtime)
         if not compilation_db:
             logging.info("Compilation database file found but unable to load")
             return None
@@ -158,9 +372,13 @@ def FlagsForCompilationDatabase(root, filename):
     except:
         return None
 
-def FlagsForFile(filename):
-    root = os.path.realpath(filename);
-    compilation_db_flags = FlagsForCompilationDatabase(root, filename)
+def IsCompilationDatabase(source):
+    return bool(source) and os.path.basename(source) == 'compile_commands.json'
+
+def ComputeFlagsForFile(root, filename, source, mtime=None):
+    compilation_db_flags = None
+    if IsCompilationDatabase(source):
+        compilation_db_flags = FlagsForCompilationDatabase(source, filename, mtime)
     if compilation_db_flags:
         final_flags = compilation_db_flags
     else:
@@ -171,6 +389,109 @@ def FlagsForFile(filename):
         include_flags = FlagsForInclude(root)
         if include_flags:
             final_flags = final_flags + include_flags
+    return InternFlags(final_flags)
+
+def WarmFlagsForFile(root, filename, source, mtime, batch=False):
+    stamp = FlagStamp(root, mtime)
+    if stamp is None:
+        # Nothing to tell when these flags go stale, so never reuse them.
+        return ComputeFlagsForFile(root, filename, source, mtime)
+    warm = _warm_flags.get(root)
+    if warm and warm[0] == source and warm[1] == stamp:
+        return warm[2]
+
+    final_flags = LoadCachedFlags(root, source, stamp)
+    if final_flags is None:
+        final_flags = ComputeFlagsForFile(root, filename, source, mtime)
+        StoreCachedFlags(root, source, stamp, final_flags, batch)
+    _warm_flags[root] = (source, stamp, final_flags)
+    return final_flags
+
+def ProjectRootForSource(source):
+    project_root = os.path.dirname(source)
+    if os.path.basename(project_root) == 'build':
+        project_root = os.path.dirname(project_root)
+    return os.path.realpath(project_root)
+
+def IsPrewarmRoot(project_root):
+    # A compile_commands.json found in $HOME or / would mean walking all of it.
+    return project_root not in (os.path.realpath(os.path.expanduser('~')), '/')
+
+def ProjectFilesForSource(source):
+    files = set()
+    try:
+        with open(source, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        entries = []
+    for entry in entries:
+        if isinstance(entry, dict) and entry.get('file'):
+            files.add(os.path.realpath(
+                os.path.join(entry.get('directory', ''), entry['file'])))
+
+    # Headers are not in the compilation database; find them in the project.
+    for dirroot, dirnames, filenames in os.walk(ProjectRootForSource(source)):
+        dirnames[:] = [d for d in dirnames if d not in PREWARM_SKIP_DIRECTORIES]
+        for name in filenames:
+            if os.path.splitext(name)[1] in HEADER_EXTENSIONS:
+                files.add(os.path.realpath(os.path.join(dirroot, name)))
+
+    # Most recently modified files are the ones most likely to be opened next.
+    def MTime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+    return sorted(files, key=MTime, reverse=True)
+
+def PrewarmWorker():
+    while True:
+        path = _prewarm_queue.get()
+        try:
+            if path not in _warm_flags:
+                source, mtime = FlagSourceForFile(path)
+                WarmFlagsForFile(path, path, source, mtime, batch=True)
+        except Exception as e:
+            logging.info("Prewarming flags for " + path + " failed: " + str(e))
+        finally:
+            _prewarm_queue.task_done()
+
+def PrewarmProject(source):
+    for path in ProjectFilesForSource(source):
+        _prewarm_queue.put(path)
+    _prewarm_queue.join()
+    FlushCachedFlags()
+
+def StartPrewarm(source, mtime):
+    # Only compilation databases bound a project; an include directory's
+    # parent may be anything up to / (e.g. for /usr/include).
+    global _prewarm_queue
+    if PREWARM_WORKERS <= 0 or mtime is None or not IsCompilationDatabase(source):
+        return
+    if not IsPrewarmRoot(ProjectRootForSource(source)):
+        logging.info("Not prewarming flags under " + ProjectRootForSource(source))
+        return
+    with _prewarm_lock:
+        if (source, mtime) in _prewarmed_sources:
+            return
+        _prewarmed_sources.add((source, mtime))
+        if _prewarm_queue is None:
+            _prewarm_queue = queue.Queue()
+            # Daemon threads so a pending backlog never delays ycmd shutdown.
+            for _ in range(PREWARM_WORKERS):
+                worker = threading.Thread(target=PrewarmWorker)
+                worker.daemon = True
+                worker.start()
+    logging.info("Prewarming flags for project of " + source)
+    walker = threading.Thread(target=PrewarmProject, args=(source,))
+    walker.daemon = True
+    walker.start()
+
+def FlagsForFile(filename):
+    root = os.path.realpath(filename);
+    source, mtime = FlagSourceForFile(root)
+    final_flags = WarmFlagsForFile(root, filename, source, mtime)
+    StartPrewarm(source, mtime)
     return {
             'flags': final_flags,
             'do_cache': True
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+Latency benchmark for `.vim/.ycm_extra_conf.py`.
+
+ycmd calls `FlagsForFile` for every buffer it opens, so this script measures
+it outside of ycmd. A stub `ycm_core` module stands in for the real one and
+serves flags from `compile_commands.json`, and a synthetic project tree is
+generated (deep directories, many sources/headers, a large `include` tree and
+a big compilation database) to exercise the same filesystem walks as a real
+project.
+
+Three paths are reported as p50/p99 latencies:
+  - cold: first lookup of each file with an empty on-disk flag cache
+  - disk: first lookup after an editor restart (on-disk cache populated)
+  - warm: repeated lookups within the same ycmd process
+
+Usage:
+  python3 .vim/ycm_extra_conf_bench.py --sources 20000 --headers 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from typing import Any, Callable
+
+EXTRA_CONF = Path(__file__).resolve().parent / ".ycm_extra_conf.py"
+
+
+# ------------------------------ ycm_core Stub -------------------------------
+
+
+class CompilationInfo:
+    """Mirror of ycm_core's CompilationInfoForFile."""
+
+    def __init__(self, flags: list[str], working_dir: str) -> None:
+        self.compiler_flags_ = flags
+        self.compiler_working_dir_ = working_dir
+
+
+class CompilationDatabase:
+    """Mirror of ycm_core.CompilationDatabase backed by `json.load`."""
+
+    def __init__(self, database_dir: str) -> None:
+        path = os.path.join(database_dir, "compile_commands.json")
+        self._entries: dict[str, tuple[list[str], str]] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                directory = entry.get("directory", "")
+                filename = os.path.realpath(os.path.join(directory, entry["file"]))
+                self._entries[filename] = (entry["arguments"][1:], directory)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def GetCompilationInfoForFile(self, filename: str) -> CompilationInfo:  # noqa: N802
+        flags, directory = self._entries.get(os.path.realpath(filename), ([], ""))
+        return CompilationInfo(flags, directory)
+
+
+def install_ycm_core_stub() -> None:
+    """Register the stub as `ycm_core` so the extra conf imports it."""
+    module = types.ModuleType("ycm_core")
+    module.CompilationDatabase = CompilationDatabase  # type: ignore[attr-defined]
+    sys.modules["ycm_core"] = module
+
+
+def load_extra_conf(cache_dir: Path, *, prewarm_workers: int) -> Any:
+    """Import a fresh copy of the extra conf, as a restarted ycmd would."""
+    os.environ["XDG_CACHE_HOME"] = str(cache_dir)
+    spec = importlib.util.spec_from_file_location("ycm_extra_conf", EXTRA_CONF)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.PREWARM_WORKERS = prewarm_workers
+    return module
+
+
+# ------------------------------ Project Builder -----------------------------
+
+
+def generate_project(
+    root: Path,
+    *,
+    sources: int,
+    headers: int,
+    depth: int,
+    include_dirs: int,
+    flags_per_tu: int,
+) -> tuple[list[Path], list[Path]]:
+    """Generate a synthetic C++ project and its `build/compile_commands.json`.
+
+    Returns:
+        The generated source and header paths.
+    """
+    rng = random.Random(0)
+
+    def nested(base: Path, index: int) -> Path:
+        parts = [f"d{(index >> (2 * level)) % 4}" for level in range(depth)]
+        return base.joinpath(*parts)
+
+    include_root = root / "include"
+    include_paths = []
+    for i in range(include_dirs):
+        path = nested(include_root, i) / f"module{i}"
+        path.mkdir(parents=True, exist_ok=True)
+        include_paths.append(path)
+
+    header_paths = []
+    for i in range(headers):
+        path = include_paths[i % len(include_paths)] / f"header{i}.hpp"
+        path.touch()
+        header_paths.append(path)
+
+    # A handful of distinct flag sets shared across many translation units,
+    # as produced by real build systems for targets with common settings.
+    flag_sets = []
+    for target in range(8):
+        flags = ["-std=c++17", "-Wall", "-Wextra", f"-DTARGET={target}"]
+        sampled = rng.sample(include_paths, min(8, len(include_paths)))
+        flags += [f"-I{p.relative_to(root)}" for p in sampled]
+        flags += [f"-DFEATURE_{target}_{n}=1" for n in range(flags_per_tu)]
+        flag_sets.append(flags)
+
+    source_paths = []
+    entries = []
+    for i in range(sources):
+        directory = nested(root / "src", i)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"source{i}.cpp"
+        path.touch()
+        source_paths.append(path)
+        relative = str(path.relative_to(root))
+        entries.append(
+            {
+                "directory": str(root),
+                "file": relative,
+                "arguments": ["c++", *flag_sets[i % len(flag_sets)], "-c", relative],
+            }
+        )
+
+    build_dir = root / "build"
+    build_dir.mkdir(exist_ok=True)
+    with (build_dir / "compile_commands.json").open("w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    return source_paths, header_paths
+
+
+# -------------------------------- Measuring ---------------------------------
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Return the nearest-rank percentile of `samples`."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def time_calls(fn: Callable[[str], Any], files: list[Path]) -> list[float]:
+    """Time `fn` once per file and return the latencies in milliseconds."""
+    out = []
+    for path in files:
+        start = time.perf_counter()
+        fn(str(path))
+        out.append((time.perf_counter() - start) * 1000)
+    return out
+
+
+def report(name: str, samples: list[float]) -> None:
+    print(
+        f"{name:<6} n={len(samples):<6} "
+        f"p50={percentile(samples, 50):8.3f}ms "
+        f"p99={percentile(samples, 99):8.3f}ms "
+        f"max={max(samples):8.3f}ms"
+    )
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sources", type=int, default=20000)
+    parser.add_argument("--headers", type=int, default=20000)
+    parser.add_argument("--depth", type=int, default=6, help="Directory nesting depth")
+    parser.add_argument("--include-dirs", type=int, default=512)
+    parser.add_argument("--flags-per-tu", type=int, default=200)
+    parser.add_argument(
+        "--samples", type=int, default=500, help="Files looked up per measured path"
+    )
+    parser.add_argument(
+        "--prewarm-workers",
+        type=int,
+        default=0,
+        help="Background prewarm threads (0 measures lookups in isolation)",
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tree")
+    args = parser.parse_args(argv)
+
+    install_ycm_core_stub()
+    workdir = Path(tempfile.mkdtemp(prefix="ycm-bench-"))
+    root = workdir / "project"
+    cache_dir = workdir / "cache"
+
+    start = time.perf_counter()
+    sources, headers = generate_project(
+        root,
+        sources=args.sources,
+        headers=args.headers,
+        depth=args.depth,
+        include_dirs=args.include_dirs,
+        flags_per_tu=args.flags_per_tu,
+    )
+    print(
+        f"generated {len(sources)} sources, {len(headers)} headers in "
+        f"{time.perf_counter() - start:.1f}s under {root}"
+    )
+
+    rng = random.Random(1)
+    files = rng.sample(sources + headers, min(args.samples, len(sources) + len(headers)))
+
+    conf = load_extra_conf(cache_dir, prewarm_workers=args.prewarm_workers)
+    first = time_calls(conf.FlagsForFile, files[:1])
+    cold = first + time_calls(conf.FlagsForFile, files[1:])
+    warm = time_calls(conf.FlagsForFile, files)
+
+    restarted = load_extra_conf(cache_dir, prewarm_workers=args.prewarm_workers)
+    disk = time_calls(restarted.FlagsForFile, files)
+
+    print(f"first  {first[0]:8.3f}ms (includes loading the compilation database)")
+    report("cold", cold)
+    report("disk", disk)
+    report("warm", warm)
+
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))